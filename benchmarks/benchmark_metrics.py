@@ -0,0 +1,129 @@
+"""
+Measures the runtime and peak memory usage of every distance function over a sweep of data sizes, \
+and compares them with a stored baseline, so that the effect of performance work (and any regressions) can be measured.
+Peak memory usage is the peak size of the memory blocks allocated during the computation, as traced by tracemalloc \
+(NumPy reports its array allocations to tracemalloc).
+
+Run with: python benchmarks/benchmark_metrics.py
+Store the results as the new baseline with: python benchmarks/benchmark_metrics.py --save
+Only run some of the metrics with: python benchmarks/benchmark_metrics.py --metrics pearson ys1
+
+The committed baseline (benchmarks/baseline_metrics.json) records the environment it was measured in \
+under the key '_environment'. Peak memory usage is comparable across machines, but runtimes are only comparable \
+on the same machine. To check a change for regressions in CI, measure the baseline and the change on the same runner:
+    git checkout <base commit> && python benchmarks/benchmark_metrics.py --save --baseline /tmp/baseline.json
+    git checkout <head commit> && python benchmarks/benchmark_metrics.py --baseline /tmp/baseline.json
+The second command exits with status 1 if any case regressed.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from pairwisedist import pairwisedist
+
+METRICS = {'pearson': pairwisedist.pearson_distance,
+           'spearman': pairwisedist.spearman_distance,
+           'jackknife': pairwisedist.jackknife_distance,
+           'ys1': pairwisedist.ys1_distance,
+           'yr1': pairwisedist.yr1_distance,
+           'sharpened_cosine': pairwisedist.sharpened_cosine_distance}
+# (n samples, p features) pairs to sweep. Jackknife distance is O(p*n^2), so it is swept over fewer features.
+SIZES = [(500, 20), (500, 200), (2000, 20), (2000, 200)]
+JACKKNIFE_SIZES = [(500, 10), (500, 50), (2000, 10), (2000, 50)]
+N_REPEATS = 3
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline_metrics.json')
+# a case is reported as a regression if it is slower (or uses more memory) than the baseline by more than this factor
+TOLERANCE = 1.2
+
+
+def measure(func, data) -> dict:
+    """
+    Returns the best wall time (in seconds) of N_REPEATS calls of func(data), \
+    and the peak memory (in bytes) allocated during a single call.
+    """
+    func(data)  # warm-up
+    seconds = min(timeit.repeat(lambda: func(data), number=1, repeat=N_REPEATS))
+    tracemalloc.start()
+    func(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': seconds, 'peak_bytes': peak}
+
+
+def environment() -> dict:
+    """
+    Returns a description of the environment the benchmark runs in, which is stored with the baseline.
+    """
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(), 'numba': pairwisedist._NUMBA_ENABLED}
+
+
+def run(metrics) -> dict:
+    rng = np.random.default_rng(0)
+    results = {}
+    for metric in metrics:
+        for n_samples, n_features in (JACKKNIFE_SIZES if metric == 'jackknife' else SIZES):
+            data = rng.normal(size=(n_samples, n_features))
+            name = f'{metric} n={n_samples} p={n_features}'
+            results[name] = measure(METRICS[metric], data)
+            print(f"{name}: {results[name]['seconds']:.3f}s, peak {results[name]['peak_bytes'] / 2 ** 20:.1f} MiB")
+    return results
+
+
+def compare(results: dict, baseline: dict) -> bool:
+    """
+    Prints the ratio between every result and its baseline, and returns True if any result regressed.
+    """
+    regressed = False
+    if baseline.get('_environment', environment()) != environment():
+        print(f"\nThe baseline was measured in a different environment, so runtimes may not be comparable:\n"
+              f"    baseline: {baseline['_environment']}\n    current:  {environment()}")
+    print(f"\nComparison with baseline (ratio > {TOLERANCE} is reported as a regression):")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"    {name}: no baseline")
+            continue
+        time_ratio = result['seconds'] / baseline[name]['seconds']
+        memory_ratio = result['peak_bytes'] / max(baseline[name]['peak_bytes'], 1)
+        flag = ''
+        if time_ratio > TOLERANCE or memory_ratio > TOLERANCE:
+            flag = '  <-- REGRESSION'
+            regressed = True
+        print(f"    {name}: time x{time_ratio:.2f}, memory x{memory_ratio:.2f}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--metrics', nargs='+', choices=sorted(METRICS), default=list(METRICS))
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='path of the baseline .json file')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args()
+
+    results = run(args.metrics)
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        baseline.update(results)
+        baseline['_environment'] = environment()
+        with open(args.baseline, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            regressed = compare(results, json.load(file))
+        sys.exit(1 if regressed else 0)
+    else:
+        print(f"\nNo baseline found at {args.baseline}. Run with --save to store one.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,93 +1,2079 @@
+import os
+import json
+import time
+import inspect
+import tracemalloc
+import threading
+import functools
+import contextlib
+import multiprocessing
 import numpy as np
-from scipy.stats.mstats import rankdata
-from typing import Union
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, NamedTuple, Tuple, Union
+from scipy import sparse
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # pragma: no cover
+    threadpool_limits = None
+
+try:
+    import numba
+except ImportError:  # pragma: no cover
+    numba = None
+
+_DEFAULT_BLOCK_SIZE = 1024
 
 __all__ = ['pearson_distance', 'spearman_distance', 'jackknife_distance', 'ys1_distance', 'yr1_distance',
-           'sharpened_cosine_distance']
+           'sharpened_cosine_distance', 'iter_distance_blocks', 'DistanceContext', 'ys1_distance_sweep',
+           'yr1_distance_sweep', 'pairwise_topk', 'cross_distance', 'PreparedReference',
+           'IncrementalDistanceMatrix', 'PearsonAccumulator', 'similarity_graph', 'out_of_core_distance',
+           'iter_distance_batches', 'Profiler', 'StageRecord', 'pairwise_distance', 'plan_distance',
+           'register_metric', 'ExecutionPlan']
+
+
+class _Metric(NamedTuple):
+    """
+    The building blocks of a pairwise metric. \
+    'prepare' receives an n-by-p array and a floating-point dtype, and returns a tuple of arrays \
+    (whose floating-point arrays are of that dtype) whose first axis is aligned with the samples \
+    (rows) of the array. Since every sample is prepared independently of the others, the prepared tuple of any \
+    subset of samples is obtained by indexing every array in the tuple. \
+    'kernel' receives two prepared tuples (of m and k samples) and keyword parameters, \
+    and returns the m-by-k similarity tile between them. \
+    The kernels of dense metrics also accept prepared tuples with a leading batch axis \
+    (arrays of shape (b, m, ...) and (b, k, ...)), and return the b-by-m-by-k stack of their similarity tiles. \
+    The optional 'sample_bound' receives a prepared tuple and the kernel's keyword parameters, and returns \
+    a bound u (between 0 and 1) for every sample, such that the similarity of samples i and j is at most \
+    (1 + u[i] * u[j]) / 2. It allows skipping tiles that cannot contain similarities above a threshold.
+    'tile_temporaries' is the approximate number of tile-sized arrays the kernel holds in memory at once \
+    (including the returned tile), and is used to estimate the peak memory usage of a computation.
+    """
+    prepare: Callable[[np.ndarray, np.dtype], tuple]
+    kernel: Callable[..., np.ndarray]
+    zero_diagonal: bool = False
+    sample_bound: Union[Callable[..., np.ndarray], None] = None
+    tile_temporaries: int = 2
+
+
+class StageRecord(NamedTuple):
+    """
+    A single call of an internal stage of a distance computation, as recorded by a Profiler.
+
+    :param function: the name of the public function the stage was called from \
+    (or None if it was called from elsewhere, for example from a DistanceContext).
+    :param stage: the name of the stage (for example 'rankdata', 'correlation_star_block' or 'minmax_match_block').
+    :param seconds: the wall time of the stage, including the stages it called. \
+    For public functions that return or yield results lazily, the 'total' stage is recorded when the results \
+    are exhausted, and includes only the time spent producing them (and not the time spent consuming them).
+    :param nbytes: the size (in bytes) of the arrays returned by the stage. \
+    This is the size of the output, and not the memory allocated by the stage (see 'allocated_bytes').
+    :param shapes: the shapes of the array arguments of the stage \
+    (for prepared tuples of samples, the shape of their first array).
+    :param allocated_bytes: the peak memory (in bytes) allocated during the stage, above the memory allocated \
+    when it started, as traced by tracemalloc. None unless the Profiler traces allocations.
+    """
+    function: Union[str, None]
+    stage: str
+    seconds: float
+    nbytes: int
+    shapes: Tuple[tuple, ...]
+    allocated_bytes: Union[int, None] = None
+
+
+class Profiler:
+    """
+    Records the wall time, output size and argument shapes of every internal stage of the distance computations \
+    (such as ranking, the correlation*, slope concordance and min-max match components, \
+    and the conversion from similarity to distance) that run while the profiler is active. \
+    Every public distance function is also recorded as a single 'total' stage. \
+    Use the profiler as a context manager::
+
+        with Profiler() as profiler:
+            ys1_distance(data)
+        profiler.summary()
+
+    When no profiler is active, every instrumented stage only checks whether a profiler is active, \
+    so the overhead of the instrumentation is negligible. \
+    Stages that run in worker processes (for example, with out_of_core_distance(n_workers > 1)) are not recorded.
+
+    :param callback: an optional function that is called with every StageRecord as soon as it is recorded \
+    (for example, to push the records into an external metrics system). \
+    Stages computed concurrently (with n_jobs > 1) may call it from several threads.
+    :type callback: function or None (default=None)
+    :param trace_allocations: if True, the peak memory allocated by every stage is traced with tracemalloc \
+    (which is started while the profiler is active, if it is not tracing already). \
+    Tracing allocations slows down the computation considerably. \
+    tracemalloc traces the memory of the entire process, so the allocations of stages that run concurrently \
+    (with n_jobs > 1) are attributed to all of them.
+    :type trace_allocations: bool (default=False)
+    """
+
+    def __init__(self, callback: Union[Callable[[StageRecord], None], None] = None, trace_allocations: bool = False):
+        self.callback = callback
+        self.trace_allocations = trace_allocations
+        self.records = []
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        _PROFILERS.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _PROFILERS.remove(self)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _record(self, record: StageRecord):
+        with self._lock:
+            self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def to_dicts(self) -> list:
+        """
+        Returns the recorded stages as a list of dictionaries, \
+        with the keys 'function', 'stage', 'seconds', 'nbytes', 'shapes' and 'allocated_bytes'.
+
+        :rtype: list of dict
+        """
+        return [record._asdict() for record in self.records]
+
+    def summary(self) -> dict:
+        """
+        Aggregates the recorded stages by public function and stage.
+
+        :return: a dictionary that maps every (function, stage) pair to a dictionary with the number of calls \
+        of the stage ('calls'), their total wall time ('seconds'), the total size of their outputs ('nbytes'), \
+        and (if allocations were traced) the largest peak memory allocated by any of the calls ('allocated_bytes').
+        :rtype: dict
+        """
+        summary = {}
+        for record in self.records:
+            entry = summary.setdefault((record.function, record.stage),
+                                       {'calls': 0, 'seconds': 0.0, 'nbytes': 0, 'allocated_bytes': None})
+            entry['calls'] += 1
+            entry['seconds'] += record.seconds
+            entry['nbytes'] += record.nbytes
+            if record.allocated_bytes is not None:
+                entry['allocated_bytes'] = max(entry['allocated_bytes'] or 0, record.allocated_bytes)
+        return summary
+
+
+_PROFILERS = []
+# the public function that is running in every thread (see _function_label()),
+# and the allocation measurements of the stages that are running in it (see _measure())
+_PROFILING = threading.local()
+
+
+def _nbytes(obj) -> int:
+    """
+    Returns the total size (in bytes) of an array, or of the arrays in a tuple.
+    """
+    if isinstance(obj, tuple):
+        return sum(_nbytes(item) for item in obj)
+    if sparse.issparse(obj):
+        return obj.data.nbytes + getattr(obj, 'indices', obj.data).nbytes
+    return getattr(obj, 'nbytes', 0)
+
+
+def _shape(obj) -> Union[tuple, None]:
+    """
+    Returns the shape of an array, or the shape of the first array in a tuple.
+    """
+    if isinstance(obj, tuple) and len(obj) > 0:
+        obj = obj[0]
+    return getattr(obj, 'shape', None)
+
+
+def _current_function() -> Union[str, None]:
+    """
+    Returns the name of the outermost public function that is running in the current thread.
+    """
+    return getattr(_PROFILING, 'function', None)
+
+
+@contextlib.contextmanager
+def _function_label(name: Union[str, None]):
+    """
+    Labels the stages called in the current thread with the name of a public function, \
+    unless they are already labeled with the name of an enclosing public function.
+    """
+    outermost = _current_function() is None
+    if outermost:
+        _PROFILING.function = name
+    try:
+        yield
+    finally:
+        if outermost:
+            _PROFILING.function = None
+
+
+@contextlib.contextmanager
+def _measure() -> Iterator[list]:
+    """
+    Measures the wall time of the enclosed block, and (if tracemalloc is tracing) the peak memory allocated in it, \
+    above the memory allocated when it started. When the block exits, the yielded list holds \
+    [seconds, allocated_bytes] (allocated_bytes is None if tracemalloc is not tracing). \
+    tracemalloc keeps a single peak, which is reset when a block starts, \
+    so the peak of every block is also folded into the peak of the block that encloses it (in the same thread). \
+    On Python < 3.9, tracemalloc cannot reset its peak. The peak is then attributed to the block only if it rose \
+    during the block, and otherwise the memory allocated by the block is bounded from below by its net allocation.
+    """
+    measurement = [0.0, None]
+    tracing = tracemalloc.is_tracing()
+    can_reset = hasattr(tracemalloc, 'reset_peak')
+    if tracing:
+        stack = _PROFILING.__dict__.setdefault('allocations', [])
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+        if can_reset:
+            tracemalloc.reset_peak()
+            peak = current
+        stack.append([current, current, peak])
+    start = time.perf_counter()
+    try:
+        yield measurement
+    finally:
+        measurement[0] = time.perf_counter() - start
+        if tracing:
+            start_bytes, peak, start_peak = stack.pop()
+            current, end_peak = tracemalloc.get_traced_memory()
+            peak = max(peak, end_peak if end_peak > start_peak or can_reset else current)
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+            measurement[1] = max(peak - start_bytes, 0)
+
+
+def _record_stage(stage: str, measurement: list, result, args: tuple):
+    """
+    Records a measured call of a stage in every active Profiler.
+    """
+    shapes = tuple(shape for shape in map(_shape, args) if shape is not None)
+    record = StageRecord(_current_function(), stage, measurement[0], _nbytes(result), shapes, measurement[1])
+    for profiler in _PROFILERS:
+        profiler._record(record)
+
+
+def _call_profiled(stage: str, func: Callable, args: tuple, kwargs: dict):
+    """
+    Calls func(*args, **kwargs), and records the call as the given stage in every active Profiler.
+    """
+    with _measure() as measurement:
+        result = func(*args, **kwargs)
+    _record_stage(stage, measurement, result, args)
+    return result
+
+
+def _profiled(func: Callable) -> Callable:
+    """
+    Instruments an internal stage of the distance computations, \
+    so that every call is recorded by the active Profilers (under the name of the function).
+    """
+    stage = func.__name__.lstrip('_')
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _PROFILERS:
+            return func(*args, **kwargs)
+        return _call_profiled(stage, func, args, kwargs)
+
+    return wrapper
+
+
+def _profiled_generator(name: str, generator: Iterator, args: tuple, seconds: float) -> Iterator:
+    """
+    Yields the items of a generator returned by a public function, labeling the stages that produce every item \
+    with the name of the function. The time spent producing the items (in addition to 'seconds', \
+    the time it took to create the generator) is recorded as the function's 'total' stage once the generator \
+    is exhausted or closed. The time spent by the caller between items is not included.
+    """
+    exhausted = object()
+    try:
+        while True:
+            with _function_label(name), _measure() as measurement:
+                item = next(generator, exhausted)
+            seconds += measurement[0]
+            if item is exhausted:
+                return
+            yield item
+    finally:
+        generator.close()
+        with _function_label(name):
+            _record_stage('total', [seconds, None], None, args)
+
+
+def _profiled_function(func: Callable) -> Callable:
+    """
+    Instruments a public function, so that the stages it calls are labeled with its name, \
+    and its entire call is recorded as a 'total' stage by the active Profilers. \
+    Generators (and the generators returned by the function) are recorded once they are exhausted.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _PROFILERS:
+            return func(*args, **kwargs)
+        with _function_label(name):
+            with _measure() as measurement:
+                result = func(*args, **kwargs)
+            if inspect.isgenerator(result):
+                return _profiled_generator(name, result, args, measurement[0])
+            _record_stage('total', measurement, result, args)
+        return result
+
+    return wrapper
 
 
 def _rowvar(data: np.ndarray, rowvar: bool = True) -> np.ndarray:
     """
-    Returns data if rowvar = True, data.transpose() otherwise.
+    Returns data if rowvar = True, data.transpose() otherwise. \
+    If 'data' is a stack of arrays (a 3-dimensional array or a list of 2-dimensional arrays), \
+    every array in the stack is transposed.
     :param data: array to be transposed
     :type data: np.ndarray
     :param rowvar: if False, array will be transposed before being returned.
     :type rowvar: bool
     :rtype: np.ndarray
     """
+    if sparse.issparse(data):
+        return data if rowvar else data.T
+    data = np.asarray(data)
     if rowvar:
         return data
-    return data.T
+    return data.swapaxes(-1, -2)
 
 
-def _similarity(similarity_mat: np.ndarray, similarity: bool) -> np.ndarray:
+def _similarity(similarity_mat: np.ndarray, similarity: bool, out: Union[np.ndarray, None] = None) -> np.ndarray:
     """
     Returns similarity_mat if similarity = True, otherwise returns _similarity_to_distance(similarity_mat)
     :param similarity_mat: similarity matrix
     :type similarity_mat: np.ndarray
     :param similarity: if False, turns similarity matrix into distance matrix and returns it.
     :type similarity: bool
+    :param out: if specified, the distance matrix is written into 'out' (which may be 'similarity_mat' itself).
+    :type out: np.ndarray or None (default=None)
     :rtype: np.ndarray
     """
     if similarity:
         return similarity_mat
-    return _similarity_to_distance(similarity_mat)
+    return _similarity_to_distance(similarity_mat, out=out)
+
+
+def _open_output(out: Union[np.ndarray, str, os.PathLike], shape: tuple, dtype=float) -> np.ndarray:
+    """
+    Returns an output array of the given shape to write results into. \
+    If 'out' is a path, a new memory-mapped .npy file of the given shape and dtype is created at that path.
+
+    :param out: a numpy array (including an np.memmap) or a path to an .npy file.
+    :type out: np.ndarray, str or os.PathLike
+    :param shape: the expected shape of the output array.
+    :type shape: tuple
+    :param dtype: the data type of a newly-created output array.
+    :type dtype: numpy dtype (default=float)
+    :rtype: np.ndarray
+    """
+    if isinstance(out, (str, os.PathLike)):
+        return np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=shape)
+    assert isinstance(out, np.ndarray), f"'out' must be a numpy array or a path. Instead got {type(out)}."
+    assert out.shape == shape, f"'out' must be of shape {shape}. Instead got {out.shape}."
+    return out
+
+
+def _check_dtype(dtype) -> np.dtype:
+    """
+    Validates the 'dtype' parameter, and returns the floating-point numpy dtype it specifies.
+    """
+    dtype = np.dtype(dtype)
+    assert np.issubdtype(dtype, np.floating), f"'dtype' must be a floating-point data type. Instead got {dtype}."
+    return dtype
+
+
+def _check_block_size(block_size: Union[int, None]):
+    assert block_size is None or (isinstance(block_size, (int, np.integer)) and block_size > 0), \
+        f"'block_size' must be a positive integer or None. Instead got {block_size}."
+
+
+def _slice_prepared(prepared: tuple, rows: slice) -> tuple:
+    """
+    Returns the prepared tuple of the samples in 'rows'.
+
+    :param prepared: a tuple of arrays aligned with the samples, as returned by a metric's 'prepare' function.
+    :type prepared: tuple
+    :param rows: the samples to keep
+    :type rows: slice
+    :rtype: tuple
+    """
+    return tuple(arr[rows] for arr in prepared)
+
+
+def _check_n_jobs(n_jobs: int) -> int:
+    """
+    Validates the 'n_jobs' parameter, and returns the number of threads it specifies.
+    """
+    assert isinstance(n_jobs, (int, np.integer)) and (n_jobs >= 1 or n_jobs == -1), \
+        f"'n_jobs' must be a positive integer or -1. Instead got {n_jobs}."
+    if n_jobs == -1:
+        return os.cpu_count() or 1
+    return n_jobs
+
+
+def _tile_slices(n_samples: int, block_size: int, upper_only: bool = False) -> Iterator[Tuple[slice, slice]]:
+    """
+    Yields the (row slice, column slice) pairs of the tiles of an n-by-n matrix in row-major order.
+
+    :param n_samples: the number of rows (and columns) of the matrix.
+    :type n_samples: int
+    :param block_size: the number of rows and columns in every tile.
+    :type block_size: int
+    :param upper_only: if True, only tiles on or above the diagonal of the matrix are yielded.
+    :type upper_only: bool (default=False)
+    """
+    for row_start in range(0, n_samples, block_size):
+        rows = slice(row_start, min(row_start + block_size, n_samples))
+        for col_start in range(row_start if upper_only else 0, n_samples, block_size):
+            yield rows, slice(col_start, min(col_start + block_size, n_samples))
+
+
+def _compute_tile(prepared: tuple, metric: _Metric, params: dict, rows: slice, cols: slice) -> np.ndarray:
+    """
+    Computes the tile matrix[rows, cols] of the pairwise similarity matrix of the prepared samples.
+
+    :param prepared: a tuple of arrays aligned with the samples, as returned by 'metric.prepare'.
+    :type prepared: tuple
+    :param metric: the metric to compute.
+    :type metric: _Metric
+    :param params: additional keyword parameters to supply to 'metric.kernel'.
+    :type params: dict
+    :param rows: the rows of the tile.
+    :type rows: slice
+    :param cols: the columns of the tile.
+    :type cols: slice
+    :rtype: np.ndarray
+    """
+    tile = metric.kernel(_slice_prepared(prepared, rows), _slice_prepared(prepared, cols), **params)
+    if metric.zero_diagonal:
+        diagonal = np.arange(max(rows.start, cols.start), min(rows.stop, cols.stop))
+        tile[diagonal - rows.start, diagonal - cols.start] = 0
+    return tile
+
+
+def _iter_tiles(prepared: tuple, metric: _Metric, params: dict, block_size: int, upper_only: bool = False
+                ) -> Iterator[Tuple[slice, slice, np.ndarray]]:
+    """
+    Computes the pairwise similarity matrix of the prepared samples in tiles of 'block_size' rows by \
+    'block_size' columns, and yields the tiles one at a time in row-major order.
+
+    :param prepared: a tuple of arrays aligned with the samples, as returned by 'metric.prepare'.
+    :type prepared: tuple
+    :param metric: the metric to compute.
+    :type metric: _Metric
+    :param params: additional keyword parameters to supply to 'metric.kernel'.
+    :type params: dict
+    :param block_size: the number of rows and columns in every tile.
+    :type block_size: int
+    :param upper_only: if True, only tiles on or above the diagonal of the matrix are computed.
+    :type upper_only: bool (default=False)
+    :return: a generator of (row slice, column slice, similarity tile) tuples.
+    """
+    for rows, cols in _tile_slices(prepared[0].shape[0], block_size, upper_only):
+        yield rows, cols, _compute_tile(prepared, metric, params, rows, cols)
+
+
+# marks the threads of _run_tiles(), in which compiled kernels run single-threaded
+_TILE_WORKER = threading.local()
+
+
+def _run_tiles(func: Callable[[slice, slice], None], n_samples: int, block_size: int, upper_only: bool,
+               n_jobs: int):
+    """
+    Calls func(rows, cols) for every tile of an n-by-n matrix. \
+    If n_jobs > 1, the tiles are processed concurrently by a pool of 'n_jobs' threads. \
+    Since NumPy releases the GIL in matrix products and element-wise operations, the tiles are computed in parallel. \
+    The tiles are independent of one another and are identical to the tiles of the serial computation, \
+    so the result does not depend on the number of threads. \
+    If threadpoolctl is installed, BLAS is limited to a single thread per tile to avoid oversubscribing the CPU. \
+    For the same reason, the threads are marked as tile workers, so that compiled kernels run single-threaded in them.
+
+    :param func: the function to call on every tile. Must write its result to a region of the output \
+    that is unique to the tile.
+    :type func: function
+    :param n_samples: the number of rows (and columns) of the matrix.
+    :type n_samples: int
+    :param block_size: the number of rows and columns in every tile.
+    :type block_size: int
+    :param upper_only: if True, only tiles on or above the diagonal of the matrix are processed.
+    :type upper_only: bool
+    :param n_jobs: the number of threads to use.
+    :type n_jobs: int
+    """
+    tiles = _tile_slices(n_samples, block_size, upper_only)
+    if n_jobs == 1:
+        for rows, cols in tiles:
+            func(rows, cols)
+        return
+
+    function = _current_function()
+
+    def process_tile(tile: Tuple[slice, slice]):
+        _TILE_WORKER.active = True
+        # the stages computed in the worker threads are labeled with the public function that started them
+        with _function_label(function):
+            func(*tile)
+
+    limits = threadpool_limits(1, 'blas') if threadpool_limits is not None else contextlib.nullcontext()
+    with limits, ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        for _ in executor.map(process_tile, tiles):
+            pass
+
+
+def _condensed_index(n_samples: int, i: int, j: int) -> int:
+    """
+    Returns the position of element (i, j) of an n-by-n symmetric matrix in its condensed form, \
+    where i < j. The condensed form is the layout used by scipy.spatial.distance.pdist.
+    """
+    return n_samples * i - (i * (i + 1)) // 2 + (j - i - 1)
+
+
+def _write_condensed(out: np.ndarray, tile: np.ndarray, rows: slice, cols: slice, n_samples: int):
+    """
+    Writes the elements of a tile that lie strictly above the diagonal of an n-by-n symmetric matrix \
+    into their positions in the condensed form of the matrix. \
+    The elements of every row of the tile are contiguous in the condensed form, and are written as a single slice.
+
+    :param out: the condensed output array, of length n(n-1)/2.
+    :type out: np.ndarray
+    :param tile: the tile matrix[rows, cols] of the matrix.
+    :type tile: np.ndarray
+    :param rows: the rows of the tile.
+    :type rows: slice
+    :param cols: the columns of the tile.
+    :type cols: slice
+    :param n_samples: the number of rows (and columns) of the matrix.
+    :type n_samples: int
+    """
+    for i in range(rows.start, min(rows.stop, cols.stop - 1)):
+        first_col = max(cols.start, i + 1)
+        start = _condensed_index(n_samples, i, first_col)
+        out[start:start + cols.stop - first_col] = tile[i - rows.start, first_col - cols.start:]
+
+
+def _get_metric(data, metric: str, nan_policy: str = 'propagate') -> _Metric:
+    """
+    Returns the implementation of the given metric that matches the type of 'data' and the given NaN policy.
+
+    :param data: the data the metric will be calculated on.
+    :type data: np.ndarray or scipy.sparse matrix
+    :param metric: name of the metric to compute, or an implementation of a metric (which is returned as is).
+    :type metric: str or _Metric
+    :param nan_policy: if 'omit', returns the pairwise-complete implementation of the metric.
+    :type nan_policy: 'propagate' or 'omit' (default='propagate')
+    :rtype: _Metric
+    """
+    assert nan_policy in {'propagate', 'omit'}, \
+        f"'nan_policy' must be 'propagate' or 'omit'. Instead got '{nan_policy}'."
+    if isinstance(metric, _Metric):
+        return metric
+    if sparse.issparse(data):
+        assert nan_policy == 'propagate', "nan_policy='omit' is not supported for sparse input."
+        assert metric in _SPARSE_METRICS, \
+            f"Sparse input is only supported for the metrics {sorted(_SPARSE_METRICS)}. Instead got '{metric}'."
+        return _SPARSE_METRICS[metric]
+    if nan_policy == 'omit':
+        assert metric in _NAN_OMIT_METRICS, \
+            f"nan_policy='omit' is only supported for the metrics {sorted(_NAN_OMIT_METRICS)}. Instead got '{metric}'."
+        return _NAN_OMIT_METRICS[metric]
+    return _METRICS[metric]
+
+
+def _pairwise_distance(data: np.ndarray, metric: str, similarity: bool, block_size: Union[int, None] = None,
+                       out: Union[np.ndarray, str, os.PathLike, None] = None, condensed: bool = False,
+                       n_jobs: int = 1, dtype=float, nan_policy: str = 'propagate', **params) -> np.ndarray:
+    """
+    Calculates the pairwise distance (or similarity) matrix of the rows of 'data' using the given metric. \
+    If 'block_size' is specified, only the tiles on or above the diagonal are computed, \
+    and the tiles below the diagonal are filled in by symmetry (or skipped entirely if 'condensed' is True). \
+    Every tile is converted from similarity to distance in-place, and is then written directly into the output array.
+
+    :param data: an n-by-p array of n samples by p features, to calculate pairwise distance on, \
+    or a b-by-n-by-p stack of b such arrays (see _batch_distance()).
+    :type data: np.ndarray or scipy.sparse matrix
+    :param metric: name of the metric to compute.
+    :type metric: str
+    :param similarity: If False, returns a pairwise distance matrix. If True, returns a pairwise similarity matrix.
+    :type similarity: bool
+    :param block_size: the number of rows and columns in every tile. \
+    If None, the entire matrix is computed as a single tile (or in tiles of the default size if 'out' is specified).
+    :type block_size: int or None (default=None)
+    :param out: the array (or path to an .npy file) to write the output into. \
+    If None, a new array is allocated.
+    :type out: np.ndarray, str, os.PathLike or None (default=None)
+    :param condensed: if True, returns only the strict upper triangle of the matrix, \
+    in the condensed layout used by scipy.spatial.distance.pdist.
+    :type condensed: bool (default=False)
+    :param n_jobs: the number of threads used to compute the tiles concurrently. If -1, all CPU cores are used.
+    :type n_jobs: int (default=1)
+    :param dtype: the floating-point data type of the computation and of the output.
+    :type dtype: numpy dtype (default=float)
+    :param nan_policy: if 'omit', the metric is computed over the features observed in both samples of every pair.
+    :type nan_policy: 'propagate' or 'omit' (default='propagate')
+    :param params: additional keyword parameters to supply to the metric's kernel.
+    :return: an n-by-n numpy array of pairwise distance (or similarity) scores, \
+    or an array of length n(n-1)/2 if 'condensed' is True.
+    :rtype: np.ndarray
+    """
+    _check_block_size(block_size)
+    n_jobs = _check_n_jobs(n_jobs)
+    dtype = _check_dtype(dtype)
+    metric = _get_metric(data, metric, nan_policy)
+    if _is_batch(data):
+        assert block_size is None and not condensed and n_jobs == 1, \
+            "'block_size', 'condensed' and 'n_jobs' are not supported for a stack of datasets."
+        return _batch_distance(data, metric, similarity, out, dtype, **params)
+    prepared = metric.prepare(data, dtype)
+    n_samples = prepared[0].shape[0]
+    if out is None and not condensed and n_jobs == 1 and (block_size is None or block_size >= n_samples):
+        tile = next(_iter_tiles(prepared, metric, params, max(n_samples, 1)))[2]
+        return _similarity(tile, similarity, out=tile)
+
+    shape = ((n_samples * (n_samples - 1)) // 2,) if condensed else (n_samples, n_samples)
+    out = np.empty(shape, dtype=dtype) if out is None else _open_output(out, shape, dtype)
+    if block_size is None:
+        block_size = _DEFAULT_BLOCK_SIZE
+
+    def process_tile(rows: slice, cols: slice):
+        tile = _compute_tile(prepared, metric, params, rows, cols)
+        tile = _similarity(tile, similarity, out=tile)
+        if condensed:
+            _write_condensed(out, tile, rows, cols, n_samples)
+            return
+        out[rows, cols] = tile
+        if rows != cols:
+            out[cols, rows] = tile.T
+
+    _run_tiles(process_tile, n_samples, block_size, True, n_jobs)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+def _is_batch(data) -> bool:
+    """
+    Returns True if 'data' is a stack of datasets (a 3-dimensional array) rather than a single dataset.
+    """
+    return not sparse.issparse(data) and np.ndim(data) == 3
+
+
+def _prepare_batch(data: np.ndarray, metric: _Metric, dtype) -> tuple:
+    """
+    Prepares every dataset in a b-by-n-by-p stack of datasets for the metric's kernel. \
+    Since every sample is prepared independently of the others, the samples of all datasets \
+    are prepared together by a single call to 'metric.prepare' on the (b*n)-by-p array of all samples, \
+    and every prepared array is then split back into a stack of b arrays of n samples.
+
+    :param data: a b-by-n-by-p numpy array of b datasets of n samples by p features.
+    :type data: np.ndarray
+    :param metric: the metric to prepare the samples for.
+    :type metric: _Metric
+    :param dtype: the floating-point data type of the prepared samples.
+    :type dtype: np.dtype
+    :return: a tuple of arrays whose first two axes are aligned with the datasets and their samples.
+    :rtype: tuple
+    """
+    n_batches, n_samples, n_features = data.shape
+    prepared = metric.prepare(data.reshape(n_batches * n_samples, n_features), dtype)
+    return tuple(arr.reshape(n_batches, n_samples, *arr.shape[1:]) for arr in prepared)
+
+
+def _iter_batches(data: np.ndarray, metric: _Metric, params: dict, batch_size: int, similarity: bool, dtype
+                  ) -> Iterator[Tuple[slice, np.ndarray]]:
+    """
+    Calculates the pairwise distance (or similarity) matrices of a stack of datasets, \
+    'batch_size' datasets at a time. The pairwise matrices of every group of datasets are computed together \
+    by the metric's kernel, using batched matrix products over the leading batch axis.
+
+    :param data: a b-by-n-by-p numpy array of b datasets of n samples by p features.
+    :type data: np.ndarray
+    :param metric: the metric to compute.
+    :type metric: _Metric
+    :param params: additional keyword parameters to supply to 'metric.kernel'.
+    :type params: dict
+    :param batch_size: the number of datasets computed together.
+    :type batch_size: int
+    :param similarity: If False, yields distance matrices. If True, yields similarity matrices.
+    :type similarity: bool
+    :param dtype: the floating-point data type of the computation and of the yielded matrices.
+    :type dtype: np.dtype
+    :return: a generator of (batch slice, matrices) tuples, where 'matrices' is a k-by-n-by-n numpy array \
+    of the pairwise matrices of the datasets in the batch slice.
+    """
+    prepared = _prepare_batch(data, metric, dtype)
+    n_batches, n_samples = data.shape[:2]
+    diagonal = np.arange(n_samples)
+    for start in range(0, n_batches, batch_size):
+        batches = slice(start, min(start + batch_size, n_batches))
+        prepared_batches = _slice_prepared(prepared, batches)
+        tiles = metric.kernel(prepared_batches, prepared_batches, **params)
+        if metric.zero_diagonal:
+            tiles[:, diagonal, diagonal] = 0
+        yield batches, _similarity(tiles, similarity, out=tiles)
+
+
+def _batch_distance(data: np.ndarray, metric: _Metric, similarity: bool,
+                    out: Union[np.ndarray, str, os.PathLike, None] = None, dtype=float, **params) -> np.ndarray:
+    """
+    Calculates the pairwise distance (or similarity) matrices of a b-by-n-by-p stack of datasets. \
+    The datasets are computed in groups whose pairwise matrices together hold about as many elements as \
+    a single tile of the default size, so that intermediate memory usage is bounded regardless of b, \
+    and every group is written directly into the output array.
+
+    :param data: a b-by-n-by-p numpy array of b datasets of n samples by p features.
+    :type data: np.ndarray
+    :param metric: the metric to compute.
+    :type metric: _Metric
+    :param similarity: If False, returns distance matrices. If True, returns similarity matrices.
+    :type similarity: bool
+    :param out: the b-by-n-by-n array (or path to an .npy file) to write the output into. \
+    If None, a new array is allocated.
+    :type out: np.ndarray, str, os.PathLike or None (default=None)
+    :param dtype: the floating-point data type of the computation and of the output.
+    :type dtype: numpy dtype (default=float)
+    :param params: additional keyword parameters to supply to the metric's kernel.
+    :return: a b-by-n-by-n numpy array of the pairwise distance (or similarity) matrices of the datasets.
+    :rtype: np.ndarray
+    """
+    n_batches, n_samples = data.shape[:2]
+    shape = (n_batches, n_samples, n_samples)
+    out = np.empty(shape, dtype=dtype) if out is None else _open_output(out, shape, dtype)
+    batch_size = max(1, _DEFAULT_BLOCK_SIZE ** 2 // max(n_samples, 1) ** 2)
+    for batches, matrices in _iter_batches(data, metric, params, batch_size, similarity, dtype):
+        out[batches] = matrices
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+@_profiled_function
+def iter_distance_batches(data: np.ndarray, metric: str = 'pearson', batch_size: int = 16, rowvar: bool = True,
+                          similarity: bool = False, dtype=float, nan_policy: str = 'propagate',
+                          **params) -> Iterator[Tuple[slice, np.ndarray]]:
+    """
+    Calculates the pairwise distance matrices of a stack of b datasets of identical shape (n samples by p features), \
+    and yields them 'batch_size' datasets at a time, instead of returning all b matrices at once. \
+    The samples of all datasets are prepared together (for example, centered, normalized or ranked), \
+    and the distance matrices of every group of 'batch_size' datasets are computed together \
+    with batched matrix products. Memory usage is therefore bounded by 'batch_size' rather than by b.
+
+    :param data: a b-by-n-by-p numpy array of b datasets of n samples by p features, \
+    or a list of b n-by-p numpy arrays.
+    :type data: np.ndarray or list of np.ndarray
+    :param metric: the distance metric to calculate.
+    :type metric: 'pearson', 'spearman', 'jackknife', 'ys1', 'yr1' or 'sharpened_cosine' (default='pearson')
+    :param batch_size: the number of datasets whose distance matrices are computed (and yielded) together.
+    :type batch_size: int (default=16)
+    :param rowvar: If True, calculates the pairwise distance between the rows of every dataset. \
+    If False, calculate the pairwise distance between the columns of every dataset.
+    :type rowvar: bool (default=True)
+    :param similarity: If False, yields pairwise distance matrices (0 means closest, 1 means furthest). \
+    If True, yields pairwise similarity matrices (1 means most similar, 0 means most different).
+    :type similarity: bool (default=False)
+    :param dtype: the floating-point data type of the computation and of the yielded matrices. \
+    See pearson_distance() for more details.
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    :param nan_policy: Determines how missing values (NaN) in 'data' are handled. \
+    See pearson_distance() for more details.
+    :type nan_policy: 'propagate' or 'omit' (default='propagate')
+    :param params: additional parameters of the distance metric \
+    (for example 'omega1', 'omega2' and 'omega3' for 'ys1', or 'sharpen_exponent' for 'sharpened_cosine').
+    :return: a generator of (batch slice, matrices) tuples, where 'matrices' is a k-by-n-by-n numpy array \
+    of the pairwise distance matrices of the datasets data[batch slice].
+    """
+    assert metric in _METRICS, f"'metric' must be one of {sorted(_METRICS)}. Instead got '{metric}'."
+    assert isinstance(batch_size, (int, np.integer)) and batch_size > 0, \
+        f"'batch_size' must be a positive integer. Instead got {batch_size}."
+    data = _rowvar(data, rowvar)
+    assert _is_batch(data), f"'data' must be a stack of datasets of identical shape. Instead got {np.ndim(data)} axes."
+    yield from _iter_batches(data, _get_metric(data, metric, nan_policy), params, batch_size, similarity,
+                             _check_dtype(dtype))
+
+
+@_profiled_function
+def iter_distance_blocks(data: np.ndarray, metric: str = 'pearson', block_size: int = 1024, rowvar: bool = True,
+                         similarity: bool = False, dtype=float, **params) -> Iterator[Tuple[slice, slice, np.ndarray]]:
+    """
+    Calculates the pairwise distance matrix for a given array of n samples by p features in tiles, \
+    and yields the tiles one at a time (in row-major order) instead of returning the entire matrix. \
+    The row-wise computations of each metric (such as centering, ranking, inclines and the positions of the \
+    minimal and maximal values) are performed only once, and memory usage is bounded by the tile size \
+    rather than by n^2. This allows consuming the pairwise distance matrix of a large number of samples as a stream.
+
+    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on.
+    :type data: np.ndarray
+    :param metric: the distance metric to calculate.
+    :type metric: 'pearson', 'spearman', 'jackknife', 'ys1', 'yr1' or 'sharpened_cosine' (default='pearson')
+    :param block_size: the number of rows and columns in every tile.
+    :type block_size: int (default=1024)
+    :param rowvar: If True, calculates the pairwise distance between the rows of 'data'. \
+    If False, calculate the pairwise distance between the columns of 'data'.
+    :type rowvar: bool (default=True)
+    :param similarity: If False, yields tiles of the pairwise distance matrix (0 means closest, 1 means furthest). \
+    If True, yields tiles of the pairwise similarity matrix (1 means most similar, 0 means most different).
+    :type similarity: bool (default=False)
+    :param dtype: the floating-point data type of the computation and of the yielded tiles. \
+    See pearson_distance() for more details.
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    :param params: additional parameters of the distance metric \
+    (for example 'omega1', 'omega2' and 'omega3' for 'ys1', or 'sharpen_exponent' for 'sharpened_cosine').
+    :return: a generator of (row slice, column slice, tile) tuples. \
+    Each tile is the block matrix[row slice, column slice] of the pairwise distance matrix.
+    """
+    assert metric in _METRICS, f"'metric' must be one of {sorted(_METRICS)}. Instead got '{metric}'."
+    assert block_size is not None, "'block_size' must be a positive integer. Instead got None."
+    _check_block_size(block_size)
+    data = _rowvar(data, rowvar)
+    metric_obj = _METRICS[metric]
+    prepared = metric_obj.prepare(data, _check_dtype(dtype))
+    for rows, cols, tile in _iter_tiles(prepared, metric_obj, params, block_size):
+        yield rows, cols, _similarity(tile, similarity, out=tile)
+
+
+def _merge_topk(best_dist: np.ndarray, best_ind: np.ndarray, tile: np.ndarray, cols: slice):
+    """
+    Merges the distances of a tile into the running k smallest distances (and their indices) of its rows, in-place.
+
+    :param best_dist: an m-by-k array of the k smallest distances found so far for every row of the tile.
+    :type best_dist: np.ndarray
+    :param best_ind: an m-by-k array of the column indices of the distances in 'best_dist'.
+    :type best_ind: np.ndarray
+    :param tile: an m-by-b array of distances between the rows of the tile and the columns in 'cols'.
+    :type tile: np.ndarray
+    :param cols: the columns of the tile.
+    :type cols: slice
+    """
+    k = best_dist.shape[1]
+    cand_dist = np.concatenate((best_dist, tile), axis=1)
+    cand_ind = np.concatenate((best_ind, np.broadcast_to(np.arange(cols.start, cols.stop), tile.shape)), axis=1)
+    if cand_dist.shape[1] > k:
+        keep = np.argpartition(cand_dist, k - 1, axis=1)[:, :k]
+    else:
+        keep = np.broadcast_to(np.arange(k), best_dist.shape)
+    best_dist[:] = np.take_along_axis(cand_dist, keep, axis=1)
+    best_ind[:] = np.take_along_axis(cand_ind, keep, axis=1)
+
+
+@_profiled_function
+def pairwise_topk(data: np.ndarray, k: int, metric: str = 'pearson', block_size: int = 1024, rowvar: bool = True,
+                  include_self: bool = False, **params) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the k nearest neighbours of every sample in a given array of n samples by p features, \
+    without allocating the n-by-n pairwise distance matrix. \
+    The pairwise distance matrix is computed in tiles of 'block_size' rows by 'block_size' columns \
+    (only the tiles on or above the diagonal, since all distance metrics are symmetric), \
+    and the running k smallest distances of every sample are merged with every tile. \
+    Memory usage is therefore O(n*k + block_size^2) rather than O(n^2). \
+    Distances that are NaN (for example, of a sample with a constant value under a correlation metric) \
+    are treated as infinitely far.
+
+    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on.
+    :type data: np.ndarray
+    :param k: the number of nearest neighbours to find for every sample.
+    :type k: int between 1 and n (or n-1 if 'include_self' is False)
+    :param metric: the distance metric to calculate.
+    :type metric: 'pearson', 'spearman', 'jackknife', 'ys1', 'yr1' or 'sharpened_cosine' (default='pearson')
+    :param block_size: the number of rows and columns in every tile.
+    :type block_size: int (default=1024)
+    :param rowvar: If True, calculates the pairwise distance between the rows of 'data'. \
+    If False, calculate the pairwise distance between the columns of 'data'.
+    :type rowvar: bool (default=True)
+    :param include_self: If True, every sample is a candidate neighbour of itself.
+    :type include_self: bool (default=False)
+    :param params: additional parameters of the distance metric \
+    (for example 'omega1', 'omega2' and 'omega3' for 'ys1', or 'sharpen_exponent' for 'sharpened_cosine').
+    :return: a tuple of two n-by-k numpy arrays: the indices of the k nearest neighbours of every sample, \
+    and their distances from the sample. The neighbours of every sample are sorted from closest to furthest \
+    (ties are broken by index), and neighbours at a NaN distance are sorted last.
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    assert metric in _METRICS, f"'metric' must be one of {sorted(_METRICS)}. Instead got '{metric}'."
+    assert block_size is not None, "'block_size' must be a positive integer. Instead got None."
+    _check_block_size(block_size)
+    data = _rowvar(data, rowvar)
+    metric_obj = _METRICS[metric]
+    prepared = metric_obj.prepare(data, float)
+    n_samples = len(prepared[0])
+    max_k = n_samples if include_self else n_samples - 1
+    assert isinstance(k, (int, np.integer)) and 1 <= k <= max_k, \
+        f"'k' must be an integer between 1 and {max_k}. Instead got {k}."
+
+    # NaN distances are ranked as infinitely far, while the empty slots of the running top-k (and every sample itself, \
+    # if 'include_self' is False) are marked with NaN, which argpartition ranks after any number (including inf)
+    best_dist = np.full((n_samples, k), np.nan)
+    best_ind = np.full((n_samples, k), -1, dtype=np.intp)
+    for rows, cols, tile in _iter_tiles(prepared, metric_obj, params, block_size, upper_only=True):
+        tile = _similarity_to_distance(tile, out=tile)
+        tile[np.isnan(tile)] = np.inf
+        if rows == cols and not include_self:
+            np.fill_diagonal(tile, np.nan)
+        _merge_topk(best_dist[rows], best_ind[rows], tile, cols)
+        if rows != cols:
+            _merge_topk(best_dist[cols], best_ind[cols], tile.T, rows)
+
+    # sort the neighbours of every sample by distance, breaking ties by index
+    order = np.lexsort((best_ind, best_dist), axis=1)
+    best_ind = np.take_along_axis(best_ind, order, axis=1)
+    best_dist = np.take_along_axis(best_dist, order, axis=1)
+    best_dist[np.isinf(best_dist)] = np.nan
+    return best_ind, best_dist
+
+
+@_profiled_function
+def similarity_graph(data: Union[np.ndarray, sparse.spmatrix], threshold: float, metric: str = 'pearson',
+                     block_size: int = 1024, rowvar: bool = True, dtype=float, nan_policy: str = 'propagate',
+                     **params) -> sparse.csr_matrix:
+    """
+    Calculates the pairwise similarity matrix for a given array of n samples by p features, \
+    and returns only the pairs of samples whose similarity is above a threshold, as a sparse matrix \
+    (for example, to build a co-expression network). \
+    The similarity matrix is computed in tiles of 'block_size' rows by 'block_size' columns \
+    (only the tiles on or above the diagonal, since all similarity metrics are symmetric), \
+    so the dense n-by-n matrix is never allocated. \
+    For 'sharpened_cosine', the similarity of every pair of samples is bounded from above by the norms of the samples. \
+    The samples are then processed in decreasing order of their bound, \
+    and tiles whose bound is not above the threshold are skipped without being computed.
+
+    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise similarity on. \
+    Sparse matrices are supported for the 'pearson' and 'sharpened_cosine' metrics.
+    :type data: np.ndarray or scipy.sparse matrix
+    :param threshold: only pairs of samples whose similarity is greater than 'threshold' are returned.
+    :type threshold: float between 0 and 1
+    :param metric: the similarity metric to calculate.
+    :type metric: 'pearson', 'spearman', 'jackknife', 'ys1', 'yr1' or 'sharpened_cosine' (default='pearson')
+    :param block_size: the number of rows and columns in every tile.
+    :type block_size: int (default=1024)
+    :param rowvar: If True, calculates the pairwise similarity between the rows of 'data'. \
+    If False, calculate the pairwise similarity between the columns of 'data'.
+    :type rowvar: bool (default=True)
+    :param dtype: the floating-point data type of the computation and of the returned matrix. \
+    See pearson_distance() for more details.
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    :param nan_policy: Determines how missing values (NaN) in 'data' are handled. \
+    See pearson_distance() for more details.
+    :type nan_policy: 'propagate' or 'omit' (default='propagate')
+    :param params: additional parameters of the similarity metric \
+    (for example 'omega1', 'omega2' and 'omega3' for 'ys1', or 'sharpen_exponent' for 'sharpened_cosine').
+    :return: a symmetric n-by-n sparse matrix (in CSR format) containing the similarity of every pair \
+    of distinct samples whose similarity is greater than 'threshold'. \
+    All other pairs (including every sample and itself) are omitted from the matrix.
+    :rtype: scipy.sparse.csr_matrix
+    """
+    assert metric in _METRICS, f"'metric' must be one of {sorted(_METRICS)}. Instead got '{metric}'."
+    assert block_size is not None, "'block_size' must be a positive integer. Instead got None."
+    _check_block_size(block_size)
+    dtype = _check_dtype(dtype)
+    data = _rowvar(data, rowvar)
+    metric_obj = _get_metric(data, metric, nan_policy)
+    prepared = metric_obj.prepare(data, dtype)
+    n_samples = prepared[0].shape[0]
+
+    bounds = None
+    order = np.arange(n_samples)
+    if metric_obj.sample_bound is not None:
+        bounds = metric_obj.sample_bound(prepared, **params)
+        order = np.argsort(-bounds, kind='stable')
+        bounds = bounds[order]
+        prepared = tuple(arr[order] for arr in prepared)
+
+    row_ind, col_ind, values = [], [], []
+    for rows, cols in _tile_slices(n_samples, block_size, upper_only=True):
+        # samples are sorted by decreasing bound, so the first pair of a tile has the largest bound
+        if bounds is not None and (1 + bounds[rows.start] * bounds[cols.start]) / 2 <= threshold:
+            continue
+        tile = _compute_tile(prepared, metric_obj, params, rows, cols)
+        with np.errstate(invalid='ignore'):
+            above = tile > threshold
+        if rows == cols:
+            above = np.triu(above, 1)
+        tile_rows, tile_cols = np.nonzero(above)
+        row_ind.append(tile_rows + rows.start)
+        col_ind.append(tile_cols + cols.start)
+        values.append(tile[tile_rows, tile_cols])
+
+    row_ind = order[np.concatenate(row_ind)] if row_ind else np.empty(0, dtype=np.intp)
+    col_ind = order[np.concatenate(col_ind)] if col_ind else np.empty(0, dtype=np.intp)
+    values = np.concatenate(values) if values else np.empty(0, dtype=dtype)
+    return sparse.csr_matrix((np.concatenate((values, values)),
+                              (np.concatenate((row_ind, col_ind)), np.concatenate((col_ind, row_ind)))),
+                             shape=(n_samples, n_samples), dtype=dtype)
+
+
+def _process_alive(pid: int) -> bool:
+    """
+    Returns True if a local process with the given process ID is running.
+    """
+    if os.name == 'nt':  # pragma: no cover
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _claim_tile(claims_dir: str, done_dir: str, name: str) -> bool:
+    """
+    Attempts to claim a tile for the current process, by creating a claim file that contains its process ID. \
+    A claim left behind by a process that is no longer running (for example, one that crashed) is taken over. \
+    So is a claim that holds the ID of the current process, since every process computes its tiles one at a time, \
+    so such a claim was left behind by an earlier call that was interrupted. \
+    Two processes may occasionally both claim the same tile when taking over a stale claim, \
+    which only causes the tile to be computed twice, since every tile is always computed identically.
+
+    :param claims_dir: the directory of claim files.
+    :type claims_dir: str
+    :param done_dir: the directory of completed-tile markers.
+    :type done_dir: str
+    :param name: the name of the tile.
+    :type name: str
+    :return: True if the tile was claimed, and False if it is completed or claimed by a running process.
+    :rtype: bool
+    """
+    claim_path = os.path.join(claims_dir, name)
+    for _ in range(2):
+        try:
+            fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(claim_path) as file:
+                    pid = int(file.read() or -1)
+            except (FileNotFoundError, ValueError):
+                # the claim is being created or released by another process
+                return False
+            if pid == -1 or (pid != os.getpid() and _process_alive(pid)):
+                return False
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(claim_path)
+            continue
+        with os.fdopen(fd, 'w') as file:
+            file.write(str(os.getpid()))
+        # the tile may have been completed between listing the completed tiles and claiming it
+        if os.path.exists(os.path.join(done_dir, name)):
+            os.remove(claim_path)
+            return False
+        return True
+    return False
+
+
+def _out_of_core_worker(prepared: tuple, path: str, metric: str, nan_policy: str, similarity: bool,
+                        block_size: int, params: dict) -> int:
+    """
+    Claims and computes the unfinished tiles (on or above the diagonal) of an on-disk pairwise distance matrix, \
+    until no unclaimed tiles remain. Every tile is written (together with its mirror image below the diagonal) \
+    into the memory-mapped .npy file at 'path', which is flushed to the disk before the tile is marked as completed.
+
+    :param prepared: a tuple of arrays aligned with the samples, as returned by the metric's 'prepare' function.
+    :type prepared: tuple
+    :param path: the path of the .npy file of the distance matrix. Its manifest is stored in path + '.manifest'.
+    :type path: str
+    :param metric: name of the metric to compute.
+    :type metric: str
+    :param nan_policy: the NaN policy of the metric.
+    :type nan_policy: 'propagate' or 'omit'
+    :param similarity: If False, computes a distance matrix. If True, computes a similarity matrix.
+    :type similarity: bool
+    :param block_size: the number of rows and columns in every tile.
+    :type block_size: int
+    :param params: additional keyword parameters to supply to the metric's kernel.
+    :type params: dict
+    :return: the number of tiles computed by this worker.
+    :rtype: int
+    """
+    metric_obj = _get_metric(prepared[0], metric, nan_policy)
+    manifest = path + '.manifest'
+    done_dir = os.path.join(manifest, 'done')
+    claims_dir = os.path.join(manifest, 'claims')
+    out = np.load(path, mmap_mode='r+')
+    completed = set(os.listdir(done_dir))
+    n_computed = 0
+    for rows, cols in _tile_slices(prepared[0].shape[0], block_size, upper_only=True):
+        name = f'{rows.start}_{cols.start}'
+        if name in completed or not _claim_tile(claims_dir, done_dir, name):
+            continue
+        try:
+            tile = _compute_tile(prepared, metric_obj, params, rows, cols)
+            tile = _similarity(tile, similarity, out=tile)
+            out[rows, cols] = tile
+            if rows != cols:
+                out[cols, rows] = tile.T
+            out.flush()
+            open(os.path.join(done_dir, name), 'w').close()
+        finally:
+            # the claim is released even if the tile was interrupted, so that the tile can be computed again
+            os.remove(os.path.join(claims_dir, name))
+        n_computed += 1
+    return n_computed
+
+
+def _unfinished_tiles(done_dir: str, n_samples: int, block_size: int) -> list:
+    """
+    Returns the names of the tiles (on or above the diagonal) of an on-disk pairwise distance matrix \
+    that are not marked as completed in its manifest.
+    """
+    completed = set(os.listdir(done_dir))
+    return [name for name in (f'{rows.start}_{cols.start}' for rows, cols in
+                              _tile_slices(n_samples, block_size, upper_only=True)) if name not in completed]
+
+
+# the interval (in seconds) at which out_of_core_distance() checks whether tiles claimed by other processes are done
+_CLAIM_POLL_INTERVAL = 0.5
+
 
+@_profiled_function
+def out_of_core_distance(data: Union[np.ndarray, sparse.spmatrix], path: Union[str, os.PathLike],
+                         metric: str = 'pearson', block_size: int = 1024, rowvar: bool = True,
+                         similarity: bool = False, dtype=float, nan_policy: str = 'propagate', n_workers: int = 1,
+                         **params) -> np.memmap:
+    """
+    Calculates the pairwise distance matrix for a given array of n samples by p features directly into \
+    a memory-mapped .npy file, in a way that can be resumed if the computation is interrupted. \
+    The matrix is computed in tiles of 'block_size' rows by 'block_size' columns \
+    (only the tiles on or above the diagonal, which are mirrored below it). \
+    Every finished tile is flushed to the disk and recorded in a manifest directory (path + '.manifest'), \
+    so calling out_of_core_distance() again with the same arguments skips the tiles that were already completed \
+    and computes only the rest. \
+    Tiles are claimed by worker processes through claim files in the manifest, so several worker processes \
+    (started by a single call with n_workers > 1, or by several calls running at the same time on the same machine) \
+    can compute the tiles of the same matrix concurrently. \
+    Claims left behind by processes that are no longer running are taken over. \
+    The function returns only once every tile is completed, \
+    so it waits for the tiles that are being computed by other processes.
+
+    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on. \
+    Sparse matrices are supported for the 'pearson' and 'sharpened_cosine' metrics.
+    :type data: np.ndarray or scipy.sparse matrix
+    :param path: the path of the .npy file to write the n-by-n distance matrix into.
+    :type path: str or os.PathLike
+    :param metric: the distance metric to calculate.
+    :type metric: 'pearson', 'spearman', 'jackknife', 'ys1', 'yr1' or 'sharpened_cosine' (default='pearson')
+    :param block_size: the number of rows and columns in every tile.
+    :type block_size: int (default=1024)
+    :param rowvar: If True, calculates the pairwise distance between the rows of 'data'. \
+    If False, calculate the pairwise distance between the columns of 'data'.
+    :type rowvar: bool (default=True)
+    :param similarity: If False, computes a pairwise distance matrix (0 means closest, 1 means furthest). \
+    If True, computes a pairwise similarity matrix (1 means most similar, 0 means most different).
+    :type similarity: bool (default=False)
+    :param dtype: the floating-point data type of the computation and of the distance matrix. \
+    See pearson_distance() for more details.
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    :param nan_policy: Determines how missing values (NaN) in 'data' are handled. \
+    See pearson_distance() for more details.
+    :type nan_policy: 'propagate' or 'omit' (default='propagate')
+    :param n_workers: the number of worker processes used to compute the tiles. If -1, all CPU cores are used.
+    :type n_workers: int (default=1)
+    :param params: additional parameters of the distance metric \
+    (for example 'omega1', 'omega2' and 'omega3' for 'ys1', or 'sharpen_exponent' for 'sharpened_cosine').
+    :return: the n-by-n distance matrix, as a memory-mapped array of the .npy file at 'path'.
+    :rtype: np.memmap
+    """
+    assert metric in _METRICS, f"'metric' must be one of {sorted(_METRICS)}. Instead got '{metric}'."
+    assert block_size is not None, "'block_size' must be a positive integer. Instead got None."
+    _check_block_size(block_size)
+    n_workers = _check_n_jobs(n_workers)
+    dtype = _check_dtype(dtype)
+    data = _rowvar(data, rowvar)
+    prepared = _get_metric(data, metric, nan_policy).prepare(data, dtype)
+    n_samples = prepared[0].shape[0]
+    path = os.fspath(path)
+    config = dict(metric=metric, n_samples=n_samples, n_features=prepared[0].shape[1], block_size=block_size,
+                  similarity=similarity, dtype=dtype.name, nan_policy=nan_policy,
+                  params={key: float(val) for key, val in sorted(params.items())})
+    _open_manifest(path, config)
+
+    if n_workers == 1:
+        _out_of_core_worker(prepared, path, metric, nan_policy, similarity, block_size, params)
+    else:
+        # worker processes are spawned rather than forked, since forking a process whose threads (of BLAS or Numba)
+        # are running can deadlock the child processes
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(_out_of_core_worker, prepared, path, metric, nan_policy, similarity,
+                                       block_size, params) for _ in range(n_workers)]
+            for future in futures:
+                future.result()
+    # the remaining tiles are claimed by other processes that are computing the same matrix.
+    # wait for them, and compute the tiles whose claims are released (or abandoned) without being completed
+    done_dir = os.path.join(path + '.manifest', 'done')
+    while _unfinished_tiles(done_dir, n_samples, block_size):
+        time.sleep(_CLAIM_POLL_INTERVAL)
+        _out_of_core_worker(prepared, path, metric, nan_policy, similarity, block_size, params)
+    return np.load(path, mmap_mode='r+')
+
+
+def _open_manifest(path: str, config: dict, timeout: float = 60):
+    """
+    Creates the .npy file of an out-of-core distance matrix and its manifest directory, \
+    or validates that an existing manifest was created with the same configuration. \
+    The manifest directory is created atomically, so when several processes start at the same time, \
+    only one of them creates the .npy file, and the others wait until its configuration is written.
+
+    :param path: the path of the .npy file of the distance matrix.
+    :type path: str
+    :param config: the configuration of the computation (metric, shape, block size and parameters).
+    :type config: dict
+    :param timeout: the number of seconds to wait for another process to finish creating the manifest.
+    :type timeout: float (default=60)
+    """
+    manifest = path + '.manifest'
+    config_path = os.path.join(manifest, 'config.json')
+    try:
+        os.mkdir(manifest)
+    except FileExistsError:
+        start = time.monotonic()
+        while not os.path.exists(config_path):
+            if time.monotonic() - start > timeout:
+                raise TimeoutError(f"The manifest '{manifest}' is incomplete. "
+                                   f"Delete it (and '{path}') to restart the computation.")
+            time.sleep(0.1)
+        with open(config_path) as file:
+            existing = json.load(file)
+        assert existing == config, \
+            f"The matrix at '{path}' was started with a different configuration ({existing}). " \
+            f"Delete it and '{manifest}' to start a new computation."
+        return
+
+    os.mkdir(os.path.join(manifest, 'done'))
+    os.mkdir(os.path.join(manifest, 'claims'))
+    n_samples = config['n_samples']
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=config['dtype'], shape=(n_samples, n_samples))
+    out.flush()
+    del out
+    with open(config_path + '.tmp', 'w') as file:
+        json.dump(config, file)
+    os.replace(config_path + '.tmp', config_path)
+
+
+class ExecutionPlan(NamedTuple):
+    """
+    The execution strategy of a pairwise distance computation, as chosen by plan_distance(), \
+    and its estimated memory usage.
+
+    :param strategy: 'dense' computes the entire matrix as a single tile. \
+    'blocked' computes the matrix in tiles of 'block_size' rows by 'block_size' columns, \
+    which are written into the output array (or memory-mapped .npy file). \
+    'out_of_core' computes the matrix in tiles directly into a resumable .npy file (see out_of_core_distance()). \
+    'batched' computes the matrices of a stack of datasets together (see iter_distance_batches()).
+    :param block_size: the number of rows and columns in every tile \
+    (None for the 'dense' and 'batched' strategies).
+    :param output_bytes: the size of the output, in bytes.
+    :param estimated_peak_bytes: the estimated peak memory usage of the computation, in bytes \
+    (including the output, unless it is written into an existing array or a file).
+    :param available_bytes: the memory budget the strategy was chosen for, in bytes \
+    (None if the available memory could not be determined, in which case the budget is unlimited).
+    """
+    strategy: str
+    block_size: Union[int, None]
+    output_bytes: int
+    estimated_peak_bytes: int
+    available_bytes: Union[int, None]
+
+
+# the smallest tile size plan_distance() considers before falling back to computing the matrix out-of-core
+_MIN_PLAN_BLOCK_SIZE = 64
+
+
+def register_metric(name: str, prepare: Callable[[np.ndarray, np.dtype], tuple], kernel: Callable[..., np.ndarray],
+                    zero_diagonal: bool = False, sample_bound: Union[Callable[..., np.ndarray], None] = None,
+                    tile_temporaries: int = 2, overwrite: bool = False):
+    """
+    Registers a new pairwise similarity metric, which can then be computed by name with pairwise_distance() \
+    and with the other tiled functions of pairwisedist \
+    (such as iter_distance_blocks(), pairwise_topk(), similarity_graph() and cross_distance()). \
+    A metric is defined by two functions: 'prepare' performs all of the row-wise computations on the samples \
+    (such as centering, normalizing or ranking), and 'kernel' computes the similarity scores \
+    between two sets of prepared samples. \
+    Metrics computed in worker processes (out_of_core_distance() with n_workers > 1) must be registered \
+    when the module that defines them is imported, so that they are also registered in the worker processes.
+
+    :param name: the name of the metric.
+    :type name: str
+    :param prepare: a function that receives an n-by-p numpy array of n samples by p features and a floating-point \
+    dtype, and returns a tuple of numpy arrays whose first axis is aligned with the samples. \
+    Every sample must be prepared independently of the others, \
+    so that indexing the prepared arrays gives the prepared tuple of a subset of the samples.
+    :type prepare: Callable
+    :param kernel: a function that receives the prepared tuples of m and k samples (and the keyword parameters \
+    of the metric), and returns an m-by-k numpy array of the similarity scores between them, between 0 and 1. \
+    To support stacks of datasets, the kernel must also accept prepared tuples with a leading batch axis.
+    :type kernel: Callable
+    :param zero_diagonal: if True, the similarity of every sample and itself is set to 0.
+    :type zero_diagonal: bool (default=False)
+    :param sample_bound: an optional function that receives a prepared tuple (and the keyword parameters \
+    of the metric), and returns a bound u (between 0 and 1) for every sample, such that the similarity \
+    of samples i and j is at most (1 + u[i] * u[j]) / 2. It allows similarity_graph() to skip tiles.
+    :type sample_bound: Callable or None (default=None)
+    :param tile_temporaries: the approximate number of tile-sized arrays the kernel holds in memory at once \
+    (including the returned tile). It is used by plan_distance() to estimate the peak memory usage.
+    :type tile_temporaries: int (default=2)
+    :param overwrite: if True, an existing metric with the same name is replaced.
+    :type overwrite: bool (default=False)
+    """
+    assert isinstance(name, str), f"'name' must be a string. Instead got {type(name)}."
+    assert callable(prepare) and callable(kernel), "'prepare' and 'kernel' must be callable."
+    assert isinstance(tile_temporaries, int) and tile_temporaries >= 1, \
+        f"'tile_temporaries' must be a positive integer. Instead got {tile_temporaries}."
+    assert overwrite or name not in _METRICS, \
+        f"A metric named '{name}' is already registered. Use overwrite=True to replace it."
+    _METRICS[name] = _Metric(prepare, kernel, zero_diagonal, sample_bound, tile_temporaries)
+
+
+def _available_memory() -> Union[int, None]:
+    """
+    Returns the amount of physical memory currently available, in bytes, \
+    or None if it cannot be determined on this platform.
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _prepared_nbytes(data, metric: _Metric, dtype: np.dtype) -> int:
+    """
+    Estimates the size (in bytes) of the prepared tuple of all samples in 'data', \
+    by preparing a small, evenly spaced subset of the samples.
+    """
+    n_samples = data.shape[0]
+    if n_samples == 0:
+        return 0
+    subset = np.unique(np.linspace(0, n_samples - 1, min(n_samples, 64)).astype(np.intp))
+    return int(np.ceil(_nbytes(metric.prepare(data[subset], dtype)) * n_samples / len(subset)))
+
+
+@_profiled_function
+def plan_distance(data: Union[np.ndarray, sparse.spmatrix], metric: str = 'pearson', rowvar: bool = True,
+                  dtype=float, nan_policy: str = 'propagate', out: Union[np.ndarray, str, os.PathLike, None] = None,
+                  condensed: bool = False, n_jobs: int = 1, memory_limit: Union[int, None] = None) -> ExecutionPlan:
+    """
+    Chooses how pairwise_distance() would compute the pairwise distance matrix of the given data, \
+    and estimates the peak memory usage of the computation, without computing the matrix. \
+    The matrix is computed as a single tile ('dense') if it fits in the memory budget together with \
+    the kernel's intermediate arrays. Otherwise, it is computed in tiles ('blocked'), whose size is halved \
+    until the computation fits in the memory budget. If the output matrix itself does not fit in the budget, \
+    or if 'out' is the path of a file, the matrix is computed directly into a .npy file ('out_of_core'). \
+    If 'out' is an existing array, the matrix is always computed in tiles, \
+    since the output does not require any additional memory. \
+    Stacks of datasets are always computed together ('batched').
+
+    :param data: an n-by-p numpy array of n samples by p features, or a b-by-n-by-p stack of b such arrays. \
+    Sparse matrices are supported for the 'pearson' and 'sharpened_cosine' metrics.
+    :type data: np.ndarray or scipy.sparse matrix
+    :param metric: the name of the distance metric (one of the built-in metrics, or a metric registered \
+    with register_metric()).
+    :type metric: str (default='pearson')
+    :param rowvar: If True, plans the pairwise distance between the rows of 'data'. \
+    If False, plans the pairwise distance between the columns of 'data'.
+    :type rowvar: bool (default=True)
+    :param dtype: the floating-point data type of the computation and of the distance matrix.
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    :param nan_policy: Determines how missing values (NaN) in 'data' are handled. \
+    See pearson_distance() for more details.
+    :type nan_policy: 'propagate' or 'omit' (default='propagate')
+    :param out: the array (or path to an .npy file) the output would be written into. \
+    If None, the output would be allocated in memory.
+    :type out: np.ndarray, str, os.PathLike or None (default=None)
+    :param condensed: if True, plans the computation of only the strict upper triangle of the matrix, \
+    in the condensed layout used by scipy.spatial.distance.pdist.
+    :type condensed: bool (default=False)
+    :param n_jobs: the number of threads (or worker processes, for the 'out_of_core' strategy) \
+    that would compute the tiles concurrently. If -1, all CPU cores are used.
+    :type n_jobs: int (default=1)
+    :param memory_limit: the memory budget, in bytes. If None, the physical memory currently available is used.
+    :type memory_limit: int or None (default=None)
+    :rtype: ExecutionPlan
+    """
+    assert metric in _METRICS, f"'metric' must be one of {sorted(_METRICS)}. Instead got '{metric}'."
+    assert memory_limit is None or memory_limit > 0, \
+        f"'memory_limit' must be a positive number of bytes or None. Instead got {memory_limit}."
+    n_jobs = _check_n_jobs(n_jobs)
+    dtype = _check_dtype(dtype)
+    data = _rowvar(data, rowvar)
+    if sparse.issparse(data):
+        data = sparse.csr_matrix(data)
+    metric_obj = _get_metric(data, metric, nan_policy)
+    available = _available_memory() if memory_limit is None else int(memory_limit)
+    budget = np.inf if available is None else available
+    itemsize = dtype.itemsize
+
+    if _is_batch(data):
+        assert not condensed, "'condensed' is not supported for a stack of datasets."
+        n_batches, n_samples = data.shape[:2]
+        output_bytes = n_batches * n_samples ** 2 * itemsize
+        batch_size = max(1, _DEFAULT_BLOCK_SIZE ** 2 // max(n_samples, 1) ** 2)
+        peak = n_batches * _prepared_nbytes(data[0], metric_obj, dtype) + \
+            min(batch_size, n_batches) * n_samples ** 2 * itemsize * metric_obj.tile_temporaries + \
+            (output_bytes if out is None else 0)
+        return ExecutionPlan('batched', None, output_bytes, peak, available)
+
+    n_samples = data.shape[0]
+    output_bytes = ((n_samples * (n_samples - 1)) // 2 if condensed else n_samples ** 2) * itemsize
+    prepared_bytes = _prepared_nbytes(data, metric_obj, dtype)
+    if out is None and not condensed:
+        # the single tile becomes the output, so the output does not need to be allocated separately
+        peak = prepared_bytes + n_samples ** 2 * itemsize * metric_obj.tile_temporaries
+        if peak <= budget:
+            return ExecutionPlan('dense', None, output_bytes, peak, available)
+
+    on_disk = isinstance(out, (str, os.PathLike))
+    allocated_bytes = output_bytes if out is None else 0
+    block_size = _DEFAULT_BLOCK_SIZE
+    while True:
+        tile_bytes = min(block_size, n_samples) ** 2 * itemsize * metric_obj.tile_temporaries * n_jobs
+        if prepared_bytes + allocated_bytes + tile_bytes <= budget or block_size <= _MIN_PLAN_BLOCK_SIZE:
+            break
+        block_size //= 2
+
+    block_size = min(block_size, max(n_samples, 1))
+    # an existing output array costs no additional memory, so it is always filled in tiles (of the smallest size,
+    # if even they exceed the budget) rather than moved to the disk
+    if (on_disk and not condensed) or (out is None and prepared_bytes + allocated_bytes + tile_bytes > budget):
+        # out-of-core worker processes receive a copy of the prepared samples each
+        workers_prepared_bytes = prepared_bytes * (n_jobs + 1 if n_jobs > 1 else 1)
+        return ExecutionPlan('out_of_core', block_size, output_bytes, workers_prepared_bytes + tile_bytes, available)
+    return ExecutionPlan('blocked', block_size, output_bytes, prepared_bytes + allocated_bytes + tile_bytes, available)
+
+
+@_profiled_function
+def pairwise_distance(data: Union[np.ndarray, sparse.spmatrix], metric: str = 'pearson', rowvar: bool = True,
+                      similarity: bool = False, dtype=float, nan_policy: str = 'propagate',
+                      out: Union[np.ndarray, str, os.PathLike, None] = None, condensed: bool = False,
+                      n_jobs: int = 1, memory_limit: Union[int, None] = None,
+                      plan: Union[ExecutionPlan, None] = None, **params) -> np.ndarray:
+    """
+    Calculates the pairwise distance matrix for a given array of n samples by p features, \
+    using any of the built-in metrics or a metric registered with register_metric(). \
+    The execution strategy (computing the matrix as a single tile, in tiles, or directly into a file on the disk) \
+    is chosen by plan_distance() according to the size of the data, the data type, the output form \
+    and the available memory. Call plan_distance() with the same arguments to see the chosen strategy \
+    and its estimated peak memory usage before running the computation.
+
+    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on, \
+    or a b-by-n-by-p stack of b such arrays. \
+    Sparse matrices are supported for the 'pearson' and 'sharpened_cosine' metrics.
+    :type data: np.ndarray or scipy.sparse matrix
+    :param metric: the name of the distance metric.
+    :type metric: 'pearson', 'spearman', 'jackknife', 'ys1', 'yr1', 'sharpened_cosine', \
+    or the name of a registered metric (default='pearson')
+    :param rowvar: If True, calculates the pairwise distance between the rows of 'data'. \
+    If False, calculate the pairwise distance between the columns of 'data'.
+    :type rowvar: bool (default=True)
+    :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
+    If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
+    :type similarity: bool (default=False)
+    :param dtype: the floating-point data type of the computation and of the returned matrix. \
+    See pearson_distance() for more details.
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    :param nan_policy: Determines how missing values (NaN) in 'data' are handled. \
+    See pearson_distance() for more details.
+    :type nan_policy: 'propagate' or 'omit' (default='propagate')
+    :param out: the array (or path to an .npy file) to write the output into. If None, a new array is allocated. \
+    If 'out' is a path, the matrix is computed out-of-core (see out_of_core_distance()).
+    :type out: np.ndarray, str, os.PathLike or None (default=None)
+    :param condensed: if True, returns only the strict upper triangle of the matrix, \
+    in the condensed layout used by scipy.spatial.distance.pdist.
+    :type condensed: bool (default=False)
+    :param n_jobs: the number of threads (or worker processes, when computing out-of-core) used to compute \
+    the tiles concurrently. If -1, all CPU cores are used.
+    :type n_jobs: int (default=1)
+    :param memory_limit: the memory budget, in bytes. If None, the physical memory currently available is used.
+    :type memory_limit: int or None (default=None)
+    :param plan: an execution plan returned by plan_distance(). If None, a plan is chosen automatically.
+    :type plan: ExecutionPlan or None (default=None)
+    :param params: additional parameters of the distance metric \
+    (for example 'omega1', 'omega2' and 'omega3' for 'ys1', or 'sharpen_exponent' for 'sharpened_cosine').
+    :return: an n-by-n numpy array of pairwise distance (or similarity) scores \
+    (a memory-mapped array if the matrix was computed out-of-core), \
+    an array of length n(n-1)/2 if 'condensed' is True, \
+    or a b-by-n-by-n array of the matrices of every dataset if 'data' is a stack of datasets.
+    :rtype: np.ndarray
+    """
+    if plan is None:
+        plan = plan_distance(data, metric, rowvar, dtype, nan_policy, out, condensed, n_jobs, memory_limit)
+    assert isinstance(plan, ExecutionPlan), f"'plan' must be an ExecutionPlan or None. Instead got {type(plan)}."
+    data = _rowvar(data, rowvar)
+    if plan.strategy in {'dense', 'batched'}:
+        return _pairwise_distance(data, metric, similarity, None, out, condensed, 1, dtype, nan_policy, **params)
+    if plan.strategy == 'blocked':
+        return _pairwise_distance(data, metric, similarity, plan.block_size, out, condensed, n_jobs, dtype,
+                                  nan_policy, **params)
+    assert plan.strategy == 'out_of_core', f"Unknown execution strategy '{plan.strategy}'."
+    if not isinstance(out, (str, os.PathLike)) or condensed:
+        raise MemoryError(f"The distance matrix ({plan.output_bytes / 2 ** 30:.1f} GiB) does not fit in memory. "
+                          f"Specify the path of an .npy file in 'out' to compute it out-of-core.")
+    return out_of_core_distance(data, out, metric, plan.block_size, True, similarity, dtype, nan_policy, n_jobs,
+                                **params)
+
+
+class PreparedReference:
+    """
+    A set of n reference samples by p features, prepared for computing the distances between them \
+    and any number of query samples. \
+    The row-wise computations of the distance metric on the reference samples \
+    (such as centering, normalizing, ranking, inclines and the positions of the minimal and maximal values) \
+    are performed only once, when the PreparedReference is created, \
+    and are then reused by every call to PreparedReference.distance().
+
+    :param reference: an n-by-p numpy array of n reference samples by p features.
+    :type reference: np.ndarray
+    :param metric: the distance metric to calculate.
+    :type metric: 'pearson', 'spearman', 'jackknife', 'ys1', 'yr1' or 'sharpened_cosine' (default='pearson')
+    :param rowvar: If True, the rows of 'reference' are the reference samples. \
+    If False, the columns of 'reference' are the reference samples.
+    :type rowvar: bool (default=True)
+    :param dtype: the floating-point data type of the computation and of the returned distance matrices. \
+    See pearson_distance() for more details.
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    """
+
+    def __init__(self, reference: np.ndarray, metric: str = 'pearson', rowvar: bool = True, dtype=float):
+        assert metric in _METRICS, f"'metric' must be one of {sorted(_METRICS)}. Instead got '{metric}'."
+        reference = _rowvar(reference, rowvar)
+        assert np.ndim(reference) == 2, f"'reference' must be a 2-dimensional array. Instead got {np.ndim(reference)}."
+        self.metric = metric
+        self.dtype = _check_dtype(dtype)
+        self.n_samples, self.n_features = np.shape(reference)
+        self.prepared = _METRICS[metric].prepare(reference, self.dtype)
+
+    def distance(self, query: np.ndarray, rowvar: bool = True, similarity: bool = False,
+                 block_size: Union[int, None] = None, out: Union[np.ndarray, str, os.PathLike, None] = None,
+                 **params) -> np.ndarray:
+        """
+        Calculates the distance matrix between m query samples and the n reference samples.
+
+        :param query: an m-by-p numpy array of m query samples by p features.
+        :type query: np.ndarray
+        :param rowvar: If True, the rows of 'query' are the query samples. \
+        If False, the columns of 'query' are the query samples.
+        :type rowvar: bool (default=True)
+        :param similarity: If False, returns a distance matrix (0 means closest, 1 means furthest). \
+        If True, returns a similarity matrix (1 means most similar, 0 means most different).
+        :type similarity: bool (default=False)
+        :param block_size: If specified, the distance matrix is computed in tiles of 'block_size' rows \
+        by 'block_size' columns, so that intermediate memory usage is bounded by the tile size rather than by m*n. \
+        If None, the entire matrix is computed in a single step.
+        :type block_size: int or None (default=None)
+        :param out: If specified, the distance matrix is written into 'out' instead of into a new array. \
+        'out' can be an m-by-n numpy array (including an np.memmap), or a path to an .npy file, \
+        which will be created as a memory-mapped array.
+        :type out: np.ndarray, str, os.PathLike or None (default=None)
+        :param params: additional parameters of the distance metric \
+        (for example 'omega1', 'omega2' and 'omega3' for 'ys1', or 'sharpen_exponent' for 'sharpened_cosine').
+        :return: an m-by-n numpy array of the distances between every query sample (rows) \
+        and every reference sample (columns).
+        :rtype: np.ndarray
+        """
+        _check_block_size(block_size)
+        query = _rowvar(query, rowvar)
+        assert np.ndim(query) == 2 and np.shape(query)[1] == self.n_features, \
+            f"'query' must be a 2-dimensional array with {self.n_features} features. " \
+            f"Instead got an array of shape {np.shape(query)}."
+        metric = _METRICS[self.metric]
+        prepared_query = metric.prepare(query, self.dtype)
+        n_queries = len(prepared_query[0])
+        if out is None and (block_size is None or block_size >= max(n_queries, self.n_samples)):
+            tile = metric.kernel(prepared_query, self.prepared, **params)
+            return _similarity(tile, similarity, out=tile)
+
+        shape = (n_queries, self.n_samples)
+        out = np.empty(shape, dtype=self.dtype) if out is None else _open_output(out, shape, self.dtype)
+        if block_size is None:
+            block_size = _DEFAULT_BLOCK_SIZE
+        for row_start in range(0, n_queries, block_size):
+            rows = slice(row_start, min(row_start + block_size, n_queries))
+            for col_start in range(0, self.n_samples, block_size):
+                cols = slice(col_start, min(col_start + block_size, self.n_samples))
+                tile = metric.kernel(_slice_prepared(prepared_query, rows), _slice_prepared(self.prepared, cols),
+                                     **params)
+                out[rows, cols] = _similarity(tile, similarity, out=tile)
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
+
+
+@_profiled_function
+def cross_distance(query: np.ndarray, reference: np.ndarray, metric: str = 'pearson', rowvar: bool = True,
+                   similarity: bool = False, block_size: Union[int, None] = None,
+                   out: Union[np.ndarray, str, os.PathLike, None] = None, dtype=float, **params) -> np.ndarray:
+    """
+    Calculates the distance matrix between m query samples and n reference samples with p features, \
+    without computing the distances within the query samples or within the reference samples. \
+    Unlike the pairwise distance functions, the distance between a query sample and an identical reference sample \
+    is not treated specially (for example, it is not set to 0 for 'sharpened_cosine'). \
+    To compute the distances of many batches of query samples from the same reference samples, \
+    use PreparedReference, which prepares the reference samples only once.
+
+    :param query: an m-by-p numpy array of m query samples by p features.
+    :type query: np.ndarray
+    :param reference: an n-by-p numpy array of n reference samples by p features.
+    :type reference: np.ndarray
+    :param metric: the distance metric to calculate.
+    :type metric: 'pearson', 'spearman', 'jackknife', 'ys1', 'yr1' or 'sharpened_cosine' (default='pearson')
+    :param rowvar: If True, the rows of 'query' and 'reference' are the samples. \
+    If False, the columns of 'query' and 'reference' are the samples.
+    :type rowvar: bool (default=True)
+    :param similarity: If False, returns a distance matrix (0 means closest, 1 means furthest). \
+    If True, returns a similarity matrix (1 means most similar, 0 means most different).
+    :type similarity: bool (default=False)
+    :param block_size: If specified, the distance matrix is computed in tiles of 'block_size' rows \
+    by 'block_size' columns, so that intermediate memory usage is bounded by the tile size rather than by m*n. \
+    If None, the entire matrix is computed in a single step.
+    :type block_size: int or None (default=None)
+    :param out: If specified, the distance matrix is written into 'out' instead of into a new array. \
+    'out' can be an m-by-n numpy array (including an np.memmap), or a path to an .npy file, \
+    which will be created as a memory-mapped array.
+    :type out: np.ndarray, str, os.PathLike or None (default=None)
+    :param dtype: the floating-point data type of the computation and of the returned distance matrix. \
+    See pearson_distance() for more details.
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    :param params: additional parameters of the distance metric \
+    (for example 'omega1', 'omega2' and 'omega3' for 'ys1', or 'sharpen_exponent' for 'sharpened_cosine').
+    :return: an m-by-n numpy array of the distances between every query sample (rows) \
+    and every reference sample (columns).
+    :rtype: np.ndarray
+    """
+    return PreparedReference(reference, metric, rowvar, dtype).distance(query, rowvar, similarity, block_size, out,
+                                                                        **params)
+
+
+class IncrementalDistanceMatrix:
+    """
+    A pairwise distance matrix that can be updated with new samples, \
+    without recomputing the distances between the samples it already contains. \
+    When m new samples are appended to a matrix of n samples, only the distances between the new samples \
+    and all other samples (an m-by-(n+m) block) are computed. \
+    The matrix is stored in a buffer whose capacity grows geometrically (doubling whenever it runs out), \
+    so that the amortized cost of appending a sample is proportional to n rather than to n^2. \
+    The buffer can be kept in memory, or in a memory-mapped .npy file on disk.
+
+    :param data: an optional n-by-p numpy array of n samples by p features, to initialize the matrix with.
+    :type data: np.ndarray or None (default=None)
+    :param metric: the distance metric to calculate.
+    :type metric: 'pearson', 'spearman', 'jackknife', 'ys1', 'yr1' or 'sharpened_cosine' (default='pearson')
+    :param rowvar: If True, the rows of 'data' are the samples. If False, the columns of 'data' are the samples.
+    :type rowvar: bool (default=True)
+    :param similarity: If False, stores a pairwise distance matrix (0 means closest, 1 means furthest). \
+    If True, stores a pairwise similarity matrix (1 means most similar, 0 means most different).
+    :type similarity: bool (default=False)
+    :param path: If specified, the buffer is stored in a memory-mapped .npy file at this path. \
+    The file holds a capacity-by-capacity array, of which the first n rows and columns are the distance matrix.
+    :type path: str, os.PathLike or None (default=None)
+    :param block_size: the number of rows and columns in every tile computed during an append, \
+    which bounds the intermediate memory usage of every append.
+    :type block_size: int (default=1024)
+    :param params: additional parameters of the distance metric \
+    (for example 'omega1', 'omega2' and 'omega3' for 'ys1', or 'sharpen_exponent' for 'sharpened_cosine').
+    """
+
+    def __init__(self, data: Union[np.ndarray, None] = None, metric: str = 'pearson', rowvar: bool = True,
+                 similarity: bool = False, path: Union[str, os.PathLike, None] = None,
+                 block_size: int = _DEFAULT_BLOCK_SIZE, **params):
+        assert metric in _METRICS, f"'metric' must be one of {sorted(_METRICS)}. Instead got '{metric}'."
+        assert block_size is not None, "'block_size' must be a positive integer. Instead got None."
+        _check_block_size(block_size)
+        self.metric = metric
+        self.similarity = similarity
+        self.path = path
+        self.block_size = block_size
+        self.params = params
+        self._n_samples = 0
+        self._prepared = None
+        self._buffer = np.empty((0, 0))
+        if data is not None:
+            self.append(data, rowvar)
+
+    @property
+    def n_samples(self) -> int:
+        """
+        The number of samples in the matrix.
+        """
+        return self._n_samples
+
+    @property
+    def capacity(self) -> int:
+        """
+        The number of samples the buffer can hold before it has to grow.
+        """
+        return self._buffer.shape[0]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        An n-by-n view of the pairwise distance matrix of all samples appended so far. \
+        The view is invalidated when the buffer grows.
+        """
+        return self._buffer[:self._n_samples, :self._n_samples]
+
+    def _grow(self, n_required: int):
+        """
+        Grows the buffer to a capacity of at least 'n_required' samples, by at least doubling its capacity.
+        """
+        n_samples = self._n_samples
+        capacity = max(n_required, 2 * self.capacity)
+        if self.path is None:
+            buffer = np.empty((capacity, capacity))
+            buffer[:n_samples, :n_samples] = self.matrix
+            self._buffer = buffer
+            return
+        if n_samples == 0:
+            self._buffer = np.lib.format.open_memmap(self.path, mode='w+', dtype=float, shape=(capacity, capacity))
+            return
+
+        tmp_path = os.fspath(self.path) + '.tmp'
+        buffer = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=float, shape=(capacity, capacity))
+        for start in range(0, n_samples, self.block_size):
+            rows = slice(start, min(start + self.block_size, n_samples))
+            buffer[rows, :n_samples] = self._buffer[rows, :n_samples]
+        buffer.flush()
+        del buffer
+        self._buffer = None
+        os.replace(tmp_path, self.path)
+        self._buffer = np.lib.format.open_memmap(self.path, mode='r+')
+
+    def append(self, data: np.ndarray, rowvar: bool = True):
+        """
+        Appends new samples to the matrix, and computes their distances from all other samples.
+
+        :param data: an m-by-p numpy array of m new samples by p features.
+        :type data: np.ndarray
+        :param rowvar: If True, the rows of 'data' are the samples. If False, the columns of 'data' are the samples.
+        :type rowvar: bool (default=True)
+        """
+        data = _rowvar(data, rowvar)
+        assert np.ndim(data) == 2, f"'data' must be a 2-dimensional array. Instead got {np.ndim(data)}."
+        metric = _METRICS[self.metric]
+        prepared = metric.prepare(data, float)
+        if self._prepared is not None:
+            n_features = self._prepared[0].shape[1]
+            assert np.shape(data)[1] == n_features, \
+                f"'data' must have {n_features} features. Instead got {np.shape(data)[1]}."
+        n_old = self._n_samples
+        n_new = len(prepared[0])
+        if n_new == 0:
+            return
+        if n_old + n_new > self.capacity:
+            self._grow(n_old + n_new)
+
+        # distances among the new samples (only the tiles on or above the diagonal, mirrored below it)
+        new = self._buffer[n_old:n_old + n_new, n_old:n_old + n_new]
+        for rows, cols in _tile_slices(n_new, self.block_size, upper_only=True):
+            tile = _compute_tile(prepared, metric, self.params, rows, cols)
+            new[rows, cols] = _similarity(tile, self.similarity, out=tile)
+            if rows != cols:
+                new[cols, rows] = tile.T
+        # distances between the new samples and the existing samples
+        for start in range(0, n_new, self.block_size):
+            rows = slice(start, min(start + self.block_size, n_new))
+            buffer_rows = slice(n_old + rows.start, n_old + rows.stop)
+            for col_start in range(0, n_old, self.block_size):
+                cols = slice(col_start, min(col_start + self.block_size, n_old))
+                tile = metric.kernel(_slice_prepared(prepared, rows), _slice_prepared(self._prepared, cols),
+                                     **self.params)
+                tile = _similarity(tile, self.similarity, out=tile)
+                self._buffer[buffer_rows, cols] = tile
+                self._buffer[cols, buffer_rows] = tile.T
+
+        self._prepared = prepared if self._prepared is None else \
+            tuple(np.concatenate((old, arr)) for old, arr in zip(self._prepared, prepared))
+        self._n_samples = n_old + n_new
+        self.flush()
+
+    def flush(self):
+        """
+        Writes any changes to the matrix to the disk, if it is stored in a memory-mapped file.
+        """
+        if isinstance(self._buffer, np.memmap):
+            self._buffer.flush()
+
+
+class PearsonAccumulator:
+    """
+    Accumulates the pairwise Pearson correlation of n samples from their features (columns), \
+    which can be supplied one at a time or in chunks, as they become available. \
+    Only the sufficient statistics of the features seen so far are kept in memory \
+    (the sum and sum of squares of every sample, and the n-by-n matrix of cross products between samples), \
+    so wide data can be processed in a single pass without ever holding all of its features in memory. \
+    To keep the sufficient statistics well-conditioned, every sample is shifted by its first feature \
+    before it is accumulated (Pearson correlation is invariant to such shifts). \
+    The Pearson correlation (or distance) of the features seen so far can be computed at any point.
+
+    :param n_samples: the number of samples.
+    :type n_samples: int
+    """
+
+    def __init__(self, n_samples: int):
+        assert isinstance(n_samples, (int, np.integer)) and n_samples > 0, \
+            f"'n_samples' must be a positive integer. Instead got {n_samples}."
+        self.n_samples = n_samples
+        self.n_features = 0
+        self._shift = None
+        self._sums = np.zeros(n_samples)
+        self._sums_of_squares = np.zeros(n_samples)
+        self._cross_products = np.zeros((n_samples, n_samples))
 
-def spearman_distance(data: np.ndarray, rowvar: bool = True, similarity: bool = False) -> np.ndarray:
+    def update(self, features: np.ndarray, rowvar: bool = True):
+        """
+        Adds features to the accumulated sufficient statistics.
+
+        :param features: an n-by-c numpy array of n samples by c new features, \
+        or a numpy array of length n containing a single new feature.
+        :type features: np.ndarray
+        :param rowvar: If True, the rows of 'features' are the samples. \
+        If False, the columns of 'features' are the samples.
+        :type rowvar: bool (default=True)
+        """
+        features = np.asarray(features, dtype=float)
+        if features.ndim == 1:
+            features = features[:, np.newaxis]
+        else:
+            features = _rowvar(features, rowvar)
+        assert features.ndim == 2 and features.shape[0] == self.n_samples, \
+            f"'features' must contain {self.n_samples} samples. Instead got an array of shape {features.shape}."
+        if features.shape[1] == 0:
+            return
+        if self._shift is None:
+            self._shift = features[:, 0].copy()
+        shifted = features - self._shift[:, np.newaxis]
+        self._sums += shifted.sum(axis=1)
+        self._sums_of_squares += np.einsum('ij,ij->i', shifted, shifted)
+        self._cross_products += shifted @ shifted.T
+        self.n_features += features.shape[1]
+
+    def correlation(self) -> np.ndarray:
+        """
+        Calculates the pairwise Pearson correlation matrix of the features seen so far. \
+        The correlation of a sample whose features are all equal is NaN.
+
+        :return: an n-by-n numpy array of Pearson correlation coefficients.
+        :rtype: np.ndarray
+        """
+        assert self.n_features > 0, "No features have been accumulated yet."
+        means = self._sums / self.n_features
+        covariance = self._cross_products - np.outer(self._sums, means)
+        stddev = np.sqrt(np.maximum(self._sums_of_squares - self._sums * means, 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covariance /= stddev[:, np.newaxis]
+            covariance /= stddev[np.newaxis, :]
+        return np.clip(covariance, -1, 1, out=covariance)
+
+    def pearson_distance(self, similarity: bool = False) -> np.ndarray:
+        """
+        Calculates the pairwise Pearson-correlation distance matrix of the features seen so far. \
+        See pearson_distance() for more details.
+
+        :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
+        If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
+        :type similarity: bool (default=False)
+        :rtype: np.ndarray
+        """
+        similarity_mat = self.correlation()
+        similarity_mat += 1
+        similarity_mat /= 2
+        return _similarity(similarity_mat, similarity, out=similarity_mat)
+
+
+@_profiled_function
+def spearman_distance(data: np.ndarray, rowvar: bool = True, similarity: bool = False,
+                      block_size: Union[int, None] = None,
+                      out: Union[np.ndarray, str, os.PathLike, None] = None, condensed: bool = False,
+                      n_jobs: int = 1, dtype=float,
+                      nan_policy: str = 'propagate', sketch_size: Union[int, None] = None,
+                      seed: Union[int, None] = None) -> np.ndarray:
     """
         Calculates the pairwise Spearman-correlation distance matrix for a given array of n samples by p features.
         The Spearman-correlation distance ranges between 0 (correlation coefficient is 1) \
         and 1 (correlation coefficient is -1).
-        :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on.
-        :type data: np.ndarray
+        :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on. \
+        A stack of b datasets of identical shape (a b-by-n-by-p numpy array, or a list of b n-by-p arrays) \
+        is also accepted. The b pairwise distance matrices are then computed together with batched matrix products.
+        :type data: np.ndarray or a stack of datasets
         :param rowvar: If True, calculates the pairwise distance between the rows of 'data'. \
         If False, calculate the pairwise distance between the columns of 'data'.
         :type rowvar: bool (default=True)
         :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
         If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
         :type similarity: bool (default=False)
-        :return: an n-by-n numpy array of pairwise Spearman-correlation dissimilarity scores.
+        :param block_size: If specified, the pairwise distance matrix is computed in tiles of 'block_size' rows \
+        by 'block_size' columns, so that intermediate memory usage is bounded by the tile size rather than by n^2. \
+        If None, the entire matrix is computed in a single step.
+        :type block_size: int or None (default=None)
+        :param out: If specified, the pairwise distance matrix is written into 'out' instead of into a new array. \
+        'out' can be an n-by-n numpy array (or an array of length n(n-1)/2 if 'condensed' is True), \
+        including an np.memmap, or a path to an .npy file, which will be created as a memory-mapped array. \
+        If 'block_size' is not specified, the matrix is then computed in tiles of 1024 rows by 1024 columns, \
+        so that only one copy of it is held in memory.
+        :type out: np.ndarray, str, os.PathLike or None (default=None)
+        :param condensed: If True, returns only the strict upper triangle of the pairwise distance matrix, \
+        as an array of length n(n-1)/2 in the condensed layout of scipy.spatial.distance.pdist \
+        (which can be passed directly to scipy.cluster.hierarchy.linkage). \
+        Only the tiles on or above the diagonal of the matrix are computed. If 'block_size' is not specified, \
+        the matrix is computed in tiles of 1024 rows by 1024 columns.
+        :type condensed: bool (default=False)
+        :param n_jobs: The number of threads used to compute the tiles of the pairwise distance matrix concurrently. \
+        If -1, all available CPU cores are used. If 'block_size' is not specified and n_jobs != 1, \
+        the matrix is computed in tiles of 1024 rows by 1024 columns. \
+        The result is identical to the result of the serial computation with the same 'block_size'.
+        :type n_jobs: int (default=1)
+        :param dtype: The floating-point data type of the computation and of the returned matrix. \
+        Using np.float32 halves the memory usage of the computation (and speeds up its matrix products) \
+        at the cost of accuracy: for typical data, distances computed in float32 differ from the distances \
+        computed in float64 by less than 1e-6 (less than 1e-5 for sharpened cosine distance).
+        :type dtype: np.float32 or np.float64 (default=np.float64)
+        :param nan_policy: Determines how missing values (NaN) in 'data' are handled. \
+        If 'propagate', the distance between a sample with missing values and any other sample is NaN. \
+        If 'omit', the distance between every pair of samples is calculated over the features observed \
+        in both samples (pairwise-complete observations). \
+        Every sample is ranked among its own observed values.
+        :type nan_policy: 'propagate' or 'omit' (default='propagate')
+        :param sketch_size: If specified, the distances are approximated from a random sketch of the samples: \
+        every ranked, centered and normalized sample is projected onto 'sketch_size' dimensions \
+        (with a CountSketch, which adds every feature to a random dimension with a random sign), \
+        and the correlation coefficients are calculated between the projected samples. \
+        This reduces the cost of the pairwise products from O(n^2 * p) to O(n^2 * sketch_size) \
+        (plus O(n * p) for the projection), which is worthwhile when p is much larger than 'sketch_size'. \
+        The approximation error of every correlation coefficient r has a standard deviation of about \
+        sqrt((1 + r^2) / sketch_size) (so the error of the distance is about half of that): \
+        for example, about 0.016 in distance for sketch_size=1024, and about 0.008 for sketch_size=4096. \
+        Not supported with nan_policy='omit'.
+        :type sketch_size: int or None (default=None)
+        :param seed: the seed of the random sketch. Calls with the same seed and 'sketch_size' \
+        use the same random sketch, and return identical results.
+        :type seed: int or None (default=None)
+        :return: an n-by-n numpy array of pairwise Spearman-correlation dissimilarity scores, \
+        or an array of length n(n-1)/2 if 'condensed' is True, \
+        or a b-by-n-by-n numpy array if 'data' is a stack of datasets.
         :rtype: np.ndarray
         """
     data = _rowvar(data, rowvar)
-    similarity_mat = _correlation_star(data, 'spearman')
-    return _similarity(similarity_mat, similarity)
+    metric = 'spearman' if sketch_size is None else _sketch_metric('spearman', sketch_size, seed, nan_policy)
+    return _pairwise_distance(data, metric, similarity, block_size, out, condensed, n_jobs, dtype,
+                              nan_policy=nan_policy)
 
 
-def pearson_distance(data: np.ndarray, rowvar: bool = True, similarity: bool = False) -> np.ndarray:
+@_profiled_function
+def pearson_distance(data: Union[np.ndarray, sparse.spmatrix], rowvar: bool = True, similarity: bool = False,
+                     block_size: Union[int, None] = None,
+                     out: Union[np.ndarray, str, os.PathLike, None] = None, condensed: bool = False,
+                     n_jobs: int = 1, dtype=float,
+                     nan_policy: str = 'propagate', sketch_size: Union[int, None] = None,
+                     seed: Union[int, None] = None) -> np.ndarray:
     """
     Calculates the pairwise Pearson-correlation distance matrix for a given array of n samples by p features.
     The Pearson-correlation distance ranges between 0 (linear correlation coefficient is 1) \
     and 1 (linear correlation coefficient is -1).
-    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on.
-    :type data: np.ndarray
+    :param data: an n-by-p numpy array (or scipy.sparse matrix) of n samples by p features, \
+    to calculate pairwise distance on. Sparse matrices are never densified: \
+    the dot products between samples are computed with sparse matrix products, \
+    and the samples are centered algebraically (by correcting their dot products with their means). \
+    A stack of b datasets of identical shape (a b-by-n-by-p numpy array, or a list of b n-by-p arrays) \
+    is also accepted. The b pairwise distance matrices are then computed together with batched matrix products.
+    :type data: np.ndarray, scipy.sparse matrix or a stack of datasets
     :param rowvar: If True, calculates the pairwise distance between the rows of 'data'. \
     If False, calculate the pairwise distance between the columns of 'data'.
     :type rowvar: bool (default=True)
     :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
     If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
     :type similarity: bool (default=False)
-    :return: an n-by-n numpy array of pairwise Pearson-correlation dissimilarity scores.
+    :param block_size: If specified, the pairwise distance matrix is computed in tiles of 'block_size' rows \
+    by 'block_size' columns, so that intermediate memory usage is bounded by the tile size rather than by n^2. \
+    If None, the entire matrix is computed in a single step.
+    :type block_size: int or None (default=None)
+    :param out: If specified, the pairwise distance matrix is written into 'out' instead of into a new array. \
+    'out' can be an n-by-n numpy array (or an array of length n(n-1)/2 if 'condensed' is True), \
+    including an np.memmap, or a path to an .npy file, which will be created as a memory-mapped array. \
+    If 'block_size' is not specified, the matrix is then computed in tiles of 1024 rows by 1024 columns, \
+    so that only one copy of it is held in memory.
+    :type out: np.ndarray, str, os.PathLike or None (default=None)
+    :param condensed: If True, returns only the strict upper triangle of the pairwise distance matrix, \
+    as an array of length n(n-1)/2 in the condensed layout of scipy.spatial.distance.pdist \
+    (which can be passed directly to scipy.cluster.hierarchy.linkage). \
+    Only the tiles on or above the diagonal of the matrix are computed. If 'block_size' is not specified, \
+    the matrix is computed in tiles of 1024 rows by 1024 columns.
+    :type condensed: bool (default=False)
+    :param n_jobs: The number of threads used to compute the tiles of the pairwise distance matrix concurrently. \
+    If -1, all available CPU cores are used. If 'block_size' is not specified and n_jobs != 1, \
+    the matrix is computed in tiles of 1024 rows by 1024 columns. \
+    The result is identical to the result of the serial computation with the same 'block_size'.
+    :type n_jobs: int (default=1)
+    :param dtype: The floating-point data type of the computation and of the returned matrix. \
+    Using np.float32 halves the memory usage of the computation (and speeds up its matrix products) \
+    at the cost of accuracy: for typical data, distances computed in float32 differ from the distances \
+    computed in float64 by less than 1e-6 (less than 1e-5 for sharpened cosine distance).
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    :param nan_policy: Determines how missing values (NaN) in 'data' are handled. \
+    If 'propagate', the distance between a sample with missing values and any other sample is NaN. \
+    If 'omit', the distance between every pair of samples is calculated over the features observed \
+    in both samples (pairwise-complete observations).
+    :type nan_policy: 'propagate' or 'omit' (default='propagate')
+    :param sketch_size: If specified, the distances are approximated from a random sketch of the samples: \
+    every centered and normalized sample is projected onto 'sketch_size' dimensions \
+    (with a CountSketch, which adds every feature to a random dimension with a random sign), \
+    and the correlation coefficients are calculated between the projected samples. \
+    This reduces the cost of the pairwise products from O(n^2 * p) to O(n^2 * sketch_size) \
+    (plus O(n * p) for the projection), which is worthwhile when p is much larger than 'sketch_size'. \
+    The approximation error of every correlation coefficient r has a standard deviation of about \
+    sqrt((1 + r^2) / sketch_size) (so the error of the distance is about half of that): \
+    for example, about 0.016 in distance for sketch_size=1024, and about 0.008 for sketch_size=4096. \
+    Not supported with nan_policy='omit'.
+    :type sketch_size: int or None (default=None)
+    :param seed: the seed of the random sketch. Calls with the same seed and 'sketch_size' \
+    use the same random sketch, and return identical results.
+    :type seed: int or None (default=None)
+    :return: an n-by-n numpy array of pairwise Pearson-correlation dissimilarity scores, \
+    or an array of length n(n-1)/2 if 'condensed' is True, \
+    or a b-by-n-by-n numpy array if 'data' is a stack of datasets.
     :rtype: np.ndarray
     """
     data = _rowvar(data, rowvar)
-    similarity_mat = _correlation_star(data, 'pearson')
-    return _similarity(similarity_mat, similarity)
+    metric = 'pearson' if sketch_size is None else _sketch_metric('pearson', sketch_size, seed, nan_policy)
+    return _pairwise_distance(data, metric, similarity, block_size, out, condensed, n_jobs, dtype,
+                              nan_policy=nan_policy)
 
 
-def sharpened_cosine_distance(data: np.ndarray, sharpen_exponent: float = 16, exp_noise_floor: float = 0.1,
-                              rowvar: bool = True, similarity: bool = False) -> np.ndarray:
+@_profiled_function
+def sharpened_cosine_distance(data: Union[np.ndarray, sparse.spmatrix], sharpen_exponent: float = 16,
+                              exp_noise_floor: float = 0.1, rowvar: bool = True, similarity: bool = False,
+                              block_size: Union[int, None] = None,
+                              out: Union[np.ndarray, str, os.PathLike, None] = None,
+                              condensed: bool = False, n_jobs: int = 1, dtype=float) -> np.ndarray:
     """
     Calculates the pairwise sharpened cosine distance matrix for a given array of n samples by p features, \
     as described in a since-deleted tweet by Brandon Rohrer. \
     You can read more about sharpened cosine distance `here <https://github.com/brohrer/sharpened-cosine-similarity>_. \
     The sharpened cosine distance ranges between 0 (highest similarity) and 1 (highest dissimilarity).
-    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on.
-    :type data: np.ndarray
-    :param sharpen_exponent: 
+    :param data: an n-by-p numpy array (or scipy.sparse matrix) of n samples by p features, \
+    to calculate pairwise distance on. Sparse matrices are never densified: \
+    the dot products between samples are computed with sparse matrix products. \
+    A stack of b datasets of identical shape (a b-by-n-by-p numpy array, or a list of b n-by-p arrays) \
+    is also accepted. The b pairwise distance matrices are then computed together with batched matrix products.
+    :type data: np.ndarray, scipy.sparse matrix or a stack of datasets
+    :param sharpen_exponent:
     :type sharpen_exponent: float (default=16)
-    :param exp_noise_floor: 
+    :param exp_noise_floor:
     :type exp_noise_floor: float (default=0.1)
     :param rowvar: If True, calculates the pairwise distance between the rows of 'data'. \
     If False, calculate the pairwise distance between the columns of 'data'.
@@ -95,31 +2081,302 @@ def sharpened_cosine_distance(data: np.ndarray, sharpen_exponent: float = 16, ex
     :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
     If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
     :type similarity: bool (default=False)
-    :return: an n-by-n numpy array of pairwise sharpened cosine distance scores.
+    :param block_size: If specified, the pairwise distance matrix is computed in tiles of 'block_size' rows \
+    by 'block_size' columns, so that intermediate memory usage is bounded by the tile size rather than by n^2. \
+    If None, the entire matrix is computed in a single step.
+    :type block_size: int or None (default=None)
+    :param out: If specified, the pairwise distance matrix is written into 'out' instead of into a new array. \
+    'out' can be an n-by-n numpy array (or an array of length n(n-1)/2 if 'condensed' is True), \
+    including an np.memmap, or a path to an .npy file, which will be created as a memory-mapped array. \
+    If 'block_size' is not specified, the matrix is then computed in tiles of 1024 rows by 1024 columns, \
+    so that only one copy of it is held in memory.
+    :type out: np.ndarray, str, os.PathLike or None (default=None)
+    :param condensed: If True, returns only the strict upper triangle of the pairwise distance matrix, \
+    as an array of length n(n-1)/2 in the condensed layout of scipy.spatial.distance.pdist \
+    (which can be passed directly to scipy.cluster.hierarchy.linkage). \
+    Only the tiles on or above the diagonal of the matrix are computed. If 'block_size' is not specified, \
+    the matrix is computed in tiles of 1024 rows by 1024 columns.
+    :type condensed: bool (default=False)
+    :param n_jobs: The number of threads used to compute the tiles of the pairwise distance matrix concurrently. \
+    If -1, all available CPU cores are used. If 'block_size' is not specified and n_jobs != 1, \
+    the matrix is computed in tiles of 1024 rows by 1024 columns. \
+    The result is identical to the result of the serial computation with the same 'block_size'.
+    :type n_jobs: int (default=1)
+    :param dtype: The floating-point data type of the computation and of the returned matrix. \
+    Using np.float32 halves the memory usage of the computation (and speeds up its matrix products) \
+    at the cost of accuracy: for typical data, distances computed in float32 differ from the distances \
+    computed in float64 by less than 1e-6 (less than 1e-5 for sharpened cosine distance).
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    :return: an n-by-n numpy array of pairwise sharpened cosine distance scores, \
+    or an array of length n(n-1)/2 if 'condensed' is True, \
+    or a b-by-n-by-n numpy array if 'data' is a stack of datasets.
     :rtype: np.ndarray
     """
     data = _rowvar(data, rowvar)
-    similarity_mat = _sharpened_cosine(data, sharpen_exponent, exp_noise_floor)
-    return _similarity(similarity_mat, similarity)
+    return _pairwise_distance(data, 'sharpened_cosine', similarity, block_size, out, condensed, n_jobs, dtype,
+                              sharpen_exponent=sharpen_exponent, exp_noise_floor=exp_noise_floor)
 
 
-def _sharpened_cosine(data, sharpen_exponent: float, exp_noise_floor: float) -> np.ndarray:
-    n_samples = data.shape[0]
-    similarities = np.zeros((n_samples, n_samples))
-    for i in range(n_samples):
-        for j in range(i + 1, n_samples):
-            dot_product = np.dot(data[i, :], data[j, :])
-            this_similarity = np.sign(dot_product) * (
-                    dot_product / ((np.linalg.norm(data[i, :]) + exp_noise_floor) *
-                                   (np.linalg.norm(data[j, :]) + exp_noise_floor))) ** sharpen_exponent
-
-            this_similarity = (this_similarity + 1) / 2
-            similarities[i, j] = this_similarity
-            similarities[j, i] = this_similarity
+def _sharpened_cosine(data: np.ndarray, sharpen_exponent: float, exp_noise_floor: float) -> np.ndarray:
+    """
+    Calculates the pairwise sharpened cosine similarity matrix of the rows of 'data'. \
+    The norm of every sample is calculated once, and all pairwise dot products are obtained from a single \
+    Gram-matrix product. The sign, exponent and noise-floor transform is then applied element-wise. \
+    By convention, the similarity of every sample with itself (the diagonal of the matrix) is 0.
+
+    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise similarity on.
+    :type data: np.ndarray
+    :param sharpen_exponent: the exponent to which the cosine similarity is raised.
+    :type sharpen_exponent: float
+    :param exp_noise_floor: a constant added to the norm of each sample before normalization.
+    :type exp_noise_floor: float
+    :return: an n-by-n numpy array of pairwise sharpened cosine similarity scores.
+    :rtype: np.ndarray
+    """
+    prepared = _sharpened_cosine_rows(data)
+    similarities = _sharpened_cosine_block(prepared, prepared, sharpen_exponent, exp_noise_floor)
+    np.fill_diagonal(similarities, 0)
+    return similarities
+
+
+def _sharpened_cosine_bound(norms: np.ndarray, sharpen_exponent: float = 16, exp_noise_floor: float = 0.1
+                            ) -> np.ndarray:
+    """
+    Returns a bound u for every sample, such that the sharpened cosine similarity of samples i and j \
+    is at most (1 + u[i] * u[j]) / 2. By the Cauchy-Schwarz inequality, |x . y| / ((|x| + f) * (|y| + f)) is at most \
+    (|x| / (|x| + f)) * (|y| / (|y| + f)), so u = (|x| / (|x| + f)) ^ sharpen_exponent.
+
+    :param norms: the norms of the samples.
+    :type norms: np.ndarray
+    :param sharpen_exponent: the exponent to which the cosine similarity is raised.
+    :type sharpen_exponent: float
+    :param exp_noise_floor: a constant added to the norm of each sample before normalization.
+    :type exp_noise_floor: float
+    :rtype: np.ndarray
+    """
+    return (norms / (norms + exp_noise_floor)) ** sharpen_exponent
+
+
+@_profiled
+def _sharpened_cosine_rows(data: np.ndarray, dtype=float) -> tuple:
+    """
+    Prepares the samples of 'data' for the sharpened cosine similarity kernel.
+
+    :param data: an n-by-p numpy array of n samples by p features.
+    :type data: np.ndarray
+    :param dtype: the floating-point data type of the prepared samples.
+    :type dtype: numpy dtype (default=float)
+    :return: a tuple of the samples (as a float array) and their norms.
+    :rtype: tuple
+    """
+    data = np.asarray(data, dtype=dtype)
+    return data, np.linalg.norm(data, axis=1)
+
+
+@_profiled
+def _sharpened_cosine_block(prepared_a: tuple, prepared_b: tuple, sharpen_exponent: float = 16,
+                            exp_noise_floor: float = 0.1) -> np.ndarray:
+    """
+    Calculates the sharpened cosine similarity tile between two sets of prepared samples. \
+    All dot products are obtained from a single matrix product, \
+    and the sign, exponent and noise-floor transform is then applied element-wise.
+
+    :param prepared_a: the prepared tuple of m samples, as returned by _sharpened_cosine_rows().
+    :type prepared_a: tuple
+    :param prepared_b: the prepared tuple of k samples, as returned by _sharpened_cosine_rows().
+    :type prepared_b: tuple
+    :param sharpen_exponent: the exponent to which the cosine similarity is raised.
+    :type sharpen_exponent: float
+    :param exp_noise_floor: a constant added to the norm of each sample before normalization.
+    :type exp_noise_floor: float
+    :return: an m-by-k numpy array of sharpened cosine similarity scores.
+    :rtype: np.ndarray
+    """
+    data_a, norms_a = prepared_a
+    data_b, norms_b = prepared_b
+    return _sharpen_dot_products(data_a @ data_b.swapaxes(-1, -2), norms_a, norms_b, sharpen_exponent, exp_noise_floor)
+
+
+def _sharpen_dot_products(dot_products: np.ndarray, norms_a: np.ndarray, norms_b: np.ndarray,
+                          sharpen_exponent: float, exp_noise_floor: float) -> np.ndarray:
+    """
+    Transforms a tile of dot products between two sets of samples into sharpened cosine similarity scores, in-place.
+
+    :param dot_products: an m-by-k numpy array of dot products between m samples and k samples.
+    :type dot_products: np.ndarray
+    :param norms_a: the norms of the m samples.
+    :type norms_a: np.ndarray
+    :param norms_b: the norms of the k samples.
+    :type norms_b: np.ndarray
+    :param sharpen_exponent: the exponent to which the cosine similarity is raised.
+    :type sharpen_exponent: float
+    :param exp_noise_floor: a constant added to the norm of each sample before normalization.
+    :type exp_noise_floor: float
+    :return: an m-by-k numpy array of sharpened cosine similarity scores.
+    :rtype: np.ndarray
+    """
+    similarities = dot_products
+    sign = np.sign(similarities)
+    similarities /= (norms_a + exp_noise_floor)[..., :, None]
+    similarities /= (norms_b + exp_noise_floor)[..., None, :]
+    similarities **= sharpen_exponent
+    similarities *= sign
+    similarities += 1
+    similarities /= 2
+    return similarities
+
+
+@_profiled
+def _sparse_rows(data, dtype=float) -> tuple:
+    """
+    Prepares the samples of a sparse matrix for the sparse correlation* and sharpened cosine kernels. \
+    The samples are stored in CSR format (so that any subset of samples can be sliced efficiently), \
+    and are never densified. \
+    Since the sparse correlation* kernel derives the covariance of every pair of samples by subtracting \
+    two nearly equal numbers, the samples, their sums and their means are always kept in double precision, \
+    and only the norms (and therefore the similarity tiles computed from them) are of the given dtype.
+
+    :param data: an n-by-p scipy.sparse matrix of n samples by p features.
+    :type data: scipy.sparse matrix
+    :param dtype: the floating-point data type of the norms and of the similarity tiles.
+    :type dtype: numpy dtype (default=float)
+    :return: a tuple of the n-by-p CSR matrix of samples, their means, \
+    their norms, and the norms of their mean-centered values. \
+    The centered norm of samples whose values are all equal is NaN.
+    :rtype: tuple
+    """
+    data = sparse.csr_matrix(data, dtype=np.promote_types(dtype, np.float64))
+    n_features = data.shape[1]
+    sums = np.asarray(data.sum(axis=1)).ravel()
+    sums_of_squares = np.asarray(data.multiply(data).sum(axis=1)).ravel()
+    means = sums / n_features
+    # the centered sum of squares is derived algebraically, so it is only zero up to floating-point error
+    centered_squares = sums_of_squares - sums * means
+    centered_squares[centered_squares <= n_features * np.finfo(data.dtype).eps * sums_of_squares] = np.nan
+    return data, means, np.sqrt(sums_of_squares).astype(dtype), np.sqrt(centered_squares).astype(dtype)
+
+
+def _sparse_dot_products(prepared_a: tuple, prepared_b: tuple) -> np.ndarray:
+    """
+    Returns the dense m-by-k matrix of dot products between two sets of prepared sparse samples, \
+    computed by a sparse matrix product.
+    """
+    return np.asarray((prepared_a[0] @ prepared_b[0].T).toarray())
+
+
+@_profiled
+def _sparse_correlation_star_block(prepared_a: tuple, prepared_b: tuple) -> np.ndarray:
+    """
+    Calculates the correlation* similarity tile between two sets of prepared sparse samples. \
+    Instead of centering the samples (which would make them dense), the covariance of every pair of samples \
+    is derived from their dot product by subtracting p times the product of their means. \
+    The dot products and the correction are computed in double precision, \
+    and the tile is then converted to the dtype of the prepared norms.
+
+    :param prepared_a: the prepared tuple of m samples, as returned by _sparse_rows().
+    :type prepared_a: tuple
+    :param prepared_b: the prepared tuple of k samples, as returned by _sparse_rows().
+    :type prepared_b: tuple
+    :return: an m-by-k numpy array of correlation* similarity scores.
+    :rtype: np.ndarray
+    """
+    _, means_a, _, centered_norms_a = prepared_a
+    _, means_b, _, centered_norms_b = prepared_b
+    n_features = prepared_a[0].shape[1]
+    similarities = _sparse_dot_products(prepared_a, prepared_b)
+    similarities -= n_features * np.outer(means_a, means_b)
+    similarities = similarities.astype(centered_norms_a.dtype, copy=False)
+    similarities /= centered_norms_a[:, None]
+    similarities /= centered_norms_b[None, :]
+    np.clip(similarities, -1, 1, out=similarities)
+    similarities += 1
+    similarities /= 2
     return similarities
 
 
-def jackknife_distance(data: np.ndarray, rowvar: bool = True, similarity: bool = False) -> np.ndarray:
+@_profiled
+def _sparse_sharpened_cosine_block(prepared_a: tuple, prepared_b: tuple, sharpen_exponent: float = 16,
+                                   exp_noise_floor: float = 0.1) -> np.ndarray:
+    """
+    Calculates the sharpened cosine similarity tile between two sets of prepared sparse samples.
+
+    :param prepared_a: the prepared tuple of m samples, as returned by _sparse_rows().
+    :type prepared_a: tuple
+    :param prepared_b: the prepared tuple of k samples, as returned by _sparse_rows().
+    :type prepared_b: tuple
+    :param sharpen_exponent: the exponent to which the cosine similarity is raised.
+    :type sharpen_exponent: float
+    :param exp_noise_floor: a constant added to the norm of each sample before normalization.
+    :type exp_noise_floor: float
+    :return: an m-by-k numpy array of sharpened cosine similarity scores.
+    :rtype: np.ndarray
+    """
+    dot_products = _sparse_dot_products(prepared_a, prepared_b).astype(prepared_a[2].dtype, copy=False)
+    return _sharpen_dot_products(dot_products, prepared_a[2], prepared_b[2], sharpen_exponent, exp_noise_floor)
+
+
+def _sketch_metric(method: str, sketch_size: int, seed: Union[int, None], nan_policy: str) -> _Metric:
+    """
+    Returns an implementation of the (approximate) correlation* metric, \
+    whose samples are prepared by _sketch_rows() with the given sketch size and seed.
+    """
+    assert isinstance(sketch_size, (int, np.integer)) and sketch_size > 0, \
+        f"'sketch_size' must be a positive integer or None. Instead got {sketch_size}."
+    assert nan_policy == 'propagate', "nan_policy='omit' is not supported with 'sketch_size'."
+    return _Metric(lambda data, dtype: _sketch_rows(data, method, sketch_size, seed, dtype), _correlation_star_block)
+
+
+@_profiled
+def _sketch_rows(data, method: str, sketch_size: int, seed: Union[int, None] = None, dtype=float) -> tuple:
+    """
+    Prepares the samples of 'data' for the correlation* kernel, by projecting their \
+    (optionally ranked,) centered and normalized values onto a random sketch of 'sketch_size' dimensions. \
+    The sketch is a CountSketch: every feature is added to one random dimension of the sketch, with a random sign. \
+    The dot product of two projected samples is an unbiased estimate of the dot product of the original samples, \
+    and the projection is a sparse matrix product that takes O(n * p) time. \
+    The projected samples are then scaled back to unit norm, \
+    so that their dot products (the estimated correlation coefficients) are between -1 and 1. \
+    Sparse samples are centered algebraically after the projection, and are never densified.
+
+    :param data: an n-by-p numpy array (or scipy.sparse matrix) of n samples by p features.
+    :type data: np.ndarray or scipy.sparse matrix
+    :param method: the correlation metric to approximate. Sparse matrices are only supported for 'pearson'.
+    :type method: 'pearson' or 'spearman'
+    :param sketch_size: the number of dimensions of the sketch.
+    :type sketch_size: int
+    :param seed: the seed of the random sketch.
+    :type seed: int or None (default=None)
+    :param dtype: the floating-point data type of the prepared samples.
+    :type dtype: numpy dtype (default=float)
+    :return: a tuple containing the n-by-sketch_size array of projected samples.
+    :rtype: tuple
+    """
+    n_features = data.shape[1]
+    rng = np.random.default_rng(seed)
+    dimensions = rng.integers(sketch_size, size=n_features)
+    signs = rng.choice([-1.0, 1.0], size=n_features)
+    projection = sparse.csr_matrix((signs, (np.arange(n_features), dimensions)), shape=(n_features, sketch_size))
+    if sparse.issparse(data):
+        assert method == 'pearson', "Sparse input is only supported for the metric 'pearson'."
+        data, means, _, centered_norms = _sparse_rows(data, np.float64)
+        sketch = np.asarray((data @ projection).toarray())
+        # projecting the centered samples is equivalent to subtracting the projection of their means
+        sketch -= np.outer(means, np.asarray(projection.sum(axis=0)).ravel())
+        # the centered norm of samples whose values are all equal is NaN
+        sketch /= centered_norms[:, None]
+    else:
+        sketch = np.asarray(_correlation_rows(data, method, np.promote_types(np.asarray(data).dtype, dtype))[0]
+                            @ projection)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sketch /= np.linalg.norm(sketch, axis=1, keepdims=True)
+    return sketch.astype(dtype, copy=False),
+
+
+@_profiled_function
+def jackknife_distance(data: np.ndarray, rowvar: bool = True, similarity: bool = False,
+                       block_size: Union[int, None] = None,
+                       out: Union[np.ndarray, str, os.PathLike, None] = None, condensed: bool = False,
+                       n_jobs: int = 1, dtype=float) -> np.ndarray:
     """
     Calculates the pairwise Jackknife-correlation distance matrix for a given array of n samples by p features, \
     as described in (Heyer et al. 1999, Genome Res.). \
@@ -131,42 +2388,203 @@ def jackknife_distance(data: np.ndarray, rowvar: bool = True, similarity: bool =
     The Jackknife correlation coefficient for X,Y is formally defined as \
     min(Pearson(X[idx != i],Y[idx != i]) for i in range(p)).
 
-    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on.
-    :type data: np.ndarray
+    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on. \
+    A stack of b datasets of identical shape (a b-by-n-by-p numpy array, or a list of b n-by-p arrays) \
+    is also accepted. The b pairwise distance matrices are then computed together with batched matrix products.
+    :type data: np.ndarray or a stack of datasets
     :param rowvar: If True, calculates the pairwise distance between the rows of 'data'. \
     If False, calculate the pairwise distance between the columns of 'data'.
     :type rowvar: bool (default=True)
     :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
     If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
     :type similarity: bool (default=False)
-    :return: an n-by-n numpy array of pairwise Jackknife dissimilarity scores.
+    :param block_size: If specified, the pairwise distance matrix is computed in tiles of 'block_size' rows \
+    by 'block_size' columns, so that intermediate memory usage is bounded by the tile size rather than by n^2. \
+    If None, the entire matrix is computed in a single step.
+    :type block_size: int or None (default=None)
+    :param out: If specified, the pairwise distance matrix is written into 'out' instead of into a new array. \
+    'out' can be an n-by-n numpy array (or an array of length n(n-1)/2 if 'condensed' is True), \
+    including an np.memmap, or a path to an .npy file, which will be created as a memory-mapped array. \
+    If 'block_size' is not specified, the matrix is then computed in tiles of 1024 rows by 1024 columns, \
+    so that only one copy of it is held in memory.
+    :type out: np.ndarray, str, os.PathLike or None (default=None)
+    :param condensed: If True, returns only the strict upper triangle of the pairwise distance matrix, \
+    as an array of length n(n-1)/2 in the condensed layout of scipy.spatial.distance.pdist \
+    (which can be passed directly to scipy.cluster.hierarchy.linkage). \
+    Only the tiles on or above the diagonal of the matrix are computed. If 'block_size' is not specified, \
+    the matrix is computed in tiles of 1024 rows by 1024 columns.
+    :type condensed: bool (default=False)
+    :param n_jobs: The number of threads used to compute the tiles of the pairwise distance matrix concurrently. \
+    If -1, all available CPU cores are used. If 'block_size' is not specified and n_jobs != 1, \
+    the matrix is computed in tiles of 1024 rows by 1024 columns. \
+    The result is identical to the result of the serial computation with the same 'block_size'.
+    :type n_jobs: int (default=1)
+    :param dtype: The floating-point data type of the computation and of the returned matrix. \
+    Using np.float32 halves the memory usage of the computation (and speeds up its matrix products) \
+    at the cost of accuracy: for typical data, distances computed in float32 differ from the distances \
+    computed in float64 by less than 1e-6 (less than 1e-5 for sharpened cosine distance).
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    :return: an n-by-n numpy array of pairwise Jackknife dissimilarity scores, \
+    or an array of length n(n-1)/2 if 'condensed' is True, \
+    or a b-by-n-by-n numpy array if 'data' is a stack of datasets.
     :rtype: np.ndarray
     """
     data = _rowvar(data, rowvar)
-    similarity_mat = _jackknife(data, _correlation_star, method='pearson')
-    return _similarity(similarity_mat, similarity)
+    return _pairwise_distance(data, 'jackknife', similarity, block_size, out, condensed, n_jobs, dtype)
 
 
-def _jackknife(data: np.ndarray, func, **kwargs) -> np.ndarray:
+@_profiled
+def _jackknife_rows(data: np.ndarray, dtype=float) -> tuple:
     """
-    Returns the element-wise minimum of the output of 'func' over Jackknife resampling (leave-1-out).
+    Prepares the samples of 'data' for the Jackknife correlation kernel.
 
-    :param data: an n-by-p numpy array of n samples by p features to iterate on.
+    :param data: an n-by-p numpy array of n samples by p features.
     :type data: np.ndarray
-    :param func: the function to calculate over 'data'
-    :type func: function
-    :param kwargs: additional constant arguments to supply to 'func'
-    :type kwargs: keworded-arguments
-    :return: an array of the element-wise minimum of the outputs of 'func' over Jackknife resampled arrays.
-    :rtype: numpy array
+    :param dtype: the floating-point data type of the prepared samples.
+    :type dtype: numpy dtype (default=float)
+    :return: a tuple of the median-centered samples, their sums, their sums of squares, \
+    the positions of their maximal and minimal values, and their two largest and two smallest values.
+    :rtype: tuple
     """
-    n = data.shape[1]
-    idx = np.arange(n)
-    return np.min(np.array([func(data[:, idx != i], **kwargs) for i in range(n)]), axis=0)
+    data = np.asarray(data, dtype=np.promote_types(np.asarray(data).dtype, dtype))
+    n_features = data.shape[1]
+    argmax = np.argmax(data, axis=1)
+    argmin = np.argmin(data, axis=1)
+    extremes = np.sort(data, axis=1)[:, [-1, -2, 0, 1]] if n_features > 1 else np.repeat(data, 4, axis=1)
+    # correlation is invariant to shifting each sample, and centering keeps the sufficient statistics well-conditioned.
+    # samples are centered around their median rather than their mean, since a single dominant feature pulls the mean
+    # away from all other features, and the small differences between them would then be lost to rounding.
+    # samples are centered in the precision of the input (if higher than 'dtype') before being converted to 'dtype'
+    data = (data - np.median(data, axis=1, keepdims=True)).astype(dtype, copy=False)
+    sums = data.sum(axis=1)
+    sums_of_squares = np.einsum('ij,ij->i', data, data)
+    return data, sums, sums_of_squares, argmax, argmin, extremes
+
+
+# leaving out a feature that holds all but this fraction of a sample's sum of squares triggers recomputing
+# the sample's statistics from its remaining features (see _jackknife_stddev())
+_JACKKNIFE_RECENTER_TOLERANCE = 0.01
+
+
+def _jackknife_stddev(prepared: tuple, i: int, n_kept: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the sums and the (unnormalized) standard deviations of the prepared samples when feature i is left out, \
+    and a mask of the samples whose sum of squares is dominated by feature i. \
+    The variance of such samples without feature i is the difference between two nearly equal numbers, \
+    so it is recomputed directly from their remaining features, centered around their own mean. \
+    A sample is constant when feature i is left out iff its largest and smallest remaining values are equal. \
+    This is determined exactly from the two largest and two smallest values of each sample, \
+    since the variance derived from the sufficient statistics is only zero up to floating-point error. \
+    The standard deviation of such samples is set to NaN.
+    """
+    data, sums, sums_of_squares, argmax, argmin, extremes = prepared
+    dropped = data[..., i]
+    kept_sums = sums - dropped
+    kept_sums_of_squares = sums_of_squares - dropped ** 2
+    dominated = kept_sums_of_squares < _JACKKNIFE_RECENTER_TOLERANCE * sums_of_squares
+    stddev = np.sqrt(kept_sums_of_squares - kept_sums ** 2 / n_kept)
+    if dominated.any():
+        stddev[dominated] = np.linalg.norm(_jackknife_recentered(data[dominated], i), axis=-1)
+    kept_max = np.where(argmax == i, extremes[..., 1], extremes[..., 0])
+    kept_min = np.where(argmin == i, extremes[..., 3], extremes[..., 2])
+    stddev[kept_max == kept_min] = np.nan
+    return kept_sums, stddev, dominated
+
+
+def _jackknife_recentered(data: np.ndarray, i: int) -> np.ndarray:
+    """
+    Returns the samples of 'data' without feature i, centered around their mean over the remaining features.
+    """
+    kept = np.delete(data, i, axis=-1)
+    kept -= kept.mean(axis=-1, keepdims=True)
+    return kept
+
+
+def _jackknife_dominated_covariance(covariance: np.ndarray, data_a: np.ndarray, data_b: np.ndarray, i: int,
+                                    dominated_a: np.ndarray, dominated_b: np.ndarray):
+    """
+    Recomputes (in-place) the rows and columns of a leave-one-out covariance tile that belong to samples \
+    whose sum of squares is dominated by the left-out feature i (see _jackknife_stddev()), \
+    as the dot products of their recentered remaining features with the remaining features of the other samples. \
+    Since the recentered features sum to zero, the other samples do not need to be centered.
+    """
+    kept_a = np.delete(data_a, i, axis=-1)
+    kept_b = np.delete(data_b, i, axis=-1)
+    kept_a[dominated_a] = _jackknife_recentered(data_a[dominated_a], i)
+    kept_b[dominated_b] = _jackknife_recentered(data_b[dominated_b], i)
+    rows = np.nonzero(dominated_a)
+    covariance[rows] = (kept_b[rows[:-1]] @ kept_a[rows][..., None])[..., 0]
+    cols = np.nonzero(dominated_b)
+    covariance.swapaxes(-1, -2)[cols] = (kept_a[cols[:-1]] @ kept_b[cols][..., None])[..., 0]
+
+
+@_profiled
+def _jackknife_pearson_block(prepared_a: tuple, prepared_b: tuple) -> np.ndarray:
+    """
+    Calculates the tile of minimal leave-one-feature-out Pearson correlation coefficients \
+    between two sets of prepared samples.
+
+    :param prepared_a: the prepared tuple of m samples, as returned by _jackknife_rows().
+    :type prepared_a: tuple
+    :param prepared_b: the prepared tuple of k samples, as returned by _jackknife_rows().
+    :type prepared_b: tuple
+    :return: an m-by-k numpy array of the minimal Pearson correlation coefficients over Jackknife resampling.
+    :rtype: np.ndarray
+    """
+    data_a, data_b = prepared_a[0], prepared_b[0]
+    n_features = data_a.shape[-1]
+    n_kept = n_features - 1
+    cross_products = data_a @ data_b.swapaxes(-1, -2)
+
+    minimum = np.full_like(cross_products, np.inf)
+    covariance = np.empty_like(cross_products)
+    outer = np.empty_like(cross_products)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(n_features):
+            kept_sums_a, stddev_a, dominated_a = _jackknife_stddev(prepared_a, i, n_kept)
+            kept_sums_b, stddev_b, dominated_b = _jackknife_stddev(prepared_b, i, n_kept)
+            np.multiply(data_a[..., :, i, None], data_b[..., None, :, i], out=outer)
+            np.subtract(cross_products, outer, out=covariance)
+            np.multiply(kept_sums_a[..., :, None], kept_sums_b[..., None, :] / n_kept, out=outer)
+            covariance -= outer
+            if dominated_a.any() or dominated_b.any():
+                _jackknife_dominated_covariance(covariance, data_a, data_b, i, dominated_a, dominated_b)
+            covariance /= stddev_a[..., :, None]
+            covariance /= stddev_b[..., None, :]
+            np.minimum(minimum, covariance, out=minimum)
+    # clipping is monotonic, so clipping the minimum is equivalent to clipping every leave-one-out matrix
+    return np.clip(minimum, -1, 1, out=minimum)
+
+
+@_profiled
+def _jackknife_block(prepared_a: tuple, prepared_b: tuple) -> np.ndarray:
+    """
+    Calculates the Jackknife-correlation similarity tile between two sets of prepared samples.
+
+    :param prepared_a: the prepared tuple of m samples, as returned by _jackknife_rows().
+    :type prepared_a: tuple
+    :param prepared_b: the prepared tuple of k samples, as returned by _jackknife_rows().
+    :type prepared_b: tuple
+    :return: an m-by-k numpy array of Jackknife-correlation similarity scores.
+    :rtype: np.ndarray
+    """
+    similarities = _jackknife_pearson_block(prepared_a, prepared_b)
+    similarities += 1
+    similarities /= 2
+    return similarities
+
+
+def _check_omegas(omega1: float, omega2: float, omega3: float):
+    assert (omega1 + omega2 + omega3) == 1, \
+        f"All three omega values must sum to 1. Instead they sum to {omega1 + omega2 + omega3}"
 
 
+@_profiled_function
 def ys1_distance(data: np.ndarray, omega1: float = 0.5, omega2: float = 0.25, omega3: float = 0.25, rowvar: bool = True,
-                 similarity: bool = False) -> np.ndarray:
+                 similarity: bool = False, block_size: Union[int, None] = None,
+                 out: Union[np.ndarray, str, os.PathLike, None] = None, condensed: bool = False,
+                 n_jobs: int = 1, dtype=float,
+                 nan_policy: str = 'propagate') -> np.ndarray:
     """
     Calculates the pairwise YS1 distance matrix for a given array of n samples by p features, \
     as described in (Son YS, Baek J 2008, Pattern Recognition Letters). \
@@ -177,8 +2595,10 @@ def ys1_distance(data: np.ndarray, omega1: float = 0.5, omega2: float = 0.25, om
     The final score (Ys1 i,j) is a weighted average of these three paremeters: \
     YS1 i,j = omega1 * (S* i,j) + omega2 * (A i,j) + omega3 * (M i,j)
 
-    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on.
-    :type data: np.ndarray
+    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on. \
+    A stack of b datasets of identical shape (a b-by-n-by-p numpy array, or a list of b n-by-p arrays) \
+    is also accepted. The b pairwise distance matrices are then computed together with batched matrix products.
+    :type data: np.ndarray or a stack of datasets
     :param omega1: Relative weight of the correlation (S* i,j) component of the YS1 distance. \
     All three relative weights (omega1-3) must add up to exactly 1.0.
     :type omega1: float between 0 and 1
@@ -194,19 +2614,56 @@ def ys1_distance(data: np.ndarray, omega1: float = 0.5, omega2: float = 0.25, om
     :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
     If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
     :type similarity: bool (default=False)
-    :return: an n-by-n numpy array of pairwise YS1 dissimilarity scores.
+    :param block_size: If specified, the pairwise distance matrix is computed in tiles of 'block_size' rows \
+    by 'block_size' columns, so that intermediate memory usage is bounded by the tile size rather than by n^2. \
+    If None, the entire matrix is computed in a single step.
+    :type block_size: int or None (default=None)
+    :param out: If specified, the pairwise distance matrix is written into 'out' instead of into a new array. \
+    'out' can be an n-by-n numpy array (or an array of length n(n-1)/2 if 'condensed' is True), \
+    including an np.memmap, or a path to an .npy file, which will be created as a memory-mapped array. \
+    If 'block_size' is not specified, the matrix is then computed in tiles of 1024 rows by 1024 columns, \
+    so that only one copy of it is held in memory.
+    :type out: np.ndarray, str, os.PathLike or None (default=None)
+    :param condensed: If True, returns only the strict upper triangle of the pairwise distance matrix, \
+    as an array of length n(n-1)/2 in the condensed layout of scipy.spatial.distance.pdist \
+    (which can be passed directly to scipy.cluster.hierarchy.linkage). \
+    Only the tiles on or above the diagonal of the matrix are computed. If 'block_size' is not specified, \
+    the matrix is computed in tiles of 1024 rows by 1024 columns.
+    :type condensed: bool (default=False)
+    :param n_jobs: The number of threads used to compute the tiles of the pairwise distance matrix concurrently. \
+    If -1, all available CPU cores are used. If 'block_size' is not specified and n_jobs != 1, \
+    the matrix is computed in tiles of 1024 rows by 1024 columns. \
+    The result is identical to the result of the serial computation with the same 'block_size'.
+    :type n_jobs: int (default=1)
+    :param dtype: The floating-point data type of the computation and of the returned matrix. \
+    Using np.float32 halves the memory usage of the computation (and speeds up its matrix products) \
+    at the cost of accuracy: for typical data, distances computed in float32 differ from the distances \
+    computed in float64 by less than 1e-6 (less than 1e-5 for sharpened cosine distance).
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    :param nan_policy: Determines how missing values (NaN) in 'data' are handled. \
+    If 'propagate', the distance between a sample with missing values and any other sample is NaN. \
+    If 'omit', the distance between every pair of samples is calculated over the features observed \
+    in both samples (pairwise-complete observations). \
+    Every sample is ranked among its own observed values, inclines that involve a missing value are skipped, \
+    and the positions of the minimal and maximal values of every sample are determined from its observed values.
+    :type nan_policy: 'propagate' or 'omit' (default='propagate')
+    :return: an n-by-n numpy array of pairwise YS1 dissimilarity scores, \
+    or an array of length n(n-1)/2 if 'condensed' is True, \
+    or a b-by-n-by-n numpy array if 'data' is a stack of datasets.
     :rtype: np.ndarray
     """
-    assert (omega1 + omega2 + omega3) == 1, \
-        f"All three omega values must sum to 1. Instead they sum to {omega1 + omega2 + omega3}"
+    _check_omegas(omega1, omega2, omega3)
     data = _rowvar(data, rowvar)
-    similarity_mat = omega1 * _correlation_star(data, 'spearman') + omega2 * _slope_concordance_similarity(
-        data) + omega3 * _minmax_match_similarity(data)
-    return _similarity(similarity_mat, similarity)
+    return _pairwise_distance(data, 'ys1', similarity, block_size, out, condensed, n_jobs, dtype,
+                              nan_policy=nan_policy, omega1=omega1, omega2=omega2, omega3=omega3)
 
 
+@_profiled_function
 def yr1_distance(data, omega1: float = 0.5, omega2: float = 0.25, omega3: float = 0.25, rowvar: bool = True,
-                 similarity: bool = False) -> np.ndarray:
+                 similarity: bool = False, block_size: Union[int, None] = None,
+                 out: Union[np.ndarray, str, os.PathLike, None] = None, condensed: bool = False,
+                 n_jobs: int = 1, dtype=float,
+                 nan_policy: str = 'propagate') -> np.ndarray:
     """
     Calculates the pairwise YR1 distance matrix for a given array of n samples by p features,\
     as described in (Son YS, Baek J 2008, Pattern Recognition Letters). \
@@ -217,8 +2674,10 @@ def yr1_distance(data, omega1: float = 0.5, omega2: float = 0.25, omega3: float
     The final score (Ys1 i,j) is a weighted average of these three paremeters: \
     YS1 i,j = omega1 * (R* i,j) + omega2 * (A i,j) + omega3 * (M i,j)
 
-    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on.
-    :type data: np.ndarray
+    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on. \
+    A stack of b datasets of identical shape (a b-by-n-by-p numpy array, or a list of b n-by-p arrays) \
+    is also accepted. The b pairwise distance matrices are then computed together with batched matrix products.
+    :type data: np.ndarray or a stack of datasets
     :param omega1: Relative weight of the correlation (R* i,j) component of the YR1 distance. \
     All three relative weights (omega1-3) must add up to exactly 1.0.
     :type omega1: float between 0 and 1
@@ -234,17 +2693,282 @@ def yr1_distance(data, omega1: float = 0.5, omega2: float = 0.25, omega3: float
     :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
     If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
     :type similarity: bool (default=False)
-    :return: an n-by-n numpy array of pairwise YR1 dissimilarity scores.
+    :param block_size: If specified, the pairwise distance matrix is computed in tiles of 'block_size' rows \
+    by 'block_size' columns, so that intermediate memory usage is bounded by the tile size rather than by n^2. \
+    If None, the entire matrix is computed in a single step.
+    :type block_size: int or None (default=None)
+    :param out: If specified, the pairwise distance matrix is written into 'out' instead of into a new array. \
+    'out' can be an n-by-n numpy array (or an array of length n(n-1)/2 if 'condensed' is True), \
+    including an np.memmap, or a path to an .npy file, which will be created as a memory-mapped array. \
+    If 'block_size' is not specified, the matrix is then computed in tiles of 1024 rows by 1024 columns, \
+    so that only one copy of it is held in memory.
+    :type out: np.ndarray, str, os.PathLike or None (default=None)
+    :param condensed: If True, returns only the strict upper triangle of the pairwise distance matrix, \
+    as an array of length n(n-1)/2 in the condensed layout of scipy.spatial.distance.pdist \
+    (which can be passed directly to scipy.cluster.hierarchy.linkage). \
+    Only the tiles on or above the diagonal of the matrix are computed. If 'block_size' is not specified, \
+    the matrix is computed in tiles of 1024 rows by 1024 columns.
+    :type condensed: bool (default=False)
+    :param n_jobs: The number of threads used to compute the tiles of the pairwise distance matrix concurrently. \
+    If -1, all available CPU cores are used. If 'block_size' is not specified and n_jobs != 1, \
+    the matrix is computed in tiles of 1024 rows by 1024 columns. \
+    The result is identical to the result of the serial computation with the same 'block_size'.
+    :type n_jobs: int (default=1)
+    :param dtype: The floating-point data type of the computation and of the returned matrix. \
+    Using np.float32 halves the memory usage of the computation (and speeds up its matrix products) \
+    at the cost of accuracy: for typical data, distances computed in float32 differ from the distances \
+    computed in float64 by less than 1e-6 (less than 1e-5 for sharpened cosine distance).
+    :type dtype: np.float32 or np.float64 (default=np.float64)
+    :param nan_policy: Determines how missing values (NaN) in 'data' are handled. \
+    If 'propagate', the distance between a sample with missing values and any other sample is NaN. \
+    If 'omit', the distance between every pair of samples is calculated over the features observed \
+    in both samples (pairwise-complete observations). \
+    Inclines that involve a missing value are skipped, and the positions of the minimal and maximal values \
+    of every sample are determined from its observed values.
+    :type nan_policy: 'propagate' or 'omit' (default='propagate')
+    :return: an n-by-n numpy array of pairwise YR1 dissimilarity scores, \
+    or an array of length n(n-1)/2 if 'condensed' is True, \
+    or a b-by-n-by-n numpy array if 'data' is a stack of datasets.
     :rtype: np.ndarray
     """
 
-    assert isinstance(data, np.ndarray), f"'data' must be a numpy array. Instead got {type(data)}."
-    assert (omega1 + omega2 + omega3) == 1, \
-        f"All three omega values must sum to 1. Instead they sum to {omega1 + omega2 + omega3}"
+    assert isinstance(data, np.ndarray) or (isinstance(data, list) and all(isinstance(i, np.ndarray) for i in data)), \
+        f"'data' must be a numpy array or a list of numpy arrays. Instead got {type(data)}."
+    _check_omegas(omega1, omega2, omega3)
     data = _rowvar(data, rowvar)
-    similarity_mat = omega1 * _correlation_star(data, 'pearson') + omega2 * _slope_concordance_similarity(
-        data) + omega3 * _minmax_match_similarity(data)
-    return _similarity(similarity_mat, similarity)
+    return _pairwise_distance(data, 'yr1', similarity, block_size, out, condensed, n_jobs, dtype,
+                              nan_policy=nan_policy, omega1=omega1, omega2=omega2, omega3=omega3)
+
+
+@_profiled_function
+def ys1_distance_sweep(data: np.ndarray, omegas: Iterable[Tuple[float, float, float]], rowvar: bool = True,
+                       similarity: bool = False,
+                       out: Union[np.ndarray, str, os.PathLike, None] = None) -> Iterator[np.ndarray]:
+    """
+    Calculates the pairwise YS1 distance matrix for a given array of n samples by p features, \
+    for every triplet of relative weights (omega1, omega2, omega3) in 'omegas'. \
+    The correlation (S* i,j), slope concordance (A i,j) and minimum-maximum similarity (M i,j) components \
+    are computed only once, and every pairwise distance matrix is then obtained as their weighted sum, \
+    so sweeping over many triplets costs little more than a single call to ys1_distance(). \
+    The matrices are yielded in the same order as the triplets in 'omegas'.
+
+    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on.
+    :type data: np.ndarray
+    :param omegas: triplets of relative weights (omega1, omega2, omega3) \
+    of the correlation (S* i,j), slope concordance (A i,j) and minimum-maximum similarity (M i,j) components. \
+    The three relative weights of every triplet must add up to exactly 1.0.
+    :type omegas: iterable of (float, float, float) tuples
+    :param rowvar: If True, calculates the pairwise distance between the rows of 'data'. \
+    If False, calculate the pairwise distance between the columns of 'data'.
+    :type rowvar: bool (default=True)
+    :param similarity: If False, yields pairwise distance matrices (0 means closest, 1 means furthest). \
+    If True, yields pairwise similarity matrices (1 means most similar, 0 means most different).
+    :type similarity: bool (default=False)
+    :param out: If specified, every pairwise distance matrix is written into 'out' instead of into a new array, \
+    overwriting the matrix of the previous triplet. 'out' can be an n-by-n numpy array (including an np.memmap), \
+    or a path to an .npy file, which will be created as a memory-mapped array. \
+    Copy the yielded matrices if you need to keep them beyond the next iteration.
+    :type out: np.ndarray, str, os.PathLike or None (default=None)
+    :return: a generator yielding an n-by-n numpy array of pairwise YS1 dissimilarity scores for every triplet.
+    :rtype: Iterator[np.ndarray]
+    """
+    return DistanceContext(data, rowvar).ys1_distance_sweep(omegas, similarity, out)
+
+
+@_profiled_function
+def yr1_distance_sweep(data: np.ndarray, omegas: Iterable[Tuple[float, float, float]], rowvar: bool = True,
+                       similarity: bool = False,
+                       out: Union[np.ndarray, str, os.PathLike, None] = None) -> Iterator[np.ndarray]:
+    """
+    Calculates the pairwise YR1 distance matrix for a given array of n samples by p features, \
+    for every triplet of relative weights (omega1, omega2, omega3) in 'omegas'. \
+    The correlation (R* i,j), slope concordance (A i,j) and minimum-maximum similarity (M i,j) components \
+    are computed only once, and every pairwise distance matrix is then obtained as their weighted sum, \
+    so sweeping over many triplets costs little more than a single call to yr1_distance(). \
+    The matrices are yielded in the same order as the triplets in 'omegas'.
+
+    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distance on.
+    :type data: np.ndarray
+    :param omegas: triplets of relative weights (omega1, omega2, omega3) \
+    of the correlation (R* i,j), slope concordance (A i,j) and minimum-maximum similarity (M i,j) components. \
+    The three relative weights of every triplet must add up to exactly 1.0.
+    :type omegas: iterable of (float, float, float) tuples
+    :param rowvar: If True, calculates the pairwise distance between the rows of 'data'. \
+    If False, calculate the pairwise distance between the columns of 'data'.
+    :type rowvar: bool (default=True)
+    :param similarity: If False, yields pairwise distance matrices (0 means closest, 1 means furthest). \
+    If True, yields pairwise similarity matrices (1 means most similar, 0 means most different).
+    :type similarity: bool (default=False)
+    :param out: If specified, every pairwise distance matrix is written into 'out' instead of into a new array, \
+    overwriting the matrix of the previous triplet. 'out' can be an n-by-n numpy array (including an np.memmap), \
+    or a path to an .npy file, which will be created as a memory-mapped array. \
+    Copy the yielded matrices if you need to keep them beyond the next iteration.
+    :type out: np.ndarray, str, os.PathLike or None (default=None)
+    :return: a generator yielding an n-by-n numpy array of pairwise YR1 dissimilarity scores for every triplet.
+    :rtype: Iterator[np.ndarray]
+    """
+    return DistanceContext(data, rowvar).yr1_distance_sweep(omegas, similarity, out)
+
+
+@_profiled
+def _son_baek_rows(data: np.ndarray, method: str, dtype=float) -> tuple:
+    """
+    Prepares the samples of 'data' for the YS1/YR1 similarity kernel.
+
+    :param data: an n-by-p numpy array of n samples by p features.
+    :type data: np.ndarray
+    :param method: the correlation metric to use when calculating correlation*
+    :type method: 'pearson' or 'spearman'
+    :param dtype: the floating-point data type of the prepared samples.
+    :type dtype: numpy dtype (default=float)
+    :return: a tuple of the correlation-normalized samples, their one-hot incline indicators, \
+    and the positions of their maximal and minimal values.
+    :rtype: tuple
+    """
+    return (_correlation_rows(data, method, dtype)[0], _incline_one_hot(data, dtype), np.argmax(data, axis=1),
+            np.argmin(data, axis=1))
+
+
+@_profiled
+def _son_baek_block(prepared_a: tuple, prepared_b: tuple, omega1: float = 0.5, omega2: float = 0.25,
+                    omega3: float = 0.25) -> np.ndarray:
+    """
+    Calculates the YS1/YR1 similarity tile between two sets of prepared samples, \
+    as the weighted sum omega1 * (correlation*) + omega2 * (slope concordance) + omega3 * (minimum-maximum match).
+
+    :param prepared_a: the prepared tuple of m samples, as returned by _son_baek_rows().
+    :type prepared_a: tuple
+    :param prepared_b: the prepared tuple of k samples, as returned by _son_baek_rows().
+    :type prepared_b: tuple
+    :return: an m-by-k numpy array of YS1/YR1 similarity scores.
+    :rtype: np.ndarray
+    """
+    _check_omegas(omega1, omega2, omega3)
+    if _NUMBA_ENABLED and prepared_a[0].ndim == 2:
+        return _son_baek_block_fused(prepared_a, prepared_b, omega1, omega2, omega3)
+    similarities = _correlation_star_block(prepared_a[:1], prepared_b[:1])
+    similarities *= omega1
+    similarities += omega2 * _slope_concordance_block(prepared_a[1:2], prepared_b[1:2])
+    similarities += omega3 * _minmax_match_block(prepared_a[2:], prepared_b[2:], similarities.dtype)
+    return similarities
+
+
+@_profiled
+def _son_baek_block_fused(prepared_a: tuple, prepared_b: tuple, omega1: float, omega2: float,
+                          omega3: float) -> np.ndarray:
+    """
+    Calculates the YS1/YR1 similarity tile between two sets of prepared samples with a compiled (Numba) kernel. \
+    The dot products between the correlation-normalized samples are computed by a single matrix product \
+    (which also serves as the output tile), and a single fused pass over the tile then replaces \
+    every dot product with the weighted sum of the three components. \
+    The slope concordance component is computed by comparing the inclines of every pair of samples directly, \
+    so no intermediate m-by-k arrays are allocated for the slope concordance or minimum-maximum match components. \
+    The pass is multi-threaded, unless the tile is itself computed by one of the threads of _run_tiles() \
+    (in which case the tiles are already computed in parallel).
+
+    :param prepared_a: the prepared tuple of m samples, as returned by _son_baek_rows().
+    :type prepared_a: tuple
+    :param prepared_b: the prepared tuple of k samples, as returned by _son_baek_rows().
+    :type prepared_b: tuple
+    :return: an m-by-k numpy array of YS1/YR1 similarity scores.
+    :rtype: np.ndarray
+    """
+    similarities = prepared_a[0] @ prepared_b[0].T
+    kernel = _son_baek_fused_serial if getattr(_TILE_WORKER, 'active', False) else _son_baek_fused_parallel
+    kernel(similarities, _incline_codes(prepared_a[1]), _incline_codes(prepared_b[1]), prepared_a[2], prepared_b[2],
+           prepared_a[3], prepared_b[3], omega1, omega2, omega3)
+    return similarities
+
+
+def _incline_codes(one_hot: np.ndarray) -> np.ndarray:
+    """
+    Converts one-hot incline indicators (as returned by _incline_one_hot()) \
+    into an n-by-(p-1) numpy array of inclines (1 for ascending, 0 for flat and -1 for descending).
+    """
+    n_inclines = one_hot.shape[1] // 3
+    return (one_hot[:, :n_inclines] - one_hot[:, 2 * n_inclines:]).astype(np.int8)
+
+
+def _son_baek_fused_kernel(similarities, codes_a, codes_b, argmax_a, argmax_b, argmin_a, argmin_b,
+                           omega1, omega2, omega3):
+    """
+    Replaces every dot product in the m-by-k tile 'similarities' (in-place) with the weighted sum \
+    omega1 * (correlation*) + omega2 * (slope concordance) + omega3 * (minimum-maximum match). \
+    The columns are processed in chunks, so that the inclines of the samples in every chunk stay in the cache \
+    while all rows are processed. When compiled with parallel=True, the rows are processed in parallel.
+    """
+    n_rows, n_cols = similarities.shape
+    n_inclines = codes_a.shape[1]
+    chunk_size = 64
+    for col_start in range(0, n_cols, chunk_size):
+        col_stop = min(col_start + chunk_size, n_cols)
+        for i in numba.prange(n_rows):
+            for j in range(col_start, col_stop):
+                correlation = similarities[i, j]
+                if correlation > 1:
+                    correlation = 1.0
+                elif correlation < -1:
+                    correlation = -1.0
+                matches = 0
+                for t in range(n_inclines):
+                    if codes_a[i, t] == codes_b[j, t]:
+                        matches += 1
+                minmax = 0.5 * (argmax_a[i] == argmax_b[j]) + 0.5 * (argmin_a[i] == argmin_b[j])
+                similarities[i, j] = omega1 * (correlation + 1) / 2 + omega2 * (matches / n_inclines) \
+                    + omega3 * minmax
+
+
+if numba is not None:
+    _son_baek_fused_parallel = numba.njit(parallel=True, nogil=True, error_model='numpy')(_son_baek_fused_kernel)
+    _son_baek_fused_serial = numba.njit(nogil=True, error_model='numpy')(_son_baek_fused_kernel)
+
+# the compiled YS1/YR1 kernel is used if Numba is installed, unless PAIRWISEDIST_DISABLE_NUMBA=1 is set
+_NUMBA_ENABLED = numba is not None and os.environ.get('PAIRWISEDIST_DISABLE_NUMBA', '0') != '1'
+
+
+@_profiled
+def _son_baek_rows_nan_omit(data: np.ndarray, method: str, dtype=float) -> tuple:
+    """
+    Prepares the samples of 'data', which may contain missing values (NaN), \
+    for the pairwise-complete YS1/YR1 similarity kernel. \
+    The positions of the maximal and minimal values of each sample are determined from its observed values.
+
+    :param data: an n-by-p numpy array of n samples by p features.
+    :type data: np.ndarray
+    :param method: the correlation metric to use when calculating correlation*
+    :type method: 'pearson' or 'spearman'
+    :param dtype: the floating-point data type of the prepared samples.
+    :type dtype: numpy dtype (default=float)
+    :return: a tuple of the prepared samples of _correlation_rows_nan_omit(), \
+    the prepared samples of _incline_one_hot_nan_omit(), and the positions of their maximal and minimal values.
+    :rtype: tuple
+    """
+    data = np.asarray(data, dtype=np.promote_types(np.asarray(data).dtype, dtype))
+    missing = np.isnan(data)
+    return (_correlation_rows_nan_omit(data, method, dtype) + _incline_one_hot_nan_omit(data, dtype)
+            + (np.argmax(np.where(missing, -np.inf, data), axis=1), np.argmin(np.where(missing, np.inf, data), axis=1)))
+
+
+@_profiled
+def _son_baek_block_nan_omit(prepared_a: tuple, prepared_b: tuple, omega1: float = 0.5, omega2: float = 0.25,
+                             omega3: float = 0.25) -> np.ndarray:
+    """
+    Calculates the pairwise-complete YS1/YR1 similarity tile between two sets of prepared samples, \
+    as the weighted sum omega1 * (correlation*) + omega2 * (slope concordance) + omega3 * (minimum-maximum match).
+
+    :param prepared_a: the prepared tuple of m samples, as returned by _son_baek_rows_nan_omit().
+    :type prepared_a: tuple
+    :param prepared_b: the prepared tuple of k samples, as returned by _son_baek_rows_nan_omit().
+    :type prepared_b: tuple
+    :return: an m-by-k numpy array of YS1/YR1 similarity scores.
+    :rtype: np.ndarray
+    """
+    _check_omegas(omega1, omega2, omega3)
+    similarities = _correlation_star_block_nan_omit(prepared_a[:3], prepared_b[:3])
+    similarities *= omega1
+    similarities += omega2 * _slope_concordance_block_nan_omit(prepared_a[3:5], prepared_b[3:5])
+    similarities += omega3 * _minmax_match_block(prepared_a[5:], prepared_b[5:], similarities.dtype)
+    return similarities
 
 
 def _minmax_match_similarity(data: np.ndarray) -> np.ndarray:
@@ -258,8 +2982,31 @@ def _minmax_match_similarity(data: np.ndarray) -> np.ndarray:
     :return: an n-by-n numpy array of min-max mismatch similarity scores.
     :rtype: np.ndarray
     """
-    return (np.argmax(data, axis=1)[:, None] == np.argmax(data, axis=1)[None, :]) * 0.5 + (
-            np.argmin(data, axis=1)[:, None] == np.argmin(data, axis=1)[None, :]) * 0.5
+    prepared = np.argmax(data, axis=1), np.argmin(data, axis=1)
+    return _minmax_match_block(prepared, prepared)
+
+
+@_profiled
+def _minmax_match_block(prepared_a: tuple, prepared_b: tuple, dtype=float) -> np.ndarray:
+    """
+    Calculates the minimum-maximum similarity tile between two sets of samples, \
+    given the positions of their maximal and minimal values.
+
+    :param prepared_a: a tuple of the positions of the maximal and minimal values of m samples.
+    :type prepared_a: tuple
+    :param prepared_b: a tuple of the positions of the maximal and minimal values of k samples.
+    :type prepared_b: tuple
+    :param dtype: the floating-point data type of the returned tile.
+    :type dtype: numpy dtype (default=float)
+    :return: an m-by-k numpy array of min-max mismatch similarity scores.
+    :rtype: np.ndarray
+    """
+    argmax_a, argmin_a = prepared_a
+    argmax_b, argmin_b = prepared_b
+    similarities = np.equal(argmax_a[..., :, None], argmax_b[..., None, :]).astype(dtype)
+    similarities += argmin_a[..., :, None] == argmin_b[..., None, :]
+    similarities *= 0.5
+    return similarities
 
 
 def _correlation_star(data: np.ndarray, method: str) -> np.ndarray:
@@ -275,12 +3022,177 @@ def _correlation_star(data: np.ndarray, method: str) -> np.ndarray:
     :return: an n-by-n numpy array of correlation* similarity scores.
     :rtype: np.ndarray
     """
+    prepared = _correlation_rows(data, method)
+    return _correlation_star_block(prepared, prepared)
+
+
+@_profiled
+def _correlation_rows(data: np.ndarray, method: str, dtype=float) -> tuple:
+    """
+    Prepares the samples of 'data' for the correlation* kernel, by (optionally) ranking each sample, \
+    and then centering each sample and scaling it to unit norm. \
+    The Pearson correlation coefficient of two samples is then the dot product of their prepared rows.
+
+    :param data: an n-by-p numpy array of n samples by p features.
+    :type data: np.ndarray
+    :param method: the correlation metric to use when calculating correlation*
+    :type method: 'pearson' or 'spearman'
+    :param dtype: the floating-point data type of the normalized samples.
+    :type dtype: numpy dtype (default=float)
+    :return: a tuple containing the n-by-p array of normalized samples.
+    :rtype: tuple
+    """
+    assert isinstance(method, str), f"'method' must be a string. Instead got {type(method)}."
+    method = method.lower()
+    assert method in {'spearman', 'pearson'}, f"'method' must be 'spearman' or 'pearson'. Instead got '{method}'."
+    if method == 'spearman':
+        data = np.asarray(data)
+        missing = np.isnan(data).any(axis=1)
+        data = _rankdata(data, dtype)
+        # missing values are ranked after all other values, so they are propagated to the ranks explicitly
+        data[missing] = np.nan
+    # samples are centered and normalized in the precision of the input (if higher than 'dtype'), \
+    # to avoid losing the precision of samples whose mean is large relative to their spread
+    data = np.asarray(data, dtype=np.promote_types(np.asarray(data).dtype, dtype))
+    centered = data - data.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centered /= np.linalg.norm(centered, axis=1, keepdims=True)
+    return centered.astype(dtype, copy=False),
+
+
+@_profiled
+def _rankdata(data: np.ndarray, dtype=float) -> np.ndarray:
+    """
+    Ranks the values of every sample (row) of 'data' separately, assigning the average rank to tied values. \
+    The rows are ranked together by a single argsort, and rows without tied values take a fast path \
+    (their sorted ranks are simply 1, 2, ..., p). \
+    Just like scipy.stats.mstats.rankdata, NaN values are ranked after all other values, \
+    and are never considered tied with each other.
+
+    :param data: an n-by-p numpy array of n samples by p features to rank.
+    :type data: np.ndarray
+    :param dtype: the data type of the returned ranks.
+    :type dtype: numpy dtype (default=float)
+    :return: an n-by-p numpy array of the rank of each value within its sample, between 1 and p.
+    :rtype: np.ndarray
+    """
+    data = np.asarray(data)
+    n_features = data.shape[1]
+    order = np.argsort(data, axis=1, kind='stable')
+    sorted_data = np.take_along_axis(data, order, axis=1)
+    starts_group = np.ones(data.shape, dtype=bool)
+    np.not_equal(sorted_data[:, 1:], sorted_data[:, :-1], out=starts_group[:, 1:])
+
+    sorted_ranks = np.empty(data.shape, dtype=dtype)
+    sorted_ranks[:] = np.arange(1, n_features + 1, dtype=dtype)
+    tied_rows = np.flatnonzero(~starts_group.all(axis=1))
+    if len(tied_rows) > 0:
+        # every group of tied values gets the average of the first and last positions it occupies within its row.
+        # since every row starts a new group, the groups of all tied rows can be processed as one flat array.
+        flat_starts = starts_group[tied_rows].ravel()
+        group_starts = np.flatnonzero(flat_starts)
+        group_stops = np.append(group_starts[1:], flat_starts.size)
+        group_ranks = (group_starts + group_stops + 1) / 2 - (group_starts // n_features) * n_features
+        sorted_ranks[tied_rows] = group_ranks[np.cumsum(flat_starts) - 1].reshape(len(tied_rows), n_features)
+
+    ranks = np.empty(data.shape, dtype=dtype)
+    np.put_along_axis(ranks, order, sorted_ranks, axis=1)
+    return ranks
+
+
+@_profiled
+def _correlation_star_block(prepared_a: tuple, prepared_b: tuple) -> np.ndarray:
+    """
+    Calculates the correlation* similarity tile between two sets of prepared samples.
+
+    :param prepared_a: the prepared tuple of m samples, as returned by _correlation_rows().
+    :type prepared_a: tuple
+    :param prepared_b: the prepared tuple of k samples, as returned by _correlation_rows().
+    :type prepared_b: tuple
+    :return: an m-by-k numpy array of correlation* similarity scores.
+    :rtype: np.ndarray
+    """
+    similarities = prepared_a[0] @ prepared_b[0].swapaxes(-1, -2)
+    np.clip(similarities, -1, 1, out=similarities)
+    similarities += 1
+    similarities /= 2
+    return similarities
+
+
+@_profiled
+def _correlation_rows_nan_omit(data: np.ndarray, method: str, dtype=float) -> tuple:
+    """
+    Prepares the samples of 'data', which may contain missing values (NaN), \
+    for the pairwise-complete correlation* kernel. \
+    Every sample is (optionally) ranked among its observed values, \
+    and then centered by the mean of its observed values. \
+    Missing values are then replaced by 0, so that the sums over the features observed in both samples of a pair \
+    are given by matrix products of the samples with the observation indicators of the other samples.
+
+    :param data: an n-by-p numpy array of n samples by p features.
+    :type data: np.ndarray
+    :param method: the correlation metric to use when calculating correlation*
+    :type method: 'pearson' or 'spearman'
+    :param dtype: the floating-point data type of the prepared samples.
+    :type dtype: numpy dtype (default=float)
+    :return: a tuple of the centered samples (with missing values replaced by 0), their observation indicators, \
+    and their squares.
+    :rtype: tuple
+    """
     assert isinstance(method, str), f"'method' must be a string. Instead got {type(method)}."
     method = method.lower()
     assert method in {'spearman', 'pearson'}, f"'method' must be 'spearman' or 'pearson'. Instead got '{method}'."
+    data = np.asarray(data, dtype=np.promote_types(np.asarray(data).dtype, dtype))
+    observed = ~np.isnan(data)
     if method == 'spearman':
-        return (np.corrcoef(rankdata(data, axis=1)) + 1) / 2
-    return (np.corrcoef(data) + 1) / 2
+        # missing values are ranked after all observed values, so the observed values are ranked 1...k among themselves
+        data = _rankdata(data, data.dtype)
+    centered = np.where(observed, data, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centered -= centered.sum(axis=1, keepdims=True) / observed.sum(axis=1, keepdims=True)
+    centered[~observed] = 0
+    centered = centered.astype(dtype, copy=False)
+    return centered, observed.astype(dtype), centered ** 2
+
+
+@_profiled
+def _correlation_star_block_nan_omit(prepared_a: tuple, prepared_b: tuple) -> np.ndarray:
+    """
+    Calculates the pairwise-complete correlation* similarity tile between two sets of prepared samples. \
+    The Pearson correlation coefficient of every pair of samples is calculated over the features observed \
+    in both samples, from sums over those features that are obtained with six matrix products. \
+    The correlation coefficient of pairs of samples that are constant over the features observed in both of them \
+    (or that have fewer than two such features) is NaN.
+
+    :param prepared_a: the prepared tuple of m samples, as returned by _correlation_rows_nan_omit().
+    :type prepared_a: tuple
+    :param prepared_b: the prepared tuple of k samples, as returned by _correlation_rows_nan_omit().
+    :type prepared_b: tuple
+    :return: an m-by-k numpy array of correlation* similarity scores.
+    :rtype: np.ndarray
+    """
+    data_a, observed_a, squares_a = prepared_a
+    data_b, observed_b, squares_b = prepared_b
+    n_common = observed_a @ observed_b.swapaxes(-1, -2)
+    sums_a = data_a @ observed_b.swapaxes(-1, -2)
+    sums_b = observed_a @ data_b.swapaxes(-1, -2)
+    sums_of_squares_a = squares_a @ observed_b.swapaxes(-1, -2)
+    sums_of_squares_b = observed_a @ squares_b.swapaxes(-1, -2)
+    similarities = data_a @ data_b.swapaxes(-1, -2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarities -= sums_a * sums_b / n_common
+        variance_a = sums_of_squares_a - sums_a ** 2 / n_common
+        variance_b = sums_of_squares_b - sums_b ** 2 / n_common
+        # variances within the rounding error of their sums of squares are treated as zero (constant samples)
+        tolerance = n_common * np.finfo(similarities.dtype).eps
+        variance_a[variance_a <= tolerance * sums_of_squares_a] = np.nan
+        variance_b[variance_b <= tolerance * sums_of_squares_b] = np.nan
+        similarities /= np.sqrt(variance_a * variance_b)
+    np.clip(similarities, -1, 1, out=similarities)
+    similarities += 1
+    similarities /= 2
+    return similarities
 
 
 def _slope_concordance_similarity(data: np.ndarray) -> np.ndarray:
@@ -296,11 +3208,96 @@ def _slope_concordance_similarity(data: np.ndarray) -> np.ndarray:
     :return: an n-by-n numpy array of slope concordance similarity scores.
     :rtype: np.ndarray
     """
-    incline_array = (1 * (data[:, 1:] > data[:, :-1]) - 1 * (data[:, 1:] < data[:, :-1]))
-    return np.mean((incline_array[None, :, :] == incline_array[:, None, :]), axis=2)
+    prepared = _incline_one_hot(data),
+    return _slope_concordance_block(prepared, prepared)
+
+
+@_profiled
+def _slope_concordance_block(prepared_a: tuple, prepared_b: tuple) -> np.ndarray:
+    """
+    Calculates the slope concordance similarity tile between two sets of samples, \
+    given their one-hot incline indicators.
+
+    :param prepared_a: a tuple containing the one-hot incline indicators of m samples.
+    :type prepared_a: tuple
+    :param prepared_b: a tuple containing the one-hot incline indicators of k samples.
+    :type prepared_b: tuple
+    :return: an m-by-k numpy array of slope concordance similarity scores.
+    :rtype: np.ndarray
+    """
+    one_hot_a, one_hot_b = prepared_a[0], prepared_b[0]
+    n_inclines = one_hot_a.shape[-1] // 3
+    return (one_hot_a @ one_hot_b.swapaxes(-1, -2)) / n_inclines
+
+
+@_profiled
+def _incline_one_hot(data: np.ndarray, dtype=float) -> np.ndarray:
+    """
+    Encodes the incline (I) between every pair of consecutive features of each sample as a one-hot indicator \
+    matrix. The columns of the returned matrix are the indicators of I == 1, I == 0 and I == -1 respectively, \
+    so that the number of matching inclines between every pair of samples is given by a single matrix product \
+    of the one-hot matrix with its transpose.
+
+    :param data: an n-by-p numpy array of n samples by p features, to calculate inclines on.
+    :type data: np.ndarray
+    :param dtype: the floating-point data type of the returned indicators.
+    :type dtype: numpy dtype (default=float)
+    :return: an n-by-3(p-1) numpy array of one-hot incline indicators.
+    :rtype: np.ndarray
+    """
+    ascending = data[:, 1:] > data[:, :-1]
+    descending = data[:, 1:] < data[:, :-1]
+    flat = ~(ascending | descending)
+    return np.concatenate([ascending, flat, descending], axis=1).astype(dtype)
+
+
+@_profiled
+def _incline_one_hot_nan_omit(data: np.ndarray, dtype=float) -> tuple:
+    """
+    Encodes the incline (I) between every pair of consecutive features of each sample as a one-hot indicator \
+    matrix, like _incline_one_hot(), where inclines that involve a missing value (NaN) are encoded as all-zeros.
+
+    :param data: an n-by-p numpy array of n samples by p features, to calculate inclines on.
+    :type data: np.ndarray
+    :param dtype: the floating-point data type of the returned indicators.
+    :type dtype: numpy dtype (default=float)
+    :return: a tuple of the n-by-3(p-1) numpy array of one-hot incline indicators, \
+    and the n-by-(p-1) numpy array of indicators of the inclines that do not involve a missing value.
+    :rtype: tuple
+    """
+    missing = np.isnan(data)
+    valid = ~(missing[:, 1:] | missing[:, :-1])
+    ascending = data[:, 1:] > data[:, :-1]
+    descending = data[:, 1:] < data[:, :-1]
+    flat = valid & ~(ascending | descending)
+    return np.concatenate([ascending, flat, descending], axis=1).astype(dtype), valid.astype(dtype)
+
+
+@_profiled
+def _slope_concordance_block_nan_omit(prepared_a: tuple, prepared_b: tuple) -> np.ndarray:
+    """
+    Calculates the pairwise-complete slope concordance similarity tile between two sets of samples, \
+    as the fraction of matching inclines among the inclines that do not involve a missing value in either sample. \
+    The slope concordance of pairs of samples without any such inclines is NaN.
+
+    :param prepared_a: the prepared tuple of m samples, as returned by _incline_one_hot_nan_omit().
+    :type prepared_a: tuple
+    :param prepared_b: the prepared tuple of k samples, as returned by _incline_one_hot_nan_omit().
+    :type prepared_b: tuple
+    :return: an m-by-k numpy array of slope concordance similarity scores.
+    :rtype: np.ndarray
+    """
+    one_hot_a, valid_a = prepared_a
+    one_hot_b, valid_b = prepared_b
+    similarities = one_hot_a @ one_hot_b.swapaxes(-1, -2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarities /= valid_a @ valid_b.swapaxes(-1, -2)
+    return similarities
 
 
-def _similarity_to_distance(similarity_matrix, max_val: Union[int, float] = 1) -> np.ndarray:
+@_profiled
+def _similarity_to_distance(similarity_matrix, max_val: Union[int, float] = 1,
+                            out: Union[np.ndarray, None] = None) -> np.ndarray:
     """
     Converts similarity scores to distance scores. Uses the formula max_val - similarity_matrix.
 
@@ -308,7 +3305,287 @@ def _similarity_to_distance(similarity_matrix, max_val: Union[int, float] = 1) -
     :type similarity_matrix: np.ndarray
     :param max_val: the maximum value of the given similarity score.
     :type max_val: int or float (default: 1)
+    :param out: if specified, the distance scores are written into 'out' (which may be 'similarity_matrix' itself) \
+    instead of into a new array.
+    :type out: np.ndarray or None (default: None)
     :return: a numpy array of of pairwise distance scores, the same shape as 'similarity_matrix'.
     :rtype: np.ndarray
     """
-    return max_val - similarity_matrix
+    return np.subtract(max_val, similarity_matrix, out=out)
+
+
+class DistanceContext:
+    """
+    Computes pairwise distance matrices of several metrics over the same array of n samples by p features, \
+    while sharing their components between the metrics. \
+    Every component (the Pearson and Spearman correlation* matrices, the slope concordance matrix, \
+    the minimum-maximum match matrix, and so on) is computed the first time a metric requires it, \
+    and is then cached and reused by every other metric that requires it. \
+    For example, calling pearson_distance(), spearman_distance(), ys1_distance() and yr1_distance() \
+    computes each of their four components only once. \
+    The memory usage of the cached components is reported by memory_usage(), \
+    and cached components can be released with evict().
+
+    :param data: an n-by-p numpy array of n samples by p features, to calculate pairwise distances on.
+    :type data: np.ndarray
+    :param rowvar: If True, calculates the pairwise distances between the rows of 'data'. \
+    If False, calculate the pairwise distances between the columns of 'data'.
+    :type rowvar: bool (default=True)
+    """
+
+    def __init__(self, data: np.ndarray, rowvar: bool = True):
+        self.data = _rowvar(data, rowvar)
+        self._components = {}
+
+    def _component(self, name: str, func: Callable[[], np.ndarray]) -> np.ndarray:
+        if name not in self._components:
+            self._components[name] = func()
+        return self._components[name]
+
+    def _output(self, similarity_mat: np.ndarray, similarity: bool) -> np.ndarray:
+        # cached components must never be returned (or modified) directly
+        if similarity:
+            return similarity_mat.copy()
+        return _similarity_to_distance(similarity_mat)
+
+    @property
+    def components(self) -> list:
+        """
+        The names of the components that are currently cached.
+        """
+        return list(self._components)
+
+    def memory_usage(self) -> dict:
+        """
+        Returns the memory usage of every cached component.
+
+        :return: a dictionary mapping the name of every cached component to its size in bytes.
+        :rtype: dict
+        """
+        return {name: component.nbytes for name, component in self._components.items()}
+
+    def evict(self, component: Union[str, None] = None):
+        """
+        Releases a cached component, so that it will be recomputed the next time it is required.
+
+        :param component: the name of the component to release. If None, all cached components are released.
+        :type component: str or None (default=None)
+        """
+        if component is None:
+            self._components.clear()
+            return
+        assert component in self._components, \
+            f"'component' must be one of the cached components {self.components}. Instead got '{component}'."
+        del self._components[component]
+
+    def correlation_star(self, method: str) -> np.ndarray:
+        """
+        Returns the correlation* ((S* i,j) or (R* i,j)) similarity component of the YS1 and YR1 metrics.
+
+        :param method: the correlation metric to use when calculating correlation*
+        :type method: 'pearson' or 'spearman'
+        :rtype: np.ndarray
+        """
+        method = method.lower()
+        return self._component(method, lambda: _correlation_star(self.data, method))
+
+    def slope_concordance(self) -> np.ndarray:
+        """
+        Returns the slope concordance (A i,j) similarity component of the YS1 and YR1 metrics.
+
+        :rtype: np.ndarray
+        """
+        return self._component('slope_concordance', lambda: _slope_concordance_similarity(self.data))
+
+    def minmax_match(self) -> np.ndarray:
+        """
+        Returns the minimum-maximum similarity (M i,j) component of the YS1 and YR1 metrics.
+
+        :rtype: np.ndarray
+        """
+        return self._component('minmax_match', lambda: _minmax_match_similarity(self.data))
+
+    def pearson_distance(self, similarity: bool = False) -> np.ndarray:
+        """
+        Calculates the pairwise Pearson-correlation distance matrix. See pearson_distance() for more details.
+
+        :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
+        If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
+        :type similarity: bool (default=False)
+        :rtype: np.ndarray
+        """
+        return self._output(self.correlation_star('pearson'), similarity)
+
+    def spearman_distance(self, similarity: bool = False) -> np.ndarray:
+        """
+        Calculates the pairwise Spearman-correlation distance matrix. See spearman_distance() for more details.
+
+        :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
+        If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
+        :type similarity: bool (default=False)
+        :rtype: np.ndarray
+        """
+        return self._output(self.correlation_star('spearman'), similarity)
+
+    def _son_baek_distance(self, method: str, omega1: float, omega2: float, omega3: float, similarity: bool,
+                           out: Union[np.ndarray, None] = None,
+                           scratch: Union[np.ndarray, None] = None) -> np.ndarray:
+        _check_omegas(omega1, omega2, omega3)
+        similarity_mat = np.multiply(self.correlation_star(method), omega1, out=out)
+        similarity_mat += np.multiply(self.slope_concordance(), omega2, out=scratch)
+        similarity_mat += np.multiply(self.minmax_match(), omega3, out=scratch)
+        return _similarity(similarity_mat, similarity, out=similarity_mat)
+
+    def _son_baek_sweep(self, method: str, omegas: Iterable[Tuple[float, float, float]], similarity: bool,
+                        out: Union[np.ndarray, str, os.PathLike, None]) -> Iterator[np.ndarray]:
+        omegas = [tuple(omega) for omega in omegas]
+        for omega in omegas:
+            assert len(omega) == 3, f"Every element of 'omegas' must be a triplet (omega1, omega2, omega3). " \
+                                    f"Instead got {omega}."
+            _check_omegas(*omega)
+        if len(omegas) == 0:
+            return
+        n_samples = self.data.shape[0]
+        if out is not None:
+            out = _open_output(out, (n_samples, n_samples))
+        # a single scratch buffer holds the weighted components, so no temporary matrices are allocated per triplet
+        scratch = np.empty((n_samples, n_samples))
+        for omega1, omega2, omega3 in omegas:
+            res = self._son_baek_distance(method, omega1, omega2, omega3, similarity, out, scratch)
+            if isinstance(res, np.memmap):
+                res.flush()
+            yield res
+
+    def ys1_distance_sweep(self, omegas: Iterable[Tuple[float, float, float]], similarity: bool = False,
+                           out: Union[np.ndarray, str, os.PathLike, None] = None) -> Iterator[np.ndarray]:
+        """
+        Calculates the pairwise YS1 distance matrix for every triplet of weights in 'omegas'. \
+        See ys1_distance_sweep() for more details.
+
+        :param omegas: triplets of relative weights (omega1, omega2, omega3). \
+        The three relative weights of every triplet must add up to exactly 1.0.
+        :type omegas: iterable of (float, float, float) tuples
+        :param similarity: If False, yields pairwise distance matrices (0 means closest, 1 means furthest). \
+        If True, yields pairwise similarity matrices (1 means most similar, 0 means most different).
+        :type similarity: bool (default=False)
+        :param out: If specified, every pairwise distance matrix is written into 'out' (overwriting the previous one) \
+        instead of into a new array. 'out' can be an n-by-n numpy array or a path to an .npy file.
+        :type out: np.ndarray, str, os.PathLike or None (default=None)
+        :rtype: Iterator[np.ndarray]
+        """
+        return self._son_baek_sweep('spearman', omegas, similarity, out)
+
+    def yr1_distance_sweep(self, omegas: Iterable[Tuple[float, float, float]], similarity: bool = False,
+                           out: Union[np.ndarray, str, os.PathLike, None] = None) -> Iterator[np.ndarray]:
+        """
+        Calculates the pairwise YR1 distance matrix for every triplet of weights in 'omegas'. \
+        See yr1_distance_sweep() for more details.
+
+        :param omegas: triplets of relative weights (omega1, omega2, omega3). \
+        The three relative weights of every triplet must add up to exactly 1.0.
+        :type omegas: iterable of (float, float, float) tuples
+        :param similarity: If False, yields pairwise distance matrices (0 means closest, 1 means furthest). \
+        If True, yields pairwise similarity matrices (1 means most similar, 0 means most different).
+        :type similarity: bool (default=False)
+        :param out: If specified, every pairwise distance matrix is written into 'out' (overwriting the previous one) \
+        instead of into a new array. 'out' can be an n-by-n numpy array or a path to an .npy file.
+        :type out: np.ndarray, str, os.PathLike or None (default=None)
+        :rtype: Iterator[np.ndarray]
+        """
+        return self._son_baek_sweep('pearson', omegas, similarity, out)
+
+    def ys1_distance(self, omega1: float = 0.5, omega2: float = 0.25, omega3: float = 0.25,
+                     similarity: bool = False) -> np.ndarray:
+        """
+        Calculates the pairwise YS1 distance matrix. See ys1_distance() for more details.
+
+        :param omega1: Relative weight of the correlation (S* i,j) component of the YS1 distance.
+        :type omega1: float between 0 and 1
+        :param omega2: Relative weight of the slope concordance (A i,j) component of the YS1 distance.
+        :type omega2: float between 0 and 1
+        :param omega3: Relative weight of the minimum-maximum similarity (M i,j) component of the YS1 distance.
+        :type omega3: float between 0 and 1
+        :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
+        If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
+        :type similarity: bool (default=False)
+        :rtype: np.ndarray
+        """
+        return self._son_baek_distance('spearman', omega1, omega2, omega3, similarity)
+
+    def yr1_distance(self, omega1: float = 0.5, omega2: float = 0.25, omega3: float = 0.25,
+                     similarity: bool = False) -> np.ndarray:
+        """
+        Calculates the pairwise YR1 distance matrix. See yr1_distance() for more details.
+
+        :param omega1: Relative weight of the correlation (R* i,j) component of the YR1 distance.
+        :type omega1: float between 0 and 1
+        :param omega2: Relative weight of the slope concordance (A i,j) component of the YR1 distance.
+        :type omega2: float between 0 and 1
+        :param omega3: Relative weight of the minimum-maximum similarity (M i,j) component of the YR1 distance.
+        :type omega3: float between 0 and 1
+        :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
+        If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
+        :type similarity: bool (default=False)
+        :rtype: np.ndarray
+        """
+        return self._son_baek_distance('pearson', omega1, omega2, omega3, similarity)
+
+    def jackknife_distance(self, similarity: bool = False) -> np.ndarray:
+        """
+        Calculates the pairwise Jackknife-correlation distance matrix. See jackknife_distance() for more details.
+
+        :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
+        If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
+        :type similarity: bool (default=False)
+        :rtype: np.ndarray
+        """
+        return self._output(self._component('jackknife', lambda: _pairwise_distance(self.data, 'jackknife', True)),
+                            similarity)
+
+    def sharpened_cosine_distance(self, sharpen_exponent: float = 16, exp_noise_floor: float = 0.1,
+                                  similarity: bool = False) -> np.ndarray:
+        """
+        Calculates the pairwise sharpened cosine distance matrix. \
+        See sharpened_cosine_distance() for more details.
+
+        :param sharpen_exponent:
+        :type sharpen_exponent: float (default=16)
+        :param exp_noise_floor:
+        :type exp_noise_floor: float (default=0.1)
+        :param similarity: If False, returns a pairwise distance matrix (0 means closest, 1 means furthest). \
+        If True, returns a pairwise similarity matrix (1 means most similar, 0 means most different).
+        :type similarity: bool (default=False)
+        :rtype: np.ndarray
+        """
+        name = f'sharpened_cosine(sharpen_exponent={sharpen_exponent}, exp_noise_floor={exp_noise_floor})'
+        return self._output(
+            self._component(name, lambda: _sharpened_cosine(self.data, sharpen_exponent, exp_noise_floor)),
+            similarity)
+
+
+_METRICS = {
+    'pearson': _Metric(lambda data, dtype: _correlation_rows(data, 'pearson', dtype), _correlation_star_block),
+    'spearman': _Metric(lambda data, dtype: _correlation_rows(data, 'spearman', dtype), _correlation_star_block),
+    'jackknife': _Metric(_jackknife_rows, _jackknife_block, tile_temporaries=4),
+    'ys1': _Metric(lambda data, dtype: _son_baek_rows(data, 'spearman', dtype), _son_baek_block, tile_temporaries=4),
+    'yr1': _Metric(lambda data, dtype: _son_baek_rows(data, 'pearson', dtype), _son_baek_block, tile_temporaries=4),
+    'sharpened_cosine': _Metric(_sharpened_cosine_rows, _sharpened_cosine_block, zero_diagonal=True,
+                                sample_bound=lambda prepared, **params: _sharpened_cosine_bound(prepared[1], **params)),
+}
+
+_SPARSE_METRICS = {
+    'pearson': _Metric(_sparse_rows, _sparse_correlation_star_block),
+    'sharpened_cosine': _Metric(_sparse_rows, _sparse_sharpened_cosine_block, zero_diagonal=True,
+                                sample_bound=lambda prepared, **params: _sharpened_cosine_bound(prepared[2], **params)),
+}
+
+_NAN_OMIT_METRICS = {
+    'pearson': _Metric(lambda data, dtype: _correlation_rows_nan_omit(data, 'pearson', dtype),
+                       _correlation_star_block_nan_omit, tile_temporaries=9),
+    'spearman': _Metric(lambda data, dtype: _correlation_rows_nan_omit(data, 'spearman', dtype),
+                        _correlation_star_block_nan_omit, tile_temporaries=9),
+    'ys1': _Metric(lambda data, dtype: _son_baek_rows_nan_omit(data, 'spearman', dtype), _son_baek_block_nan_omit,
+                   tile_temporaries=12),
+    'yr1': _Metric(lambda data, dtype: _son_baek_rows_nan_omit(data, 'pearson', dtype), _son_baek_block_nan_omit,
+                   tile_temporaries=12),
+}
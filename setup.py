@@ -38,6 +38,7 @@ setup(
     description='Calculate the pairwise-distance matrix for an array of *n* samples by *p* features, '
                 'sing a selection of distance metrics.',
     install_requires=requirements,
+    extras_require={'numba': ['numba>=0.55']},
     python_requires='>=3.7',
     license="License :: OSI Approved :: Apache Software License",
     long_description=readme + '\n\n' + history,
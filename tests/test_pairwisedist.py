@@ -1,6 +1,16 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
 import pytest
 from pairwisedist import pairwisedist
 import numpy as np
+from scipy.cluster.hierarchy import linkage
+from scipy.stats import mstats
+from scipy.spatial.distance import squareform
+from scipy import sparse
 
 inp = np.array([[1, 2, 3, 4],
                 [5, 6.5, 5, 9],
@@ -9,6 +19,13 @@ inp = np.array([[1, 2, 3, 4],
                 [1, 2, 4, 3]])
 
 
+def _jackknife(data: np.ndarray, func, **kwargs) -> np.ndarray:
+    # reference implementation: the element-wise minimum of 'func' over all leave-one-feature-out arrays
+    n = data.shape[1]
+    idx = np.arange(n)
+    return np.min(np.array([func(data[:, idx != i], **kwargs) for i in range(n)]), axis=0)
+
+
 def test_sharpened_cosine_distance():
     truth = truth = np.array([[1, 0.33560609, 0.50002998, 0.42575679, 0.33708719],
                               [0.33560609, 1, 0.50574587, 0.27300692, 0.43677134],
@@ -21,8 +38,22 @@ def test_sharpened_cosine_distance():
                       pairwisedist.sharpened_cosine_distance(inp, rowvar=False), equal_nan=True).all()
 
 
+def test_sharpened_cosine_matches_pairwise_loop():
+    rng = np.random.default_rng(42)
+    data = rng.normal(size=(12, 6))
+    data[4] = 0
+    truth = np.zeros((12, 12))
+    for i in range(12):
+        for j in range(i + 1, 12):
+            dot_product = np.dot(data[i], data[j])
+            this_similarity = np.sign(dot_product) * (dot_product / ((np.linalg.norm(data[i]) + 0.1) *
+                                                                     (np.linalg.norm(data[j]) + 0.1))) ** 16
+            truth[i, j] = truth[j, i] = (this_similarity + 1) / 2
+    assert np.isclose(pairwisedist._sharpened_cosine(data, 16, 0.1), truth).all()
+
+
 def test_spearman_distance():
-    truth_corr = np.corrcoef(pairwisedist.rankdata(inp, axis=1))
+    truth_corr = np.corrcoef(mstats.rankdata(inp, axis=1))
     truth_sim = (truth_corr + 1) / 2
     truth_dist = pairwisedist._similarity_to_distance(truth_sim)
 
@@ -76,6 +107,32 @@ def test_jackknife_distance():
                       equal_nan=True).all()
 
 
+def test_jackknife_pearson_matches_resampling():
+    rng = np.random.default_rng(42)
+    data = rng.integers(0, 3, size=(15, 5)).astype(float)
+    data[0] = [1, 1, 1, 1, 7]
+    truth = _jackknife(data, pairwisedist._correlation_star, method='pearson')
+    res = pairwisedist.jackknife_distance(data, similarity=True)
+    assert np.isclose(truth, res, equal_nan=True).all()
+    assert np.isnan(res[0]).all()
+
+
+@pytest.mark.parametrize('block_size', [None, 2])
+def test_jackknife_pearson_dominant_feature(block_size):
+    rng = np.random.default_rng(42)
+    data = rng.normal(size=(6, 5))
+    data[0] = [1, 1.000001, 1, 1.000002, 1e6]
+    data[1] = data[0] + rng.normal(size=5) * 1e-7
+    data[2] = [1, 2, 1, 2, 1e6]
+    data[3, 2] = -1e8
+    truth = _jackknife(data, pairwisedist._correlation_star, method='pearson')
+    res = pairwisedist.jackknife_distance(data, similarity=True, block_size=block_size)
+    assert np.isclose(res, truth).all()
+    assert np.isclose(np.diag(res), 1).all()
+    stacked = pairwisedist.jackknife_distance(np.stack([data, data[::-1]]), similarity=True)
+    assert np.isclose(stacked[1], truth[::-1, ::-1]).all()
+
+
 def test_ys1_distance():
     truth_default = np.array([[0., 0.17521945, 0.51666667, np.nan, 0.25833333],
                               [0.17521945, 0., 0.80270463, np.nan, 0.51531435],
@@ -159,6 +216,25 @@ def test_slope_concordance_similarity():
     assert np.all(pairwisedist._slope_concordance_similarity(inp) == truth)
 
 
+def test_slope_concordance_matches_broadcast():
+    rng = np.random.default_rng(42)
+    data = rng.integers(0, 3, size=(20, 9)).astype(float)
+    inclines = 1 * (data[:, 1:] > data[:, :-1]) - 1 * (data[:, 1:] < data[:, :-1])
+    truth = np.mean(inclines[None, :, :] == inclines[:, None, :], axis=2)
+    assert np.all(pairwisedist._slope_concordance_similarity(data) == truth)
+
+
+@pytest.mark.parametrize('dtype', [float, np.float32])
+def test_rankdata(dtype):
+    rng = np.random.default_rng(42)
+    data = np.concatenate([rng.normal(size=(10, 8)), rng.integers(0, 3, size=(10, 8))])
+    data[3, [1, 5]] = np.nan
+    res = pairwisedist._rankdata(data, dtype=dtype)
+    assert res.dtype == dtype
+    assert np.array_equal(res, mstats.rankdata(data, axis=1))
+    assert np.array_equal(pairwisedist._rankdata(inp), mstats.rankdata(inp, axis=1))
+
+
 def test_similarity_to_distance():
     res = np.array([[1, 2 / 3, 1 / 3, 0, 2 / 3],
                     [-1, 1, 0, 0, 1 / 3],
@@ -176,8 +252,881 @@ def test_similarity_to_distance():
 
 def test_jackknife():
     truth = np.array([2, 5.5, -6 - (2 / 3), 5, 2])
-    res = pairwisedist._jackknife(inp, np.mean, axis=1)
+    res = _jackknife(inp, np.mean, axis=1)
     print("truth: ")
     print(truth)
     print(res)
     assert np.isclose(truth, res).all()
+
+
+@pytest.mark.parametrize('func', [pairwisedist.pearson_distance, pairwisedist.spearman_distance,
+                                  pairwisedist.jackknife_distance, pairwisedist.ys1_distance,
+                                  pairwisedist.yr1_distance, pairwisedist.sharpened_cosine_distance])
+@pytest.mark.parametrize('block_size', [1, 2, 3, 5, 100])
+def test_block_size(func, block_size):
+    assert np.isclose(func(inp), func(inp, block_size=block_size), equal_nan=True).all()
+    assert np.isclose(func(inp, similarity=True), func(inp, similarity=True, block_size=block_size),
+                      equal_nan=True).all()
+
+
+@pytest.mark.parametrize('metric,func', [('pearson', pairwisedist.pearson_distance),
+                                         ('ys1', pairwisedist.ys1_distance),
+                                         ('sharpened_cosine', pairwisedist.sharpened_cosine_distance)])
+def test_iter_distance_blocks(metric, func):
+    truth = func(inp)
+    res = np.full_like(truth, -1)
+    n_tiles = 0
+    for rows, cols, tile in pairwisedist.iter_distance_blocks(inp, metric, block_size=2):
+        assert tile.shape == (rows.stop - rows.start, cols.stop - cols.start)
+        res[rows, cols] = tile
+        n_tiles += 1
+    assert n_tiles == 9
+    assert np.isclose(res, truth, equal_nan=True).all()
+
+
+def test_iter_distance_blocks_bad_input():
+    with pytest.raises(AssertionError):
+        next(pairwisedist.iter_distance_blocks(inp, 'euclidean'))
+    with pytest.raises(AssertionError):
+        next(pairwisedist.iter_distance_blocks(inp, 'pearson', block_size=0))
+
+
+@pytest.mark.parametrize('func', [pairwisedist.pearson_distance, pairwisedist.jackknife_distance,
+                                  pairwisedist.ys1_distance, pairwisedist.sharpened_cosine_distance])
+@pytest.mark.parametrize('block_size', [None, 2])
+def test_out_array(func, block_size):
+    out = np.empty((5, 5))
+    res = func(inp, block_size=block_size, out=out)
+    assert res is out
+    assert np.isclose(out, func(inp), equal_nan=True).all()
+    func(inp, similarity=True, block_size=block_size, out=out)
+    assert np.isclose(out, func(inp, similarity=True), equal_nan=True).all()
+
+
+def test_out_npy_path(tmp_path):
+    path = tmp_path.joinpath('dist.npy')
+    res = pairwisedist.yr1_distance(inp, out=path, block_size=3)
+    assert isinstance(res, np.memmap)
+    assert np.isclose(np.load(path), pairwisedist.yr1_distance(inp), equal_nan=True).all()
+
+
+def test_out_bad_shape():
+    with pytest.raises(AssertionError):
+        pairwisedist.pearson_distance(inp, out=np.empty((4, 5)))
+
+
+@pytest.mark.parametrize('func', [pairwisedist.pearson_distance, pairwisedist.spearman_distance,
+                                  pairwisedist.jackknife_distance, pairwisedist.ys1_distance,
+                                  pairwisedist.yr1_distance, pairwisedist.sharpened_cosine_distance])
+@pytest.mark.parametrize('block_size', [None, 1, 2, 3])
+def test_condensed(func, block_size):
+    data = np.random.default_rng(42).normal(size=(7, 5))
+    truth = func(data)
+    res = func(data, condensed=True, block_size=block_size)
+    assert res.shape == (21,)
+    assert np.isclose(squareform(res), truth - np.diag(np.diag(truth))).all()
+    linkage(res)
+
+
+def test_condensed_out(tmp_path):
+    path = tmp_path.joinpath('condensed.npy')
+    pairwisedist.pearson_distance(inp, similarity=True, out=path, condensed=True, block_size=2)
+    truth = pairwisedist.pearson_distance(inp, similarity=True)
+    assert np.isclose(np.load(path), truth[np.triu_indices(5, 1)], equal_nan=True).all()
+
+
+@pytest.mark.parametrize('func', [pairwisedist.pearson_distance, pairwisedist.spearman_distance,
+                                  pairwisedist.jackknife_distance, pairwisedist.ys1_distance,
+                                  pairwisedist.yr1_distance, pairwisedist.sharpened_cosine_distance])
+@pytest.mark.parametrize('n_jobs', [2, 4, -1])
+def test_n_jobs(func, n_jobs):
+    data = np.random.default_rng(42).normal(size=(23, 6))
+    serial = func(data, block_size=4)
+    assert np.array_equal(func(data, block_size=4, n_jobs=n_jobs), serial)
+    assert np.array_equal(func(data, block_size=4, n_jobs=n_jobs, condensed=True),
+                          func(data, block_size=4, condensed=True))
+    assert np.isclose(func(data, n_jobs=n_jobs), func(data)).all()
+
+
+def test_n_jobs_bad_input():
+    with pytest.raises(AssertionError):
+        pairwisedist.pearson_distance(inp, n_jobs=0)
+
+
+@pytest.mark.parametrize('method,func,kwargs', [
+    ('pearson_distance', pairwisedist.pearson_distance, {}),
+    ('spearman_distance', pairwisedist.spearman_distance, {}),
+    ('jackknife_distance', pairwisedist.jackknife_distance, {}),
+    ('ys1_distance', pairwisedist.ys1_distance, {'omega1': 0.2, 'omega2': 0.5, 'omega3': 0.3}),
+    ('yr1_distance', pairwisedist.yr1_distance, {}),
+    ('sharpened_cosine_distance', pairwisedist.sharpened_cosine_distance, {'sharpen_exponent': 3})])
+@pytest.mark.parametrize('similarity', [True, False])
+def test_distance_context(method, func, kwargs, similarity):
+    data = np.random.default_rng(42).normal(size=(9, 6))
+    context = pairwisedist.DistanceContext(data.T, rowvar=False)
+    truth = func(data, similarity=similarity, **kwargs)
+    for _ in range(2):
+        assert np.isclose(getattr(context, method)(similarity=similarity, **kwargs), truth).all()
+
+
+def test_distance_context_cache():
+    data = np.random.default_rng(42).normal(size=(9, 6))
+    context = pairwisedist.DistanceContext(data)
+    context.ys1_distance()
+    context.yr1_distance()
+    assert sorted(context.components) == ['minmax_match', 'pearson', 'slope_concordance', 'spearman']
+    spearman = context.correlation_star('spearman')
+    res = context.spearman_distance(similarity=True)
+    res[:] = 0
+    assert context.correlation_star('spearman') is spearman
+    assert context.memory_usage() == {name: 9 * 9 * 8 for name in context.components}
+
+    context.evict('spearman')
+    assert 'spearman' not in context.components
+    with pytest.raises(AssertionError):
+        context.evict('spearman')
+    context.evict()
+    assert context.components == []
+    assert context.memory_usage() == {}
+    assert np.isclose(context.spearman_distance(), pairwisedist.spearman_distance(data)).all()
+
+
+@pytest.mark.parametrize('sweep,func', [(pairwisedist.ys1_distance_sweep, pairwisedist.ys1_distance),
+                                        (pairwisedist.yr1_distance_sweep, pairwisedist.yr1_distance)])
+@pytest.mark.parametrize('similarity', [True, False])
+def test_distance_sweep(sweep, func, similarity):
+    data = np.random.default_rng(42).normal(size=(9, 6))
+    omegas = [(0.5, 0.25, 0.25), (1, 0, 0), (0.2, 0.3, 0.5)]
+    results = list(sweep(data, omegas, similarity=similarity))
+    assert len(results) == len(omegas)
+    for res, (omega1, omega2, omega3) in zip(results, omegas):
+        assert np.isclose(res, func(data, omega1, omega2, omega3, similarity=similarity)).all()
+
+    out = np.empty((9, 9))
+    for res, (omega1, omega2, omega3) in zip(sweep(data.T, omegas, rowvar=False, out=out), omegas):
+        assert res is out
+        assert np.isclose(res, func(data, omega1, omega2, omega3)).all()
+
+
+def test_distance_sweep_bad_input():
+    with pytest.raises(AssertionError):
+        list(pairwisedist.ys1_distance_sweep(inp, [(0.5, 0.25, 0.25), (0.5, 0.5, 0.5)]))
+    with pytest.raises(AssertionError):
+        list(pairwisedist.yr1_distance_sweep(inp, [(0.5, 0.5)]))
+    with pytest.raises(AssertionError):
+        list(pairwisedist.ys1_distance_sweep(inp, [(0.5, 0.25, 0.25)], out=np.empty((4, 4))))
+
+
+@pytest.mark.parametrize('metric,func', [('pearson', pairwisedist.pearson_distance),
+                                         ('spearman', pairwisedist.spearman_distance),
+                                         ('ys1', pairwisedist.ys1_distance),
+                                         ('sharpened_cosine', pairwisedist.sharpened_cosine_distance)])
+@pytest.mark.parametrize('block_size', [1, 4, 1024])
+@pytest.mark.parametrize('k,include_self', [(1, False), (5, False), (22, False), (5, True), (23, True)])
+def test_pairwise_topk(metric, func, block_size, k, include_self):
+    data = np.random.default_rng(42).normal(size=(23, 8))
+    truth = func(data)
+    if not include_self:
+        np.fill_diagonal(truth, np.inf)
+    ind, dist = pairwisedist.pairwise_topk(data, k, metric, block_size=block_size, include_self=include_self)
+    assert ind.shape == dist.shape == (23, k)
+    assert np.isclose(dist, np.sort(truth, axis=1)[:, :k]).all()
+    assert np.isclose(np.take_along_axis(truth, ind, axis=1), dist).all()
+    assert np.all(np.diff(dist, axis=1) >= 0)
+    if not include_self:
+        assert not np.any(ind == np.arange(23)[:, None])
+    assert np.all(np.sort(ind, axis=1)[:, 1:] != np.sort(ind, axis=1)[:, :-1])
+
+
+def test_pairwise_topk_nan():
+    data = np.random.default_rng(42).normal(size=(6, 4))
+    data[2] = 1
+    ind, dist = pairwisedist.pairwise_topk(data, 5, 'pearson', block_size=2)
+    assert np.isnan(dist[2]).all()
+    assert sorted(ind[2]) == [0, 1, 3, 4, 5]
+    assert np.all(ind[np.arange(6) != 2, -1] == 2)
+    assert np.isnan(dist[np.arange(6) != 2, -1]).all()
+    assert not np.isnan(dist[np.arange(6) != 2, :-1]).any()
+
+
+def test_pairwise_topk_bad_input():
+    with pytest.raises(AssertionError):
+        pairwisedist.pairwise_topk(inp, 5)
+    with pytest.raises(AssertionError):
+        pairwisedist.pairwise_topk(inp, 0)
+    with pytest.raises(AssertionError):
+        pairwisedist.pairwise_topk(inp, 2, 'euclidean')
+
+
+@pytest.mark.parametrize('metric,func,kwargs', [('pearson', pairwisedist.pearson_distance, {}),
+                                                ('spearman', pairwisedist.spearman_distance, {}),
+                                                ('jackknife', pairwisedist.jackknife_distance, {}),
+                                                ('ys1', pairwisedist.ys1_distance, {'omega1': 0.2, 'omega2': 0.4,
+                                                                                    'omega3': 0.4}),
+                                                ('yr1', pairwisedist.yr1_distance, {}),
+                                                ('sharpened_cosine', pairwisedist.sharpened_cosine_distance,
+                                                 {'sharpen_exponent': 3})])
+@pytest.mark.parametrize('block_size', [None, 2, 5])
+@pytest.mark.parametrize('similarity', [True, False])
+def test_cross_distance(metric, func, kwargs, block_size, similarity):
+    data = np.random.default_rng(42).normal(size=(11, 6))
+    truth = func(data, similarity=similarity, **kwargs)[:4, 4:]
+    res = pairwisedist.cross_distance(data[:4], data[4:], metric, similarity=similarity, block_size=block_size,
+                                      **kwargs)
+    assert res.shape == (4, 7)
+    assert np.isclose(res, truth).all()
+
+    reference = pairwisedist.PreparedReference(data[4:].T, metric, rowvar=False)
+    for batch in (slice(0, 1), slice(1, 4)):
+        res = reference.distance(data[batch], similarity=similarity, block_size=block_size, **kwargs)
+        assert np.isclose(res, truth[batch]).all()
+
+
+def test_cross_distance_self():
+    data = np.random.default_rng(42).normal(size=(5, 6))
+    res = pairwisedist.cross_distance(data, data, 'sharpened_cosine')
+    norms = np.linalg.norm(data, axis=1)
+    assert np.isclose(np.diag(res), (1 - (norms ** 2 / (norms + 0.1) ** 2) ** 16) / 2).all()
+    assert np.isclose(pairwisedist.cross_distance(data, data, 'pearson', out=np.empty((5, 5))),
+                      pairwisedist.pearson_distance(data)).all()
+
+
+def test_cross_distance_bad_input():
+    with pytest.raises(AssertionError):
+        pairwisedist.cross_distance(inp, inp[:, :3])
+    with pytest.raises(AssertionError):
+        pairwisedist.cross_distance(inp, inp, 'euclidean')
+    with pytest.raises(AssertionError):
+        pairwisedist.cross_distance(inp, inp, out=np.empty((5, 4)))
+
+
+@pytest.mark.parametrize('metric,func,kwargs', [('pearson', pairwisedist.pearson_distance, {}),
+                                                ('spearman', pairwisedist.spearman_distance, {}),
+                                                ('jackknife', pairwisedist.jackknife_distance, {}),
+                                                ('ys1', pairwisedist.ys1_distance, {'omega1': 0.2, 'omega2': 0.4,
+                                                                                    'omega3': 0.4}),
+                                                ('yr1', pairwisedist.yr1_distance, {}),
+                                                ('sharpened_cosine', pairwisedist.sharpened_cosine_distance,
+                                                 {'sharpen_exponent': 3})])
+@pytest.mark.parametrize('block_size', [1024, 2])
+def test_incremental_distance_matrix(metric, func, kwargs, block_size):
+    data = np.random.default_rng(42).normal(size=(12, 6))
+    matrix = pairwisedist.IncrementalDistanceMatrix(data[:3], metric, block_size=block_size, **kwargs)
+    assert matrix.n_samples == 3
+    assert np.isclose(matrix.matrix, func(data[:3], **kwargs)).all()
+    for start, stop in [(3, 4), (4, 5), (5, 9), (9, 12)]:
+        matrix.append(data[start:stop].T, rowvar=False)
+        assert matrix.n_samples == stop
+        assert matrix.capacity >= stop
+        assert np.isclose(matrix.matrix, func(data[:stop], **kwargs)).all()
+
+
+def test_incremental_distance_matrix_growth(tmp_path):
+    data = np.random.default_rng(42).normal(size=(20, 6))
+    path = tmp_path.joinpath('incremental.npy')
+    matrix = pairwisedist.IncrementalDistanceMatrix(path=path, similarity=True, block_size=3)
+    assert matrix.n_samples == 0
+    capacities = []
+    for i in range(20):
+        matrix.append(data[i:i + 1])
+        capacities.append(matrix.capacity)
+    assert capacities == [1, 2, 4, 4, 8, 8, 8, 8] + [16] * 8 + [32] * 4
+    truth = pairwisedist.pearson_distance(data, similarity=True)
+    assert np.isclose(matrix.matrix, truth).all()
+    assert np.isclose(np.load(path)[:20, :20], truth).all()
+
+    with pytest.raises(AssertionError):
+        matrix.append(data[:2, :5])
+    with pytest.raises(AssertionError):
+        pairwisedist.IncrementalDistanceMatrix(data, 'euclidean')
+
+
+@pytest.mark.parametrize('chunks', [[1] * 8, [3, 5], [8], [2, 0, 1, 5]])
+def test_pearson_accumulator(chunks):
+    data = np.random.default_rng(42).normal(loc=1000, size=(7, 8))
+    data[3] = 1000
+    accumulator = pairwisedist.PearsonAccumulator(7)
+    start = 0
+    for size in chunks:
+        chunk = data[:, start:start + size]
+        accumulator.update(chunk[:, 0] if size == 1 else chunk.T, rowvar=size == 1)
+        start += size
+        assert accumulator.n_features == start
+        if start > 1:
+            truth = pairwisedist.pearson_distance(data[:, :start])
+            assert np.isclose(accumulator.pearson_distance(), truth, equal_nan=True).all()
+            assert np.isclose(accumulator.pearson_distance(similarity=True), 1 - truth, equal_nan=True).all()
+    assert np.isnan(accumulator.correlation()[3]).all()
+    assert np.isclose(np.delete(np.delete(accumulator.correlation(), 3, 0), 3, 1),
+                      np.corrcoef(np.delete(data, 3, 0))).all()
+
+
+def test_pearson_accumulator_bad_input():
+    accumulator = pairwisedist.PearsonAccumulator(5)
+    with pytest.raises(AssertionError):
+        accumulator.correlation()
+    with pytest.raises(AssertionError):
+        accumulator.update(np.ones((4, 3)))
+    with pytest.raises(AssertionError):
+        pairwisedist.PearsonAccumulator(0)
+
+
+@pytest.mark.parametrize('func,atol', [(pairwisedist.pearson_distance, 1e-6),
+                                       (pairwisedist.spearman_distance, 1e-6),
+                                       (pairwisedist.jackknife_distance, 1e-6),
+                                       (pairwisedist.ys1_distance, 1e-6),
+                                       (pairwisedist.yr1_distance, 1e-6),
+                                       (pairwisedist.sharpened_cosine_distance, 1e-5)])
+@pytest.mark.parametrize('kwargs', [{}, {'block_size': 7}, {'condensed': True}])
+def test_dtype_float32(func, atol, kwargs):
+    rng = np.random.default_rng(42)
+    data = rng.normal(size=(40, 12)) * rng.uniform(0.1, 100, size=(40, 1)) + rng.normal(0, 1000, size=(40, 1))
+    truth = func(data, **kwargs)
+    res = func(data, dtype=np.float32, **kwargs)
+    assert res.dtype == np.float32
+    assert np.allclose(res, truth, rtol=0, atol=atol, equal_nan=True)
+    assert func(data, dtype='float64', **kwargs).dtype == np.float64
+
+
+def test_dtype_bad_input():
+    with pytest.raises(AssertionError):
+        pairwisedist.pearson_distance(inp, dtype=int)
+    with pytest.raises(AssertionError):
+        next(pairwisedist.iter_distance_blocks(inp, dtype=bool))
+
+
+def _nan_omit_reference(data, method, omegas=None):
+    from scipy.stats import rankdata
+    n = data.shape[0]
+    ranked = np.array([rankdata(row, nan_policy='omit') for row in data]) if method == 'spearman' else data
+    inclines = np.sign(np.diff(data, axis=1))
+    res = np.full((n, n), np.nan)
+    for i in range(n):
+        for j in range(n):
+            common = ~np.isnan(data[i]) & ~np.isnan(data[j])
+            if common.sum() < 2:
+                continue
+            similarity = (np.corrcoef(ranked[i, common], ranked[j, common])[0, 1] + 1) / 2
+            if omegas is not None:
+                valid = ~np.isnan(inclines[i]) & ~np.isnan(inclines[j])
+                slope = np.mean(inclines[i, valid] == inclines[j, valid])
+                minmax = (int(np.nanargmax(data[i]) == np.nanargmax(data[j])) +
+                          int(np.nanargmin(data[i]) == np.nanargmin(data[j]))) / 2
+                similarity = omegas[0] * similarity + omegas[1] * slope + omegas[2] * minmax
+            res[i, j] = 1 - similarity
+    return res
+
+
+@pytest.mark.parametrize('func,method,omegas', [(pairwisedist.pearson_distance, 'pearson', None),
+                                                (pairwisedist.spearman_distance, 'spearman', None),
+                                                (pairwisedist.ys1_distance, 'spearman', (0.5, 0.25, 0.25)),
+                                                (pairwisedist.yr1_distance, 'pearson', (0.5, 0.25, 0.25))])
+@pytest.mark.parametrize('block_size', [None, 4])
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+def test_nan_policy_omit(func, method, omegas, block_size):
+    rng = np.random.default_rng(42)
+    data = rng.normal(size=(13, 9))
+    data[rng.random(data.shape) < 0.2] = np.nan
+    data[4, 1:] = np.nan
+    data[7, :4] = 3
+    data[7, 5:] = np.nan
+    truth = _nan_omit_reference(data, method, omegas)
+    res = func(data, nan_policy='omit', block_size=block_size)
+    assert np.isclose(res, truth, equal_nan=True).all()
+    assert np.isnan(res[4]).all()
+
+    clean = rng.normal(size=(13, 9))
+    assert np.isclose(func(clean, nan_policy='omit', block_size=block_size), func(clean)).all()
+
+
+@pytest.mark.parametrize('func', [pairwisedist.pearson_distance, pairwisedist.spearman_distance,
+                                  pairwisedist.ys1_distance, pairwisedist.yr1_distance])
+@pytest.mark.parametrize('block_size', [None, 2])
+def test_nan_policy_propagate(func, block_size):
+    data = np.random.default_rng(42).normal(size=(5, 6))
+    data[1, 2] = np.nan
+    res = func(data, block_size=block_size)
+    assert np.isnan(res[1]).all() and np.isnan(res[:, 1]).all()
+    rest = [0, 2, 3, 4]
+    assert np.isclose(res[np.ix_(rest, rest)], func(data[rest])).all()
+    assert np.isnan(func(np.stack([data, data]))[:, 1]).all()
+    assert np.isnan(pairwisedist.cross_distance(data, data[rest], func.__name__[:-len('_distance')])[1]).all()
+
+
+def test_nan_policy_bad_input():
+    with pytest.raises(AssertionError):
+        pairwisedist.pearson_distance(inp, nan_policy='raise')
+    with pytest.raises(AssertionError):
+        pairwisedist._pairwise_distance(inp, 'jackknife', False, nan_policy='omit')
+
+
+@pytest.mark.parametrize('func', [pairwisedist.pearson_distance, pairwisedist.sharpened_cosine_distance])
+@pytest.mark.parametrize('sparse_type', [sparse.csr_matrix, sparse.csc_matrix, sparse.coo_matrix])
+@pytest.mark.parametrize('kwargs', [{}, {'block_size': 4}, {'condensed': True, 'block_size': 3},
+                                    {'dtype': np.float32}])
+def test_sparse_input(func, sparse_type, kwargs):
+    rng = np.random.default_rng(42)
+    data = rng.poisson(0.3, size=(11, 40)).astype(float)
+    data[2] = 0
+    data[5] = 3
+    truth = func(data, **kwargs)
+    res = func(sparse_type(data), **kwargs)
+    assert res.dtype == truth.dtype
+    assert np.allclose(res, truth, equal_nan=True, atol=1e-6)
+    assert np.allclose(func(sparse.csr_matrix(data.T), rowvar=False, **kwargs), truth, equal_nan=True, atol=1e-6)
+
+
+@pytest.mark.parametrize('func', [pairwisedist.pearson_distance, pairwisedist.sharpened_cosine_distance])
+@pytest.mark.parametrize('block_size', [None, 7])
+def test_sparse_input_float32(func, block_size):
+    # large counts with a large mean make the mean correction of the sparse kernel cancel most of the dot product
+    data = np.random.default_rng(42).poisson(200, size=(30, 2000)).astype(float)
+    truth = func(data)
+    res = func(sparse.csr_matrix(data), dtype=np.float32, block_size=block_size)
+    assert res.dtype == np.float32
+    assert np.abs(res - truth).max() < 1e-5
+    assert np.abs(res - func(data, dtype=np.float32)).max() < 1e-5
+
+
+def test_sparse_input_bad_input():
+    with pytest.raises(AssertionError):
+        pairwisedist._pairwise_distance(sparse.csr_matrix(inp), 'spearman', False)
+    with pytest.raises(AssertionError):
+        pairwisedist.pearson_distance(sparse.csr_matrix(inp), nan_policy='omit')
+
+
+@pytest.mark.parametrize('metric,func,kwargs', [('pearson', pairwisedist.pearson_distance, {}),
+                                                ('spearman', pairwisedist.spearman_distance, {}),
+                                                ('ys1', pairwisedist.ys1_distance, {}),
+                                                ('sharpened_cosine', pairwisedist.sharpened_cosine_distance,
+                                                 {'sharpen_exponent': 2})])
+@pytest.mark.parametrize('block_size', [1, 4, 1024])
+@pytest.mark.parametrize('threshold', [0.5, 0.75, 1])
+def test_similarity_graph(metric, func, kwargs, block_size, threshold):
+    rng = np.random.default_rng(42)
+    data = rng.normal(size=(17, 6)) * rng.uniform(0.01, 5, size=(17, 1))
+    data[3] = 1
+    truth = func(data, similarity=True, **kwargs)
+    np.fill_diagonal(truth, 0)
+    truth[~(truth > threshold)] = 0
+    res = pairwisedist.similarity_graph(data, threshold, metric, block_size=block_size, **kwargs)
+    assert sparse.isspmatrix_csr(res)
+    assert res.shape == (17, 17)
+    assert np.all(res.data > threshold)
+    assert np.isclose(res.toarray(), truth).all()
+
+
+def test_similarity_graph_sparse_input():
+    data = np.random.default_rng(42).poisson(0.5, size=(12, 30)).astype(float)
+    for metric in ('pearson', 'sharpened_cosine'):
+        truth = pairwisedist.similarity_graph(data, 0.55, metric, block_size=5)
+        res = pairwisedist.similarity_graph(sparse.csr_matrix(data), 0.55, metric, block_size=5)
+        assert np.isclose(res.toarray(), truth.toarray()).all()
+
+
+def test_similarity_graph_bad_input():
+    with pytest.raises(AssertionError):
+        pairwisedist.similarity_graph(inp, 0.5, 'euclidean')
+    with pytest.raises(AssertionError):
+        pairwisedist.similarity_graph(inp, 0.5, block_size=None)
+
+
+@pytest.mark.parametrize('metric,func,kwargs', [('pearson', pairwisedist.pearson_distance, {}),
+                                                ('jackknife', pairwisedist.jackknife_distance, {}),
+                                                ('ys1', pairwisedist.ys1_distance, {'omega1': 0.2, 'omega2': 0.4,
+                                                                                    'omega3': 0.4}),
+                                                ('sharpened_cosine', pairwisedist.sharpened_cosine_distance,
+                                                 {'sharpen_exponent': 3})])
+@pytest.mark.parametrize('block_size', [3, 1024])
+def test_out_of_core_distance(tmp_path, metric, func, kwargs, block_size):
+    data = np.random.default_rng(42).normal(size=(11, 6))
+    path = tmp_path / 'dist.npy'
+    res = pairwisedist.out_of_core_distance(data, path, metric, block_size=block_size, **kwargs)
+    assert isinstance(res, np.memmap)
+    assert np.isclose(res, func(data, **kwargs)).all()
+    assert np.isclose(np.load(path), func(data, **kwargs)).all()
+
+
+def test_out_of_core_distance_resume(tmp_path):
+    data = np.random.default_rng(42).normal(size=(11, 6))
+    truth = pairwisedist.ys1_distance(data)
+    path = tmp_path / 'dist.npy'
+    manifest = tmp_path / 'dist.npy.manifest'
+    pairwisedist.out_of_core_distance(data, path, 'ys1', block_size=4)
+    assert sorted(os.listdir(manifest / 'done')) == ['0_0', '0_4', '0_8', '4_4', '4_8', '8_8']
+    assert os.listdir(manifest / 'claims') == []
+
+    # simulate a crash: one tile was never finished, and another was claimed by a process that is no longer running
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    out = np.load(path, mmap_mode='r+')
+    out[:4, 4:8] = out[4:8, :4] = 0
+    out[4:8, 8:] = out[8:, 4:8] = 0
+    out[8:, 8:] = -1  # a completed tile, which should not be recomputed
+    out.flush()
+    del out
+    os.remove(manifest / 'done' / '0_4')
+    os.remove(manifest / 'done' / '4_8')
+    (manifest / 'claims' / '4_8').write_text(str(dead.pid))
+
+    res = pairwisedist.out_of_core_distance(data, path, 'ys1', block_size=4)
+    assert np.isclose(res[:8], truth[:8]).all()
+    assert np.isclose(res[8:, :8], truth[8:, :8]).all()
+    assert (res[8:, 8:] == -1).all()
+    assert len(os.listdir(manifest / 'done')) == 6
+
+
+def test_out_of_core_distance_interrupted(tmp_path, monkeypatch):
+    data = np.random.default_rng(42).normal(size=(11, 6))
+    path = tmp_path / 'dist.npy'
+    manifest = tmp_path / 'dist.npy.manifest'
+    compute_tile = pairwisedist._compute_tile
+    calls = []
+
+    def interrupted_compute_tile(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return compute_tile(*args)
+
+    monkeypatch.setattr(pairwisedist, '_compute_tile', interrupted_compute_tile)
+    with pytest.raises(KeyboardInterrupt):
+        pairwisedist.out_of_core_distance(data, path, block_size=4)
+    # the interrupted tile is not marked as completed, and its claim was released
+    assert os.listdir(manifest / 'done') == ['0_0']
+    assert os.listdir(manifest / 'claims') == []
+
+    # a claim left behind by an earlier call in the same process is taken over
+    (manifest / 'claims' / '0_4').write_text(str(os.getpid()))
+    res = pairwisedist.out_of_core_distance(data, path, block_size=4)
+    assert np.isclose(res, pairwisedist.pearson_distance(data)).all()
+    assert len(os.listdir(manifest / 'done')) == 6
+
+
+def test_out_of_core_distance_waits_for_claims(tmp_path, monkeypatch):
+    monkeypatch.setattr(pairwisedist, '_CLAIM_POLL_INTERVAL', 0.05)
+    data = np.random.default_rng(42).normal(size=(11, 6))
+    path = tmp_path / 'dist.npy'
+    claim = tmp_path / 'dist.npy.manifest' / 'claims' / '4_8'
+    pairwisedist.out_of_core_distance(data, path, block_size=4)
+    os.remove(tmp_path / 'dist.npy.manifest' / 'done' / '4_8')
+
+    # the tile is claimed by another process that is still running, and releases its claim without completing it
+    alive = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    try:
+        claim.write_text(str(alive.pid))
+        threading.Timer(0.5, os.remove, args=(claim,)).start()
+        start = time.perf_counter()
+        res = pairwisedist.out_of_core_distance(data, path, block_size=4)
+        assert time.perf_counter() - start >= 0.5
+    finally:
+        alive.kill()
+        alive.wait()
+    assert np.isclose(res, pairwisedist.pearson_distance(data)).all()
+    assert len(os.listdir(tmp_path / 'dist.npy.manifest' / 'done')) == 6
+
+
+def test_out_of_core_distance_n_workers(tmp_path):
+    data = np.random.default_rng(42).normal(size=(13, 6))
+    res = pairwisedist.out_of_core_distance(data, tmp_path / 'dist.npy', 'spearman', block_size=3, n_workers=2)
+    assert np.isclose(res, pairwisedist.spearman_distance(data)).all()
+
+
+def test_out_of_core_distance_bad_input(tmp_path):
+    with pytest.raises(AssertionError):
+        pairwisedist.out_of_core_distance(inp, tmp_path / 'dist.npy', 'euclidean')
+    pairwisedist.out_of_core_distance(inp, tmp_path / 'dist.npy', 'pearson', block_size=2)
+    with pytest.raises(AssertionError):
+        pairwisedist.out_of_core_distance(inp, tmp_path / 'dist.npy', 'spearman', block_size=2)
+    with pytest.raises(AssertionError):
+        pairwisedist.out_of_core_distance(inp, tmp_path / 'dist.npy', 'pearson', block_size=3)
+
+
+@pytest.mark.parametrize('func,kwargs', [(pairwisedist.pearson_distance, {}),
+                                         (pairwisedist.spearman_distance, {}),
+                                         (pairwisedist.jackknife_distance, {}),
+                                         (pairwisedist.ys1_distance, {'omega1': 0.2, 'omega2': 0.4, 'omega3': 0.4}),
+                                         (pairwisedist.yr1_distance, {'nan_policy': 'omit'}),
+                                         (pairwisedist.sharpened_cosine_distance, {'sharpen_exponent': 3}),
+                                         (pairwisedist.pearson_distance, {'similarity': True, 'dtype': np.float32})])
+def test_batch_input(func, kwargs):
+    data = np.random.default_rng(42).normal(size=(5, 9, 6))
+    data[1, 3] = 2
+    truth = np.stack([func(batch, **kwargs) for batch in data])
+    res = func(data, **kwargs)
+    assert res.shape == (5, 9, 9)
+    assert res.dtype == truth.dtype
+    assert np.allclose(res, truth, equal_nan=True, atol=1e-6)
+    assert np.allclose(func(list(data), **kwargs), truth, equal_nan=True, atol=1e-6)
+    assert np.allclose(func(data.swapaxes(1, 2), rowvar=False, **kwargs), truth, equal_nan=True, atol=1e-6)
+
+
+def test_batch_input_out(tmp_path):
+    data = np.random.default_rng(42).normal(size=(3, 7, 5))
+    truth = np.stack([pairwisedist.spearman_distance(batch) for batch in data])
+    res = pairwisedist.spearman_distance(data, out=tmp_path / 'dist.npy')
+    assert isinstance(res, np.memmap)
+    assert np.isclose(np.load(tmp_path / 'dist.npy'), truth).all()
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 16])
+def test_iter_distance_batches(batch_size):
+    data = np.random.default_rng(42).normal(size=(5, 9, 6))
+    truth = pairwisedist.ys1_distance(data, similarity=True)
+    res = np.empty_like(truth)
+    for batches, matrices in pairwisedist.iter_distance_batches(data, 'ys1', batch_size, similarity=True):
+        assert matrices.shape[0] <= batch_size
+        res[batches] = matrices
+    assert np.isclose(res, truth).all()
+
+
+def test_batch_input_bad_input():
+    data = np.random.default_rng(42).normal(size=(5, 9, 6))
+    with pytest.raises(AssertionError):
+        pairwisedist.pearson_distance(data, block_size=2)
+    with pytest.raises(AssertionError):
+        pairwisedist.pearson_distance(data, condensed=True)
+    with pytest.raises(AssertionError):
+        list(pairwisedist.iter_distance_batches(data[0]))
+    with pytest.raises(AssertionError):
+        list(pairwisedist.iter_distance_batches(data, batch_size=0))
+
+
+def test_profiler(monkeypatch):
+    # the NumPy implementation of ys1_distance computes every component as a separate stage
+    monkeypatch.setattr(pairwisedist, '_NUMBA_ENABLED', False)
+    data = np.random.default_rng(42).normal(size=(9, 6))
+    callback_records = []
+    with pairwisedist.Profiler(callback=callback_records.append) as profiler:
+        res = pairwisedist.ys1_distance(data, block_size=4)
+    assert np.isclose(res, pairwisedist.ys1_distance(data)).all()
+    assert profiler.records == callback_records
+    assert all(record.function == 'ys1_distance' for record in profiler.records)
+    summary = profiler.summary()
+    assert summary[('ys1_distance', 'total')]['calls'] == 1
+    assert summary[('ys1_distance', 'rankdata')]['calls'] == 1
+    for stage in ('son_baek_block', 'correlation_star_block', 'slope_concordance_block', 'minmax_match_block',
+                  'similarity_to_distance'):
+        assert summary[('ys1_distance', stage)]['calls'] == 6
+    total = [record for record in profiler.records if record.stage == 'total'][0]
+    assert total.nbytes == res.nbytes
+    assert total.shapes == ((9, 6),)
+    assert total.seconds >= summary[('ys1_distance', 'son_baek_block')]['seconds']
+    assert profiler.to_dicts()[0].keys() == {'function', 'stage', 'seconds', 'nbytes', 'shapes', 'allocated_bytes'}
+    assert all(record.allocated_bytes is None for record in profiler.records)
+
+    # profilers only record while they are active
+    pairwisedist.pearson_distance(data)
+    assert len(profiler.records) == len(callback_records)
+
+
+def test_profiler_generator():
+    data = np.random.default_rng(42).normal(size=(9, 6))
+    with pairwisedist.Profiler() as profiler:
+        list(pairwisedist.iter_distance_blocks(data, 'jackknife', block_size=5))
+    assert {record.function for record in profiler.records} == {'iter_distance_blocks'}
+    assert profiler.summary()[('iter_distance_blocks', 'jackknife_block')]['calls'] == 4
+    assert profiler.summary()[('iter_distance_blocks', 'total')]['calls'] == 1
+
+    omegas = [(0.5, 0.25, 0.25), (0.2, 0.4, 0.4)]
+    sleep_seconds = 0.2
+    with pairwisedist.Profiler() as profiler:
+        start = time.perf_counter()
+        sweep = pairwisedist.ys1_distance_sweep(data, omegas)
+        assert profiler.records == []
+        for _ in sweep:
+            time.sleep(sleep_seconds)
+        elapsed = time.perf_counter() - start
+    summary = profiler.summary()
+    # the total is recorded once the sweep is exhausted, and excludes the time the caller spent between matrices
+    assert summary[('ys1_distance_sweep', 'total')]['calls'] == 1
+    assert summary[('ys1_distance_sweep', 'total')]['seconds'] >= summary[('ys1_distance_sweep', 'rankdata')]['seconds']
+    assert summary[('ys1_distance_sweep', 'total')]['seconds'] <= elapsed - len(omegas) * sleep_seconds
+    assert {record.function for record in profiler.records} == {'ys1_distance_sweep'}
+
+
+def test_profiler_threads():
+    data = np.random.default_rng(42).normal(size=(9, 6))
+    with pairwisedist.Profiler() as profiler:
+        pairwisedist.pearson_distance(data, block_size=2, n_jobs=4)
+    assert {record.function for record in profiler.records} == {'pearson_distance'}
+    assert profiler.summary()[('pearson_distance', 'correlation_star_block')]['calls'] == 15
+
+    # the function label of one thread does not leak into other threads
+    with pairwisedist.Profiler() as profiler:
+        thread = threading.Thread(target=pairwisedist._sharpened_cosine_rows, args=(data,))
+        with pairwisedist._function_label('pearson_distance'):
+            thread.start()
+            thread.join()
+    assert [record.function for record in profiler.records] == [None]
+
+
+@pytest.mark.parametrize('reset_peak', [True, False])
+def test_profiler_allocations(monkeypatch, reset_peak):
+    if not reset_peak:
+        # tracemalloc.reset_peak() is not available on Python < 3.9
+        monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    data = np.random.default_rng(42).normal(size=(300, 6))
+    with pairwisedist.Profiler(trace_allocations=True) as profiler:
+        res = pairwisedist.jackknife_distance(data)
+    assert not tracemalloc.is_tracing()
+    summary = profiler.summary()
+    # the jackknife kernel allocates several tile-sized arrays in addition to its output
+    assert summary[('jackknife_distance', 'jackknife_pearson_block')]['allocated_bytes'] >= 3 * res.nbytes
+    assert summary[('jackknife_distance', 'total')]['allocated_bytes'] >= \
+        summary[('jackknife_distance', 'jackknife_pearson_block')]['allocated_bytes']
+    assert summary[('jackknife_distance', 'total')]['allocated_bytes'] < 10 * res.nbytes
+
+
+@pytest.mark.parametrize('func', [pairwisedist.ys1_distance, pairwisedist.yr1_distance])
+@pytest.mark.parametrize('kwargs', [{}, {'omega1': 0.2, 'omega2': 0.4, 'omega3': 0.4}, {'block_size': 4},
+                                    {'block_size': 3, 'n_jobs': 4}, {'dtype': np.float32}])
+def test_numba_fused_kernel(monkeypatch, func, kwargs):
+    pytest.importorskip('numba')
+    data = np.random.default_rng(42).normal(size=(11, 7))
+    data[2] = 1
+    data[5, 3:] = data[5, 2]
+    monkeypatch.setattr(pairwisedist, '_NUMBA_ENABLED', False)
+    truth = func(data, **kwargs)
+    monkeypatch.setattr(pairwisedist, '_NUMBA_ENABLED', True)
+    with pairwisedist.Profiler() as profiler:
+        res = func(data, **kwargs)
+    assert res.dtype == truth.dtype
+    assert np.allclose(res, truth, equal_nan=True, atol=1e-6)
+    assert any(record.stage == 'son_baek_block_fused' for record in profiler.records)
+
+
+@pytest.mark.parametrize('func', [pairwisedist.pearson_distance, pairwisedist.spearman_distance])
+def test_sketch_accuracy(func):
+    rng = np.random.default_rng(42)
+    base = rng.normal(size=(15, 20000))
+    data = np.vstack([base, base[:10] + rng.normal(size=(10, 20000))])
+    truth = func(data)
+    upper = np.triu_indices(25, 1)
+    errors = []
+    for sketch_size in (256, 4096):
+        res = func(data, sketch_size=sketch_size, seed=0)
+        assert res.shape == truth.shape
+        assert np.all((res >= 0) & (res <= 1))
+        error = (res - truth)[upper]
+        # the standard deviation of the error in distance is about 0.5 * sqrt((1 + r^2) / sketch_size)
+        assert np.std(error) < 0.5 * np.sqrt(2 / sketch_size) * 1.5
+        errors.append(np.abs(error).mean())
+    assert errors[1] < errors[0]
+
+
+def test_sketch_seed():
+    data = np.random.default_rng(42).normal(size=(12, 500))
+    data[3] = 2
+    res = pairwisedist.pearson_distance(data, sketch_size=64, seed=1)
+    assert np.array_equal(res, pairwisedist.pearson_distance(data, sketch_size=64, seed=1), equal_nan=True)
+    assert not np.allclose(res, pairwisedist.pearson_distance(data, sketch_size=64, seed=2), equal_nan=True)
+    assert np.isnan(res[3]).all()
+    assert np.allclose(pairwisedist.pearson_distance(data, sketch_size=64, seed=1, block_size=5), res, equal_nan=True)
+    assert np.allclose(pairwisedist.pearson_distance(sparse.csr_matrix(data), sketch_size=64, seed=1), res,
+                       equal_nan=True)
+    assert np.allclose(pairwisedist.pearson_distance(data, sketch_size=64, seed=1, dtype=np.float32), res,
+                       equal_nan=True, atol=1e-6)
+
+
+def test_sketch_bad_input():
+    with pytest.raises(AssertionError):
+        pairwisedist.pearson_distance(inp, sketch_size=0)
+    with pytest.raises(AssertionError):
+        pairwisedist.spearman_distance(inp, sketch_size=4, nan_policy='omit')
+    with pytest.raises(AssertionError):
+        pairwisedist.spearman_distance(sparse.csr_matrix(inp), sketch_size=4)
+
+
+@pytest.mark.parametrize('metric,func,kwargs', [('pearson', pairwisedist.pearson_distance, {}),
+                                                ('jackknife', pairwisedist.jackknife_distance, {}),
+                                                ('yr1', pairwisedist.yr1_distance, {'omega1': 0.2, 'omega2': 0.4,
+                                                                                    'omega3': 0.4}),
+                                                ('sharpened_cosine', pairwisedist.sharpened_cosine_distance,
+                                                 {'sharpen_exponent': 3})])
+@pytest.mark.parametrize('memory_limit,strategy', [(None, 'dense'), (500000, 'blocked')])
+def test_pairwise_distance(metric, func, kwargs, memory_limit, strategy):
+    data = np.random.default_rng(42).normal(size=(200, 6))
+    plan = pairwisedist.plan_distance(data, metric, memory_limit=memory_limit)
+    assert plan.strategy == strategy
+    assert plan.output_bytes == 200 * 200 * 8
+    assert plan.estimated_peak_bytes > plan.output_bytes
+    if memory_limit is not None:
+        assert plan.estimated_peak_bytes <= memory_limit
+        assert plan.block_size < 200
+    res = pairwisedist.pairwise_distance(data, metric, memory_limit=memory_limit, **kwargs)
+    assert np.isclose(res, func(data, **kwargs)).all()
+    res = pairwisedist.pairwise_distance(data.T, metric, rowvar=False, plan=plan, similarity=True, **kwargs)
+    assert np.isclose(res, func(data, similarity=True, **kwargs)).all()
+
+
+def test_pairwise_distance_output_forms(tmp_path):
+    data = np.random.default_rng(42).normal(size=(40, 6))
+    truth = pairwisedist.pearson_distance(data)
+    plan = pairwisedist.plan_distance(data, condensed=True)
+    assert plan.strategy == 'blocked'
+    assert plan.output_bytes == 40 * 39 // 2 * 8
+    assert np.isclose(pairwisedist.pairwise_distance(data, condensed=True), truth[np.triu_indices(40, 1)]).all()
+
+    path = tmp_path / 'dist.npy'
+    assert pairwisedist.plan_distance(data, out=path).strategy == 'out_of_core'
+    res = pairwisedist.pairwise_distance(data, out=path, n_jobs=1)
+    assert isinstance(res, np.memmap)
+    assert np.isclose(res, truth).all()
+
+    # the output itself does not fit in the memory budget, so it can only be computed into a file
+    plan = pairwisedist.plan_distance(data, memory_limit=1000)
+    assert plan.strategy == 'out_of_core'
+    with pytest.raises(MemoryError):
+        pairwisedist.pairwise_distance(data, memory_limit=1000)
+    res = pairwisedist.pairwise_distance(data, out=tmp_path / 'dist2.npy', memory_limit=1000)
+    assert np.isclose(res, truth).all()
+
+    # an existing output array (or memory-mapped array) costs no memory, so it is filled in the smallest tiles
+    for out in (np.empty((40, 40)), np.lib.format.open_memmap(tmp_path / 'dist3.npy', 'w+', float, (40, 40))):
+        plan = pairwisedist.plan_distance(data, out=out, memory_limit=1000)
+        assert plan.strategy == 'blocked'
+        assert plan.block_size == 40
+        res = pairwisedist.pairwise_distance(data, out=out, memory_limit=1000)
+        assert res is out
+        assert np.isclose(out, truth).all()
+
+    stack = np.stack([data, data[::-1]])
+    assert pairwisedist.plan_distance(stack).strategy == 'batched'
+    assert np.isclose(pairwisedist.pairwise_distance(stack), pairwisedist.pearson_distance(stack)).all()
+    assert np.isclose(pairwisedist.pairwise_distance(sparse.csr_matrix(data), dtype=np.float32), truth,
+                      atol=1e-5).all()
+
+
+def test_register_metric(monkeypatch):
+    monkeypatch.setattr(pairwisedist, '_METRICS', dict(pairwisedist._METRICS))
+
+    def prepare(data, dtype):
+        return (np.asarray(data, dtype=dtype),)
+
+    def kernel(prepared_a, prepared_b, scale=1.0):
+        squared_distances = np.sum((prepared_a[0][..., :, None, :] - prepared_b[0][..., None, :, :]) ** 2, axis=-1)
+        return np.exp(-squared_distances / scale)
+
+    pairwisedist.register_metric('gaussian', prepare, kernel, tile_temporaries=3)
+    data = np.random.default_rng(42).normal(size=(100, 4))
+    truth = 1 - np.exp(-np.sum((data[:, None] - data[None]) ** 2, axis=-1) / 2)
+    assert np.isclose(pairwisedist.pairwise_distance(data, 'gaussian', scale=2), truth).all()
+    assert pairwisedist.plan_distance(data, 'gaussian', memory_limit=200000).strategy == 'blocked'
+    assert np.isclose(pairwisedist.pairwise_distance(data, 'gaussian', memory_limit=200000, scale=2), truth).all()
+    assert np.isclose(pairwisedist.pairwise_topk(data, 3, 'gaussian', block_size=4, scale=2)[1],
+                      np.sort(truth, axis=1)[:, 1:4]).all()
+    with pytest.raises(AssertionError):
+        pairwisedist.register_metric('gaussian', prepare, kernel)
+    pairwisedist.register_metric('gaussian', prepare, kernel, overwrite=True)
+
+
+def test_pairwise_distance_bad_input():
+    with pytest.raises(AssertionError):
+        pairwisedist.pairwise_distance(inp, 'euclidean')
+    with pytest.raises(AssertionError):
+        pairwisedist.plan_distance(inp, memory_limit=0)
+    with pytest.raises(AssertionError):
+        pairwisedist.pairwise_distance(inp, plan='dense')
+    with pytest.raises(AssertionError):
+        pairwisedist.register_metric('pearson', pairwisedist._sparse_rows, pairwisedist._correlation_star_block)